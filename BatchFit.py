@@ -0,0 +1,279 @@
+# encoding = utf-8
+''' Headless batch fit of spectra files, built on sflib.
+
+A job file has one fit job per line, as a JSON object:
+    {"file": "spec01.csv", "ftype": 0, "der": 2, "peak": 1,
+     "init": [mu, sigma, A], "deg": 0}
+file -- spectrum file. Relative to the directory of the job file
+ftype -- 0 Gaussian, 1 Lorentzian
+der -- order of derivative (up to 4)
+peak -- number of peaks. 0 fits the baseline only
+init -- initial guess, (mu, sigma|gamma, A) of each peak.
+        Optional, guessed by sflib.guess_init if missing
+deg -- degree of the polynomial baseline. Default 0
+boxwin, rescale, smooth_edge -- optional, same as in PySpec. Default 1, 1, false
+
+Jobs run in a pool of worker processes. For each successful fit, the fit
+(Fit<name>.csv) and the log (Fit<name>.log) are written to the output
+directory, as PySpec does. The job number is appended to the name if
+several jobs fit files of the same name. All jobs are listed in summary.csv, one row per
+peak. Failed jobs are written to review.jsonl, which is a job file itself:
+it can be opened in PySpec (Open Review Queue) or run again. A fit that
+converges to implausible parameters (see plausible_fit) counts as failed.
+
+Run from the command line:
+    python BatchFit.py jobs.jsonl -o fit_output
+'''
+
+import os
+import csv
+import json
+import argparse
+import concurrent.futures
+import numpy as np
+import sflib
+
+
+SUMMARY_FILE = 'summary.csv'
+REVIEW_FILE = 'review.jsonl'
+
+SUMMARY_HEADER = ['file', 'stat', 'message', 'noise', 'peak', 'mu', 'width', 'A',
+                  'mu_err', 'width_err', 'A_err']
+
+JOB_DEFAULT = {'deg': 0, 'boxwin': 1, 'rescale': 1, 'smooth_edge': False}
+
+
+def read_jobs(filename):
+    ''' Read a job file. Relative spectrum file names are resolved against
+    the directory of the job file.
+
+    Arguments:
+    filename -- job file name
+
+    Returns: list of job dict
+    '''
+    job_dir = os.path.dirname(os.path.abspath(filename))
+    jobs = []
+    with open(filename, 'r') as f:
+        for line in f:
+            if line.strip():
+                job = dict(JOB_DEFAULT)
+                job.update(json.loads(line))
+                job['file'] = os.path.join(job_dir, job['file'])
+                jobs.append(job)
+            else:
+                pass
+    return jobs
+
+
+def write_jobs(filename, jobs):
+    ''' Write jobs to a job file '''
+    with open(filename, 'w') as f:
+        for job in jobs:
+            f.write(json.dumps(job) + '\n')
+    return None
+
+
+def fit_job(job, out_name):
+    ''' Fit one spectrum file and save the fit and the log.
+
+    Arguments:
+    job -- job dict
+    out_name -- output file name without extension
+
+    Returns: result dict
+    stat -- fit status, see sflib.FIT_STAT
+    noise -- noise level
+    popt -- optimized parameter vector
+    uncertainty -- parameter uncertainty
+    '''
+    result = {'stat': 5, 'noise': 0, 'popt': [], 'uncertainty': []}
+
+    try:
+        ftype = int(job['ftype'])
+        der = int(job['der'])
+        peak = int(job['peak'])
+        init = job.get('init')
+        init = None if init is None else np.array(init, dtype=float)
+        deg = abs(int(job['deg']))
+        boxwin = abs(int(job['boxwin']))
+        rescale = abs(float(job['rescale']))
+    except (KeyError, TypeError, ValueError):
+        return result
+    if ftype in (0, 1) and 0 <= der <= 4 and peak >= 0 and (init is None or len(init) == 3*peak):
+        pass
+    else:
+        return result
+
+    xdata, ydata, stat = sflib.read_file(job['file'], boxwin, rescale)
+    if stat:
+        result['stat'] = stat
+        return result
+    else:
+        pass
+
+    f = sflib.Function(ftype, der, peak)
+    if init is None:
+        init = sflib.guess_init(xdata, ydata, ftype, der, peak)
+    else:
+        pass
+    if peak:
+        popt, uncertainty, noise, ppoly, stat = sflib.fit_spectrum_vp(f,
+            xdata, ydata, init, deg, job['smooth_edge'])
+    else:
+        popt, uncertainty, noise, ppoly, stat = sflib.fit_baseline(xdata, ydata, deg)
+    if stat == 0 and peak and not plausible_fit(xdata, popt, uncertainty[:3*peak]):
+        stat = 1
+    else:
+        pass
+    result['stat'] = stat
+    if stat:
+        return result
+    else:
+        pass
+
+    if peak:
+        fit = f.get_func()(xdata, *popt)
+    else:
+        fit = np.zeros_like(ydata)
+    baseline = np.polyval(ppoly, xdata - np.median(xdata))
+    data_table = np.column_stack((xdata, ydata, fit, baseline))
+
+    par_name = ['mu', 'sigma', 'A'] if not ftype else ['mu', 'gamma', 'A']
+    sflib.save_fit(out_name + '.csv', data_table, popt, ftype, der, peak)
+    sflib.save_log(out_name + '.log', popt, uncertainty, ppoly, ftype, der,
+                   peak, par_name)
+
+    result['noise'] = noise
+    if peak:
+        result['popt'] = list(popt)
+        result['uncertainty'] = list(uncertainty[:3*peak])
+    else:
+        pass
+    return result
+
+
+def plausible_fit(xdata, popt, uncertainty):
+    ''' Check that the fitted peaks make physical sense: all parameters and
+    uncertainties are finite, the widths are positive and less than half
+    the data span (a wider line cannot be told from the baseline), and the
+    uncertainty of A and of the width is less than the value.
+    The uncertainty of mu is compared to the width, because mu is a
+    position and its value carries no scale.
+
+    Arguments:
+    xdata -- x data vector
+    popt -- optimized parameter vector, (mu, width, A) of each peak
+    uncertainty -- parameter uncertainty, same length as popt
+
+    Returns: bool
+    '''
+    popt = np.asarray(popt, dtype=float)
+    uncertainty = np.asarray(uncertainty, dtype=float)
+    if not (np.all(np.isfinite(popt)) and np.all(np.isfinite(uncertainty))):
+        return False
+    else:
+        pass
+    width = np.abs(popt[1::3])
+    amp = np.abs(popt[2::3])
+    span = abs(xdata[-1] - xdata[0])
+    return bool(np.all(width > 0) and np.all(width < span/2) and
+                np.all(uncertainty[0::3] < width) and
+                np.all(uncertainty[1::3] < width) and
+                np.all(uncertainty[2::3] < amp))
+
+
+def _out_names(jobs, output_dir):
+    ''' Output file names of the jobs, Fit<name>. The job number is
+    appended if several jobs fit files of the same name '''
+    names = ['Fit' + os.path.splitext(os.path.basename(job['file']))[0] for job in jobs]
+    out_names = []
+    for i, name in enumerate(names):
+        if names.count(name) > 1:
+            name += '_{:d}'.format(i+1)
+        else:
+            pass
+        out_names.append(os.path.join(output_dir, name))
+    return out_names
+
+
+def _summary_rows(job, result):
+    ''' Rows of the summary table for one job, one row per peak '''
+    head = [job['file'], result['stat'], sflib.FIT_STAT[result['stat']],
+            '{:.6g}'.format(result['noise'])]
+    if result['stat'] or not result['popt']:
+        return [head]
+    else:
+        rows = []
+        for k in range(len(result['popt'])//3):
+            par = result['popt'][3*k:3*k+3] + result['uncertainty'][3*k:3*k+3]
+            rows.append(head + [k+1] + ['{:.8g}'.format(v) for v in par])
+        return rows
+
+
+def batch_fit(jobs, output_dir, workers=None, progress=None):
+    ''' Run fit jobs in a pool of worker processes.
+    Writes the summary table and the review queue of failed jobs
+    to output_dir.
+
+    Arguments:
+    jobs -- list of job dict
+    output_dir -- output directory. Created if it does not exist
+
+    Keyword Arguments:
+    workers -- number of worker processes. Default is the number of CPUs
+    progress -- function(n_done, n_total) called after each job
+
+    Returns: list of result dict, in the order of jobs
+    '''
+    os.makedirs(output_dir, exist_ok=True)
+    results = [None] * len(jobs)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fit_job, job, out_name): i for i, (job, out_name)
+                   in enumerate(zip(jobs, _out_names(jobs, output_dir)))}
+        for n, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+            try:
+                results[futures[future]] = future.result()
+            except Exception:
+                # any error in a worker fails the job, not the batch
+                results[futures[future]] = {'stat': 1, 'noise': 0, 'popt': [], 'uncertainty': []}
+            if progress:
+                progress(n, len(jobs))
+            else:
+                pass
+
+    with open(os.path.join(output_dir, SUMMARY_FILE), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(SUMMARY_HEADER)
+        for job, result in zip(jobs, results):
+            writer.writerows(_summary_rows(job, result))
+
+    review = []
+    for job, result in zip(jobs, results):
+        if result['stat']:
+            job = dict(job)
+            job['stat'] = result['stat']
+            job['message'] = sflib.FIT_STAT[result['stat']]
+            review.append(job)
+        else:
+            pass
+    write_jobs(os.path.join(output_dir, REVIEW_FILE), review)
+
+    return results
+
+
+# ------ run script ------
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Fit spectra files in batch')
+    parser.add_argument('jobs', help='Job file name, one JSON fit job per line')
+    parser.add_argument('-o', '--out', default='fit_output', help='Output directory. Default: fit_output')
+    parser.add_argument('-workers', type=int, help='Number of worker processes. Default: number of CPUs')
+    args = parser.parse_args()
+
+    jobs = read_jobs(args.jobs)
+    results = batch_fit(jobs, args.out, workers=args.workers)
+    n_failed = sum(1 for result in results if result['stat'])
+    print('{:d} jobs fitted, {:d} failed. Failed jobs are in {:s}'.format(
+          len(jobs) - n_failed, n_failed, os.path.join(args.out, REVIEW_FILE)))
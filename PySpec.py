@@ -12,7 +12,7 @@
 
   Package Requirments:
     > numpy 1.8+
-    > scipy 0.16+
+    > scipy 0.18+
     > PyQt5
     > matplotlib
 
@@ -34,6 +34,7 @@ from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
 from matplotlib.backends.backend_qt5agg import NavigationToolbar2QT as NavigationToolbar
 # custom module
 import sflib
+import BatchFit
 
 
 class FitParameter:
@@ -65,12 +66,7 @@ class FitStatus:
     def __init__(self):
         self.stat = 2
         self.input_valid = True
-        self.stat_dict = {0:'Fit successful',
-                          1:'Fit failed',
-                          2:'File not found',
-                          3:'Unsupported file format',
-                          4:'Baseline removal failed',
-                          5:'Input Invalid'}
+        self.stat_dict = sflib.FIT_STAT
         self.file_idx = 0
 
     def print_stat(self):
@@ -95,6 +91,10 @@ class FitMainGui(QtWidgets.QMainWindow):
         # add aborted and successful file list
         self.list_aborted_file = []
         self.list_success_file = []
+        # review queue of failed batch fit jobs
+        self.review_file = ''
+        self.review_jobs = []
+        self.review_done = set()
 
         # add menubar
         openAction = QtWidgets.QAction('Open', self)
@@ -104,6 +104,10 @@ class FitMainGui(QtWidgets.QMainWindow):
         self.menu = self.menuBar()
         self.menu.setNativeMenuBar(False)
         self.menu.addAction(openAction)
+        reviewAction = QtWidgets.QAction('Open Review Queue', self)
+        reviewAction.setStatusTip('Open failed fits of a batch fit job')
+        reviewAction.triggered.connect(self.open_review)
+        self.menu.addAction(reviewAction)
 
         # add status bar
         self.statusbar = self.statusBar()
@@ -198,6 +202,12 @@ class FitMainGui(QtWidgets.QMainWindow):
 
         self.layout_main.addLayout(self.layout_setting, 2, 3)
 
+        # add auto guess button
+        btn_guess = QtWidgets.QPushButton('Auto Guess', self)
+        btn_guess.setStatusTip('Guess initial parameters from the spectrum')
+        self.layout_setting.addWidget(btn_guess, 9, 0, 1, 2)
+        btn_guess.clicked.connect(self.auto_guess)
+
         # add fit & Quit button
         btn_fit = QtWidgets.QPushButton('Fit Spectrum', self)
         btn_quit = QtWidgets.QPushButton('Quit', self)
@@ -260,6 +270,26 @@ class FitMainGui(QtWidgets.QMainWindow):
         else:
             self.fit_stat.stat = 5
 
+    def auto_guess(self):
+        # guess initial parameters of all peaks from the loaded spectrum
+        if self.fit_par.peak:
+            xdata, ydata = self.load_data()
+        else:
+            return None
+        if xdata is None:
+            return None
+        else:
+            init = sflib.guess_init(xdata, ydata, self.fit_par.ftype,
+                                    self.fit_par.der, self.fit_par.peak)
+            self.guess_par(init)
+            # peaks are already picked, further clicks ask for a reset
+            self.click_counter = self.fit_par.peak
+
+    def guess_par(self, init):
+        # fill in the initial guess boxes
+        for i, par in enumerate(init[:len(self.edit_par)]):
+            self.edit_par[i].setText('{:.8g}'.format(par))
+
     # --------- fit routine ---------
 
     def fit_routine(self):
@@ -304,7 +334,7 @@ class FitMainGui(QtWidgets.QMainWindow):
                 f = self.fit_par.get_function()
                 # re-load data with boxcar win and rescale
                 xdata, ydata = self.load_data()
-                popt, uncertainty, noise, ppoly, self.fit_stat.stat = sflib.fit_spectrum(f,
+                popt, uncertainty, noise, ppoly, self.fit_stat.stat = sflib.fit_spectrum_vp(f,
                 xdata, ydata, self.fit_par.par, self.fit_par.deg, self.fit_par.smooth_edge)
             else:    # if no peak, fit baseline
                 xdata, ydata = self.load_data()
@@ -390,6 +420,8 @@ class FitMainGui(QtWidgets.QMainWindow):
             self.current_dir = self.list_dir[0]
             self.current_file = self.list_file[0]
             self.fit_stat.file_idx = 0
+            # leave the review queue
+            self.review_jobs = []
             # update label
             self.label_current_file.setText(self.current_file)
             # launch fit routine
@@ -397,6 +429,49 @@ class FitMainGui(QtWidgets.QMainWindow):
         else:
             self.fit_stat.stat = 2
 
+    def open_review(self):
+        # open the review queue of a batch fit job
+        filename = QtWidgets.QFileDialog.getOpenFileName(self,
+                   'Open Review Queue', self.current_dir,
+                   'Review queue ({:s})'.format(BatchFit.REVIEW_FILE))[0]
+        if filename:
+            jobs = BatchFit.read_jobs(filename)
+        else:
+            return None
+        if jobs:
+            self.review_file = filename
+            self.review_jobs = jobs
+            self.review_done = set()
+            self.list_dir, self.list_file = sflib.separate_dir([job['file'] for job in jobs])
+            self.current_dir = self.list_dir[0]
+            self.current_file = self.list_file[0]
+            self.fit_stat.file_idx = 0
+            self.label_current_file.setText(self.current_file)
+            self.load_job()
+            self.load_data()
+        else:
+            QtWidgets.QMessageBox.information(self, 'Empty Queue',
+                'No failed fit to review.', QtWidgets.QMessageBox.Ok)
+
+    def load_job(self):
+        # fill in fit options of the current review job
+        job = self.review_jobs[self.fit_stat.file_idx]
+        self.combo_ftype.setCurrentIndex(job['ftype'])
+        self.combo_der.setCurrentIndex(job['der'])
+        self.edit_num_peak.setText(str(job['peak']))
+        self.set_par_layout()
+        if job.get('init'):
+            self.guess_par(job['init'])
+        else:
+            pass
+        self.edit_deg.setText(str(job['deg']))
+        self.check_boxcar.setChecked(job['boxwin'] > 1)
+        self.edit_boxcar.setText(str(job['boxwin']))
+        self.check_rescale.setChecked(job['rescale'] != 1)
+        self.edit_rescale.setText(str(job['rescale']))
+        self.fit_par.smooth_edge = job['smooth_edge']
+        self.statusbar.showMessage('Batch fit: {:s}'.format(job.get('message', '')))
+
     def pass_file(self):
         try:
             self.list_aborted_file.append('/'.join([self.current_dir, self.current_file]))
@@ -419,6 +494,13 @@ class FitMainGui(QtWidgets.QMainWindow):
                        self.fit_par.ftype, self.fit_par.der,
                        self.fit_par.peak, self.fit_par.par_name)
         self.list_success_file.append('/'.join([self.current_dir, self.current_file]))
+        if self.review_jobs:
+            # remove the job from the review queue
+            self.review_done.add(self.fit_stat.file_idx)
+            BatchFit.write_jobs(self.review_file, [job for i, job in
+                enumerate(self.review_jobs) if i not in self.review_done])
+        else:
+            pass
 
     def next_file(self):
         # refresh current file index, fit status and click counter
@@ -431,6 +513,10 @@ class FitMainGui(QtWidgets.QMainWindow):
             self.current_dir = self.list_dir[self.fit_stat.file_idx]
             # update label text
             self.label_current_file.setText(self.current_file)
+            if self.review_jobs:
+                self.load_job()
+            else:
+                pass
             # repeat fit routine
             self.load_data()
         except (IndexError, AttributeError):
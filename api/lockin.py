@@ -42,6 +42,9 @@ SAMPLE_RATE_LIST = ['1/16 Hz', '1/8 Hz', '1/4 Hz', '1/2 Hz', '1 Hz',
                     '2 Hz', '4 Hz', '8 Hz', '16 Hz', '32 Hz', '64 Hz',
                     '128 Hz', '256 Hz', '512 Hz', 'Trigger']
 
+# LOCKIN DATA BUFFER SIZE (POINTS PER CHANNEL)
+BUFFER_SIZE = 16383
+
 
 def init_lia(liaHandle):
     ''' Initiate the lockin with default settings.
@@ -390,6 +393,21 @@ def read_lp_slope(liaHandle):
         return 0
 
 
+def set_lp_slope(liaHandle, slope_index):
+    ''' Set low pass filter slope.
+        Arguments
+            liaHandle: pyvisa.resources.Resource, Lockin handle
+            slope_index: int, index in LPSLOPE_LIST
+        Returns visaCode
+    '''
+
+    try:
+        num, vcode = liaHandle.write('OFSL{:d}'.format(slope_index))
+        return vcode
+    except:
+        return 'Lockin set lp slope: IOError'
+
+
 def read_disp(liaHandle):
     ''' Read display parameter
         Returns
@@ -475,3 +493,130 @@ def read_sample_rate(liaHandle):
         return int(text.strip())
     except:
         return 0
+
+
+def set_sample_rate(liaHandle, srate_index):
+    ''' Set the data sample rate.
+        Arguments
+            liaHandle: pyvisa.resources.Resource, Lockin handle
+            srate_index: int, index in SAMPLE_RATE_LIST.
+                         The last index (14) is the trigger mode
+        Returns visaCode
+    '''
+
+    try:
+        num, vcode = liaHandle.write('SRAT{:d}'.format(srate_index))
+        return vcode
+    except:
+        return 'Lockin set sample rate: IOError'
+
+
+def init_buffer(liaHandle, srate_index=14):
+    ''' Prepare the data buffer for a new acquisition:
+        reset the buffer, set the sample rate (default: trigger mode),
+        1-shot buffer mode, and disable trigger start.
+        Returns visaCode
+    '''
+
+    try:
+        num, vcode = liaHandle.write('REST;SRAT{:d};SEND0;TSTR0'.format(srate_index))
+        return vcode
+    except:
+        return 'Lockin init buffer: IOError'
+
+
+def start_buffer(liaHandle):
+    ''' Start or resume data storage.
+        Returns visaCode
+    '''
+
+    try:
+        num, vcode = liaHandle.write('STRT')
+        return vcode
+    except:
+        return 'Lockin start buffer: IOError'
+
+
+def pause_buffer(liaHandle):
+    ''' Pause data storage.
+        Returns visaCode
+    '''
+
+    try:
+        num, vcode = liaHandle.write('PAUS')
+        return vcode
+    except:
+        return 'Lockin pause buffer: IOError'
+
+
+def reset_buffer(liaHandle):
+    ''' Reset the data buffer. All stored data are lost.
+        Returns visaCode
+    '''
+
+    try:
+        num, vcode = liaHandle.write('REST')
+        return vcode
+    except:
+        return 'Lockin reset buffer: IOError'
+
+
+def trigger(liaHandle):
+    ''' Send a software trigger. In trigger mode (SRAT14),
+        each trigger stores one data point in the buffer.
+        Returns visaCode
+    '''
+
+    try:
+        num, vcode = liaHandle.write('TRIG')
+        return vcode
+    except:
+        return 'Lockin trigger: IOError'
+
+
+def read_buffer_len(liaHandle):
+    ''' Read the number of points stored in the buffer.
+        Returns npts: int
+    '''
+
+    try:
+        text = liaHandle.query('SPTS?')
+        return int(text.strip())
+    except:
+        return 0
+
+
+def _decode_trcl(raw):
+    ''' Decode the non-normalized TRCL binary format.
+        Each point is a 16-bit signed mantissa followed by a 16-bit exponent,
+        both LSB first. value = mantissa * 2**(exp - 124)
+    '''
+
+    a = np.frombuffer(raw, dtype='<i2').reshape(-1, 2)
+    return np.ldexp(a[:, 0].astype(float), a[:, 1].astype(int) - 124)
+
+
+def read_buffer(liaHandle, npts, start=0, channel=1, fmt='TRCB'):
+    ''' Read stored data points in one binary transfer.
+        Arguments
+            liaHandle: pyvisa.resources.Resource, Lockin handle
+            npts: int, number of points to read
+            start: int, index of the first point in the buffer
+            channel: int, 1 (CH1 display) or 2 (CH2 display)
+            fmt: str, 'TRCB' (IEEE float) or 'TRCL' (non-normalized float)
+        Returns
+            data: np.array of float. Shorter than npts if the transfer fails
+    '''
+
+    try:
+        liaHandle.write('{:s}?{:d},{:d},{:d}'.format(fmt, channel, start, npts))
+        raw = liaHandle.read_raw()
+    except:
+        return np.zeros(0)
+
+    # each point is 4 bytes. Drop incomplete tail bytes
+    raw = raw[:min(npts, len(raw)//4)*4]
+    if fmt == 'TRCL':
+        return _decode_trcl(raw)
+    else:
+        return np.frombuffer(raw, dtype='<f4').astype(float)
@@ -3,6 +3,12 @@ import pyvisa
 
 MOD_MODE_LIST = ['NONE', 'AM', 'FM']
 
+# SWEEP POINT TRIGGER SOURCE LIST
+LIST_TRIG_SRC_LIST = ['IMM', 'BUS', 'EXT']
+
+# MAXIMUM NUMBER OF POINTS IN THE FREQUENCY LIST
+LIST_MAX_PTS = 1601
+
 
 def ramp_up(start, stop):
     ''' A integer list generator. start < stop '''
@@ -134,6 +140,60 @@ def set_syn_freq(synHandle, freq):
         return 'Synthesizer set syn freq: IOError'
 
 
+def set_list_sweep(synHandle, freq_list, dwell, trig_src='IMM'):
+    ''' Program a frequency sweep over freq_list.
+        The list type is used if the list fits in the list memory.
+        Otherwise a uniform step sweep from freq_list[0] to freq_list[-1]
+        is programmed, which requires freq_list to be equally spaced.
+        The synthesizer sends a pulse to TRIG OUT at each sweep point.
+        Arguments
+            synHandle: pyvisa.resources.Resource, synthesizer handle
+            freq_list: synthesizer frequencies (Hz), np.array
+            dwell: dwell time of each point (s), float
+            trig_src: str, point trigger source in LIST_TRIG_SRC_LIST.
+                      'IMM' advances the sweep when the dwell time is over
+        Returns visaCode
+    '''
+
+    if len(freq_list) <= LIST_MAX_PTS:
+        freq_cmd = ':LIST:TYPE LIST; :LIST:FREQ ' + ','.join(
+                   '{:.3f}'.format(f) for f in freq_list)
+    else:
+        freq_cmd = ':LIST:TYPE STEP; :FREQ:STAR {:.3f}HZ; :FREQ:STOP {:.3f}HZ; :SWE:POIN {:d}'.format(
+                   freq_list[0], freq_list[-1], len(freq_list))
+
+    try:
+        num, vcode = synHandle.write(freq_cmd)
+        num, vcode = synHandle.write(':LIST:DWEL:TYPE STEP; :SWE:DWEL {:.6f}S; :LIST:TRIG:SOUR {:s}; :TRIG:SOUR IMM; :INIT:CONT 0'.format(dwell, trig_src))
+        return vcode
+    except:
+        return 'Synthesizer set list sweep: IOError'
+
+
+def start_list_sweep(synHandle):
+    ''' Switch to list frequency mode and start the programmed sweep.
+        Returns visaCode
+    '''
+
+    try:
+        num, vcode = synHandle.write(':FREQ:MODE LIST; :INIT')
+        return vcode
+    except:
+        return 'Synthesizer start list sweep: IOError'
+
+
+def stop_list_sweep(synHandle):
+    ''' Abort the sweep and switch back to CW frequency mode.
+        Returns visaCode
+    '''
+
+    try:
+        num, vcode = synHandle.write(':ABOR; :FREQ:MODE CW')
+        return vcode
+    except:
+        return 'Synthesizer stop list sweep: IOError'
+
+
 def set_mod_mode(synHandle, mod_index):
     ''' Set synthesizer modulation mode.
         Arguments: mod_index, int
@@ -347,17 +347,22 @@ def val_lia_monitor_srate(srate_index, tc_index):
     return code, waittime
 
 
-def val_lia_waittime(text, tc_index):
+def val_lia_waittime(text, tc_index, settle=None):
     ''' Validate the wait time setting for lockin scans. The wait
         time must be longer than 2pi*time_const. Best > 3pi*time_const
         Arguments
             text: integration time user input, str
             tc_index: LIA time constant index, int
-        Safe range: > 3pi*tc + 10
-        Warning range: > 2pi*tc + 10
+            settle: calibrated settle time (ms), float or None
+        Safe range: > 3pi*tc + 10, or >= settle (and > 2pi*tc + 10) if calibrated
+        Warning range: > 2pi*tc + 10, also if calibrated
     '''
 
     time_const = LIATCLIST[tc_index]
-    code, waittime = val_float(text, safe=[('>', time_const*3*pi + 10)],
-                                 warning=[('>', time_const*2*pi + 10)])
+    if settle:
+        code, waittime = val_float(text, safe=[('>=', settle), ('>', time_const*2*pi + 10)],
+                                     warning=[('>', time_const*2*pi + 10)])
+    else:
+        code, waittime = val_float(text, safe=[('>', time_const*3*pi + 10)],
+                                     warning=[('>', time_const*2*pi + 10)])
     return code, waittime
@@ -5,6 +5,11 @@
 
 from PyQt5 import QtGui, QtCore
 import numpy as np
+import os
+import copy
+import queue
+import threading
+import time
 from math import ceil
 import pyqtgraph as pg
 from gui import SharedWidgets as Shared
@@ -13,6 +18,42 @@ from api import validator as api_val
 from api import lockin as api_lia
 from api import synthesizer as api_syn
 from data import save
+from data import journal
+from data import checkpoint as ckpt
+from data import average
+from data import npystore
+
+
+# index marker of the last sample in a sweep
+SWEEP_END = -1
+
+# interval (ms) at which the scan window consumes samples from the daq thread
+DRAIN_INTERVAL = 100
+
+# number of points of the running sweep collected before writing to the journal
+JOURNAL_CHUNK = 100
+
+# data acquisition modes.
+# 0: query lockin output (OUTP?) after each frequency step
+# 1: trigger the lockin buffer after each step, read the sweep in one transfer
+# 2: program the sweep into the synthesizer list. The synthesizer steps on
+#    its own dwell timer, and its TRIG OUT triggers the lockin buffer
+#    (synthesizer TRIG OUT must be wired to lockin TRIG IN)
+ACQ_MODE_LIST = ['Query each point', 'Lockin buffer', 'Synthesizer list']
+
+# coarse survey: features deviate from the baseline by more than
+# FEATURE_THRESHOLD times the robust noise level
+FEATURE_THRESHOLD = 5
+
+# coarse survey: fine scans extend REFINE_MARGIN coarse points beyond features
+REFINE_MARGIN = 2
+
+# interval (s) at which the lockin buffer is polled in a synthesizer list sweep
+LIST_POLL_INTERVAL = 0.5
+
+# a synthesizer list sweep is considered stalled if no trigger arrives
+# within this many dwell times (plus 1 s)
+LIST_STALL_FACTOR = 10
 
 
 class JPLScanConfig(QtGui.QDialog):
@@ -33,11 +74,26 @@ class JPLScanConfig(QtGui.QDialog):
         self.filename = 'default.lwa'
         self.fileLabel = QtGui.QLabel('Save Data to: {:s}'.format(self.filename))
         self.fileLabel.setStyleSheet('QLabel {color: #003366}')
+        self.acqModeSel = QtGui.QComboBox()
+        self.acqModeSel.addItems(ACQ_MODE_LIST)
+        self.surveyCheck = QtGui.QCheckBox('Coarse-then-refine survey')
+        self.surveyCheck.setToolTip('Scan each entry once with the coarse step and wait time first.\nFine scans are then added over the regions that contain features.')
+        self.coarseStepFill = QtGui.QLineEdit('1')
+        self.coarseWaitFill = QtGui.QLineEdit('20')
         topButtonLayout = QtGui.QGridLayout()
         topButtonLayout.addWidget(saveButton, 0, 0)
         topButtonLayout.addWidget(addBatchButton, 0, 1)
         topButtonLayout.addWidget(removeBatchButton, 0, 2)
         topButtonLayout.addWidget(self.fileLabel, 1, 0, 1, 3)
+        topButtonLayout.addWidget(QtGui.QLabel('Acquisition Mode'), 2, 0)
+        topButtonLayout.addWidget(self.acqModeSel, 2, 1)
+        topButtonLayout.addWidget(self.surveyCheck, 3, 0)
+        surveyLayout = QtGui.QHBoxLayout()
+        surveyLayout.addWidget(QtGui.QLabel('Coarse Step (MHz)'))
+        surveyLayout.addWidget(self.coarseStepFill)
+        surveyLayout.addWidget(QtGui.QLabel('Coarse Wait time (ms)'))
+        surveyLayout.addWidget(self.coarseWaitFill)
+        topButtonLayout.addLayout(surveyLayout, 3, 1, 1, 2)
         topButtons = QtGui.QWidget()
         topButtons.setLayout(topButtonLayout)
 
@@ -69,6 +125,8 @@ class JPLScanConfig(QtGui.QDialog):
         self.entryLayout.addWidget(QtGui.QLabel('Mod Depth/Dev'), 0, 10, 1, 2)
         self.entryLayout.addWidget(QtGui.QLabel('Harmonics'), 0, 12)
         self.entryLayout.addWidget(QtGui.QLabel('Phase'), 0, 13)
+        self.entryLayout.addWidget(QtGui.QLabel('SNR Target'), 0, 14)
+        self.entryLayout.addWidget(QtGui.QLabel('Max Avg'), 0, 15)
 
         self.add_entry()
 
@@ -105,7 +163,7 @@ class JPLScanConfig(QtGui.QDialog):
                             self.main.synInfo.modFreq,
                             self.main.synInfo.modAmp,
                             self.main.liaInfo.refHarm,
-                            self.main.liaInfo.refPhase)
+                            self.main.liaInfo.refPhase, 0, 1)
         entry = Shared.JPLLIAScanEntry(self.main, default=default_setting)
 
         # get the current last entry
@@ -120,11 +178,14 @@ class JPLScanConfig(QtGui.QDialog):
             entry.sensSel.setCurrentIndex(last_entry.sensSel.currentIndex())
             entry.tcSel.setCurrentIndex(last_entry.tcSel.currentIndex())
             entry.waitTimeFill.setText(last_entry.waitTimeFill.text())
+            entry.waittimeAuto = last_entry.waittimeAuto
             entry.modModeSel.setCurrentIndex(last_entry.modModeSel.currentIndex())
             entry.modFreqFill.setText(last_entry.modFreqFill.text())
             entry.modAmpFill.setText(last_entry.modAmpFill.text())
             entry.harmSel.setCurrentIndex(last_entry.harmSel.currentIndex())
             entry.refPhaseFill.setText(last_entry.refPhaseFill.text())
+            entry.snrTargetFill.setText(last_entry.snrTargetFill.text())
+            entry.maxAvgFill.setText(last_entry.maxAvgFill.text())
         else:
             pass
         # add this entry to the layout and to the entry list
@@ -144,6 +205,8 @@ class JPLScanConfig(QtGui.QDialog):
         self.entryLayout.addWidget(entry.modAmpUnitLabel, row, 11)
         self.entryLayout.addWidget(entry.harmSel, row, 12)
         self.entryLayout.addWidget(entry.refPhaseFill, row, 13)
+        self.entryLayout.addWidget(entry.snrTargetFill, row, 14)
+        self.entryLayout.addWidget(entry.maxAvgFill, row, 15)
 
     def remove_entry(self):
         ''' Remove last batch entry in this dialog window '''
@@ -184,11 +247,15 @@ class JPLScanConfig(QtGui.QDialog):
             entry.harmSel.deleteLater()
             self.entryLayout.removeWidget(entry.refPhaseFill)
             entry.refPhaseFill.deleteLater()
+            self.entryLayout.removeWidget(entry.snrTargetFill)
+            entry.snrTargetFill.deleteLater()
+            self.entryLayout.removeWidget(entry.maxAvgFill)
+            entry.maxAvgFill.deleteLater()
             entry.deleteLater()
 
     def set_file_directory(self):
 
-        self.filename, _ = QtGui.QFileDialog.getSaveFileName(self, 'Save Data', '', 'SMAP File (*.lwa)')
+        self.filename, _ = QtGui.QFileDialog.getSaveFileName(self, 'Save Data', '', 'SMAP File (*.lwa *.lwa.gz *.lwa.xz)')
         self.fileLabel.setText('Data save to: {:s}'.format(self.filename))
 
     def get_settings(self):
@@ -196,7 +263,8 @@ class JPLScanConfig(QtGui.QDialog):
             Returns a list of seting tuples in the format of
             (comment, start_freq <MHz>, stop_freq <MHz>, step <MHz>,
              averages [int], sens_index [int], timeConst [int],
-             waittime <ms>, mod Mode index [int], mod freq <Hz>, mod Amp [float], harmonics [int], phase [float])
+             waittime <ms>, mod Mode index [int], mod freq <Hz>, mod Amp [float], harmonics [int], phase [float],
+             snr target [float, 0 if off], max averages [int])
         '''
 
         vdi_index = self.main.synCtrl.bandSel.currentIndex()
@@ -219,11 +287,18 @@ class JPLScanConfig(QtGui.QDialog):
                                      entry.tcSel.currentIndex(), entry.waittime,
                                      entry.modModeSel.currentIndex(),
                                      entry.modFreq, entry.modAmp, entry.refHarm,
-                                     entry.refPhase)
+                                     entry.refPhase, entry.snrTarget, entry.maxAvg)
                     # put the setting tuple into a list
                     entry_settings.append(entry_setting)
                 else:
                     no_error *= False
+        if self.surveyCheck.isChecked():
+            code1, _ = api_val.val_float(self.coarseStepFill.text(), safe=[('>=', 0.01)])
+            code2, _ = api_val.val_float(self.coarseWaitFill.text(), safe=[('>', 0)])
+            no_error *= (code1 == 2 and code2 == 2)
+        else:
+            pass
+
         if no_error:
             return entry_settings, self.filename
         else:
@@ -231,6 +306,16 @@ class JPLScanConfig(QtGui.QDialog):
             msg.exec_()
             return None, None
 
+    def get_survey(self):
+        ''' Returns (coarse step <MHz>, coarse waittime <ms>) of the
+            coarse-then-refine survey, or None if the survey is off
+        '''
+
+        if self.surveyCheck.isChecked():
+            return float(self.coarseStepFill.text()), float(self.coarseWaitFill.text())
+        else:
+            return None
+
 
 class JPLScanWindow(QtGui.QDialog):
     ''' Scanning window '''
@@ -238,11 +323,33 @@ class JPLScanWindow(QtGui.QDialog):
     # define a pyqt signal to control batch scans
     next_entry_signal = QtCore.pyqtSignal()
 
-    def __init__(self, entry_settings, filename, main=None):
+    def __init__(self, entry_settings, filename, main=None, acq_mode=0,
+                 checkpoint=None, survey=None):
+        ''' checkpoint is the (state, arrays) tuple of an unfinished batch
+            job loaded by data.checkpoint.load_checkpoint. If given, the
+            batch job resumes at the sweep where it stopped.
+            survey is the (coarse step <MHz>, coarse waittime <ms>) of the
+            coarse-then-refine survey. If given, every entry is first
+            scanned coarsely, and fine scans over the features found are
+            appended to the batch.
+        '''
         QtGui.QWidget.__init__(self, main)
         self.main = main
         self.setWindowTitle('Lockin scan monitor')
         self.setMinimumSize(1200, 600)
+        self.filename = filename
+        self.acq_mode = acq_mode
+
+        # fine entry settings of coarse survey entries, by entry index
+        self.refine_templates = {}
+        if checkpoint:
+            for index, template in checkpoint[0]['refine_templates']:
+                self.refine_templates[index] = tuple(template)
+        elif survey:
+            self.refine_templates = dict(enumerate(entry_settings))
+            entry_settings = coarse_entry_settings(entry_settings, survey)
+        else:
+            pass
         self.entry_settings = entry_settings
 
         # set up batch list display
@@ -257,6 +364,14 @@ class JPLScanWindow(QtGui.QDialog):
         batchLayout.addWidget(batchArea)
         batchDisplay.setLayout(batchLayout)
 
+        # set up the acquisition thread. It owns the instrument handles
+        # until the batch job finishes
+        self.worker = JPLScanWorker(main=self.main, acq_mode=acq_mode)
+        self.worker.start()
+
+        # journal of sweeps, for recovery if the program dies before saving
+        self.journal = journal.Journal(filename + journal.JOURNAL_EXT)
+
         # set up single scan monitor + daq class
         self.singleScan = SingleScan(filename, parent=self, main=self.main)
 
@@ -278,9 +393,9 @@ class JPLScanWindow(QtGui.QDialog):
         mainLayout.addWidget(progressDisplay, 1, 0, 1, 5)
         self.setLayout(mainLayout)
 
-        # Initiate progress bar
-        total_time = ceil(Shared.jpl_scan_time(entry_settings))
-        self.totalProgBar.setRange(0, total_time)
+        # Initiate progress bar. The total time follows the adaptive plan
+        self.total_time = Shared.jpl_scan_time(entry_settings)
+        self.totalProgBar.setRange(0, ceil(self.total_time))
         self.totalProgBar.setValue(0)
         self.batch_time_taken = 0
 
@@ -288,6 +403,18 @@ class JPLScanWindow(QtGui.QDialog):
         self.next_entry_signal.connect(self.next_entry)
         # this makes sure batch starts at index 0
         self.current_entry_index = -1
+        if checkpoint:
+            state, arrays = checkpoint
+            self.current_entry_index = state['current_entry_index'] - 1
+            self.batch_time_taken = state['batch_time_taken']
+            self.singleScan.resume_from(state['acquired_avg'], arrays['y_sweeps'],
+                                        state['journal_id'])
+            for entry in self.batchListWidget.entryList[:state['current_entry_index']]:
+                entry.set_color_grey()
+                entry.commentFill.setReadOnly(True)
+                entry.commentFill.setStyleSheet('color: grey')
+        else:
+            pass
         self.next_entry_signal.emit()
 
     def next_entry(self):
@@ -308,10 +435,49 @@ class JPLScanWindow(QtGui.QDialog):
         else:
             self.finish()
 
+    def save_checkpoint(self):
+        ''' Save the batch state to disk. Called at sweep boundaries '''
+
+        # grab current comments (in case edited during the scan)
+        entry_settings = [(entry.commentFill.text(),) + tuple(setting[1:])
+                          for entry, setting in zip(self.batchListWidget.entryList, self.entry_settings)]
+        state = {'filename': self.filename,
+                 'acq_mode': self.acq_mode,
+                 'entry_settings': entry_settings,
+                 'current_entry_index': self.current_entry_index,
+                 'batch_time_taken': self.batch_time_taken,
+                 'acquired_avg': self.singleScan.acquired_avg,
+                 'journal_id': self.singleScan.journal_id,
+                 'refine_templates': list(self.refine_templates.items())}
+        ckpt.save_checkpoint(self.filename + ckpt.CHECKPOINT_EXT, state,
+                             y_sweeps=self.singleScan.y_sweeps[:self.singleScan.acquired_avg])
+
+    def refine_entry(self, x, y):
+        ''' If the current entry is a coarse survey, append fine scans over
+            the regions of y that contain features
+        '''
+
+        if self.current_entry_index in self.refine_templates:
+            template = self.refine_templates[self.current_entry_index]
+            for start, stop in find_feature_windows(x, y):
+                entry_setting = (('{:s} refine'.format(template[0]), start, stop) +
+                                 tuple(template[3:]))
+                self.entry_settings.append(entry_setting)
+                self.batchListWidget.add_entry(entry_setting)
+                self.total_time += Shared.jpl_scan_time(entry_setting)
+            self.totalProgBar.setRange(0, ceil(self.total_time))
+        else:
+            pass
+
     def stop_timers(self):
 
         # stop timers
-        self.singleScan.waitTimer.stop()
+        self.singleScan.drainTimer.stop()
+        self.singleScan.yCurve.stop()
+        self.singleScan.ySumCurve.stop()
+        # stop the acquisition thread
+        self.worker.stop()
+        self.journal.close()
 
     def finish(self):
 
@@ -322,6 +488,9 @@ class JPLScanWindow(QtGui.QDialog):
                              'Congratulations! Now it is time to grab some coffee.')
         msg.exec_()
         self.stop_timers()
+        ckpt.remove_checkpoint(self.filename + ckpt.CHECKPOINT_EXT)
+        # every entry is saved in the lwa file, the journal is not needed
+        journal.remove_journal(self.journal.filename)
         self.accept()
 
     def reject(self):
@@ -365,27 +534,417 @@ class JPLBatchListWidget(QtGui.QWidget):
 
         # add batch list entry
         self.entryList = []
-        for row in range(len(entry_settings)):
-            # entry = (start, stop, step, avg, sens_idx, tc_idx, waittime, comment)
-            current_setting = entry_settings[row]
-            entry = Shared.JPLLIABatchListEntry(self, entry_setting=current_setting)
-            # set up the batch number (row + 1)
-            entry.numberLabel.setText(str(row+1))
-            # add widgets to the dispaly panel layout
-            self.batchLayout.addWidget(entry.numberLabel, row+2, 0)
-            self.batchLayout.addWidget(entry.commentFill, row+2, 1)
-            self.batchLayout.addWidget(entry.startFreqLabel, row+2, 2)
-            self.batchLayout.addWidget(entry.stopFreqLabel, row+2, 3)
-            self.batchLayout.addWidget(entry.stepLabel, row+2, 4)
-            self.batchLayout.addWidget(entry.avgLabel, row+2, 5)
-            self.batchLayout.addWidget(entry.sensLabel, row+2, 6)
-            self.batchLayout.addWidget(entry.tcLabel, row+2, 7)
-            self.batchLayout.addWidget(entry.modModeLabel, row+2, 8)
-            self.batchLayout.addWidget(entry.refHarmLabel, row+2, 9)
-            self.entryList.append(entry)
+        for current_setting in entry_settings:
+            self.add_entry(current_setting)
 
         self.setLayout(self.batchLayout)
 
+    def add_entry(self, entry_setting):
+        ''' Add an entry to the end of the batch list '''
+
+        row = len(self.entryList)
+        entry = Shared.JPLLIABatchListEntry(self, entry_setting=entry_setting)
+        # set up the batch number (row + 1)
+        entry.numberLabel.setText(str(row+1))
+        # add widgets to the dispaly panel layout
+        self.batchLayout.addWidget(entry.numberLabel, row+2, 0)
+        self.batchLayout.addWidget(entry.commentFill, row+2, 1)
+        self.batchLayout.addWidget(entry.startFreqLabel, row+2, 2)
+        self.batchLayout.addWidget(entry.stopFreqLabel, row+2, 3)
+        self.batchLayout.addWidget(entry.stepLabel, row+2, 4)
+        self.batchLayout.addWidget(entry.avgLabel, row+2, 5)
+        self.batchLayout.addWidget(entry.sensLabel, row+2, 6)
+        self.batchLayout.addWidget(entry.tcLabel, row+2, 7)
+        self.batchLayout.addWidget(entry.modModeLabel, row+2, 8)
+        self.batchLayout.addWidget(entry.refHarmLabel, row+2, 9)
+        self.entryList.append(entry)
+
+
+def coarse_entry_settings(entry_settings, survey):
+    ''' Coarse survey entries: one sweep with the coarse step and waittime,
+        without SNR target.
+        Arguments
+            entry_settings: list of entry setting tuples
+            survey: (coarse step <MHz>, coarse waittime <ms>)
+        Returns
+            coarse_settings: list of entry setting tuples
+    '''
+
+    coarse_settings = []
+    for entry_setting in entry_settings:
+        coarse_settings.append(('{:s} coarse'.format(entry_setting[0]),) +
+                               tuple(entry_setting[1:3]) + (survey[0], 1) +
+                               tuple(entry_setting[5:7]) + (survey[1],) +
+                               tuple(entry_setting[8:13]) + (0, 1))
+
+    return coarse_settings
+
+
+def find_feature_windows(x, y, threshold=FEATURE_THRESHOLD, margin=REFINE_MARGIN):
+    ''' Find regions of a coarse spectrum that contain features.
+        Points deviating from the median baseline by more than threshold
+        times the robust noise level (median absolute deviation, floored
+        by the smallest deviation if it is 0) are features. They are
+        widened by margin points on each side, and overlapping regions
+        are merged.
+        Arguments
+            x: mm frequency array (MHz), np.array
+            y: spectrum, np.array
+            threshold: float
+            margin: int, number of points
+        Returns
+            windows: list of (start, stop) frequency (MHz) in ascending order
+    '''
+
+    dev = np.abs(y - np.median(y))
+    noise = np.median(dev) * average.MAD_TO_SIGMA
+    if noise > 0:
+        pass
+    elif np.any(dev > 0):
+        # flat or quantized data has no MAD. Floor the noise by the
+        # smallest deviation, as average.clipped_mean does
+        noise = np.min(dev[dev > 0]) * average.MAD_TO_SIGMA
+    else:
+        # constant spectrum, no features
+        return []
+    mask = dev > threshold * noise
+
+    # widen features by margin points
+    mask = np.convolve(mask, np.ones(2*margin+1), mode='same') > 0
+    # start and stop index of each continuous region
+    edges = np.diff(np.concatenate(([0], mask.astype(int), [0])))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1) - 1
+
+    windows = [(float(min(x[i], x[j])), float(max(x[i], x[j]))) for i, j in zip(starts, stops)]
+    windows.sort()
+
+    return windows
+
+
+class JPLScanWorker(QtCore.QThread):
+    ''' Data acquisition thread of the JPL lockin scan.
+        The worker owns the synthesizer and lockin handles for the duration
+        of a batch job. The scan window posts commands to it, and the worker
+        pushes samples (index, value, timestamp) into the data queue given
+        with each sweep. The end of a sweep is marked by a sample whose
+        index is SWEEP_END. Timestamps are time.perf_counter() seconds.
+        acq_mode is the index in ACQ_MODE_LIST.
+    '''
+
+    # emitted with the (SynInfo, LiaInfo) queried after the instruments
+    # are tuned to a new entry setting
+    tuned = QtCore.pyqtSignal(object, object)
+    # emitted with a message when the worker has to fall back to another mode
+    warning = QtCore.pyqtSignal(str)
+
+    def __init__(self, main=None, acq_mode=0):
+        QtCore.QThread.__init__(self)
+        self.main = main
+        self.acq_mode = acq_mode
+        self.synHandle = main.synHandle
+        self.liaHandle = main.liaHandle
+        self.test_mode = main.testModeAction.isChecked()
+        self.multiplier = main.synInfo.vdiBandMultiplication
+
+        self.cmd_queue = queue.Queue()
+        # data queue of the active sweep. Replacing it cancels the sweep
+        self.data_queue = None
+        self._resume = threading.Event()
+        self._resume.set()
+        self._wake = threading.Event()
+
+    def tune(self, entry_setting):
+        ''' Tune instruments to entry_setting. The worker queries the
+            instruments into copies of the info objects of the main window,
+            which are handed back to the GUI thread by the tuned signal.
+        '''
+
+        self.cmd_queue.put(('tune', (entry_setting, copy.copy(self.main.synInfo),
+                                     copy.copy(self.main.liaInfo))))
+
+    def sweep(self, x, index_list, waittime, data_queue):
+        ''' Start a sweep over x[index_list]. Cancels the active sweep.
+            Arguments
+                x: mm frequency array (MHz), np.array
+                index_list: indices of x to be taken in order, np.array
+                waittime: dwell time of each point (ms), float
+                data_queue: queue.Queue to receive the samples
+        '''
+
+        self.data_queue = data_queue
+        self._wake.set()
+        self.cmd_queue.put(('sweep', (x, index_list, waittime, data_queue)))
+
+    def cancel_sweep(self):
+        ''' Cancel the active sweep '''
+
+        self.data_queue = None
+        self._wake.set()
+
+    def pause(self):
+
+        self._resume.clear()
+        self._wake.set()
+
+    def resume(self):
+
+        self._resume.set()
+
+    def stop(self):
+        ''' Stop the thread and release instrument handles '''
+
+        self.cancel_sweep()
+        self.cmd_queue.put(('stop', None))
+        self._resume.set()
+        self.wait()
+
+    def run(self):
+
+        while True:
+            cmd, args = self.cmd_queue.get()
+            if cmd == 'tune':
+                self.tuned.emit(*self._tune(*args))
+            elif cmd == 'sweep' and self.acq_mode == 1:
+                self._sweep_buffer(*args)
+            elif cmd == 'sweep' and self.acq_mode == 2:
+                self._sweep_list(*args)
+            elif cmd == 'sweep':
+                self._sweep(*args)
+            else:
+                break
+
+    def _tune(self, entry_setting, syn_info, lia_info):
+        ''' Tune instrument. Returns syn_info, lia_info updated by
+            the instrument query
+        '''
+
+        if self.test_mode:
+            pass
+        else:
+            api_syn.set_mod_mode(self.synHandle, entry_setting[8])
+            if entry_setting[8] == 1:
+                api_syn.set_am(self.synHandle, entry_setting[9], entry_setting[10], True)
+            elif entry_setting[8] == 2:
+                api_syn.set_fm(self.synHandle, entry_setting[9], entry_setting[10], True)
+            else:
+                pass
+            api_lia.set_sens(self.liaHandle, entry_setting[5])
+            api_lia.set_tc(self.liaHandle, entry_setting[6])
+            api_lia.set_harm(self.liaHandle, entry_setting[11])
+            api_lia.set_phase(self.liaHandle, entry_setting[12])
+
+            syn_info.full_info_query(self.synHandle)
+            lia_info.full_info_query(self.liaHandle)
+
+        return syn_info, lia_info
+
+    def _tune_freq(self, probf):
+        ''' Tune synthesizer to the mm frequency probf (MHz) '''
+
+        if self.test_mode:
+            pass
+        else:
+            api_syn.set_syn_freq(self.synHandle, probf * 1e6 / self.multiplier)
+
+    def _read_lockin(self):
+
+        if self.test_mode:
+            return np.random.random_sample()
+        else:
+            return float(api_lia.query_single_x(self.liaHandle))
+
+    def _dwell(self, deadline):
+        ''' Sleep until deadline (perf_counter seconds).
+            Wakes up early if the sweep is paused or cancelled.
+        '''
+
+        remaining = deadline - time.perf_counter()
+        if remaining > 0:
+            self._wake.wait(remaining)
+        self._wake.clear()
+
+    def _sweep(self, x, index_list, waittime, data_queue):
+        ''' Take data points in x[index_list] '''
+
+        i = 0
+        while i < len(index_list):
+            self._resume.wait()
+            if data_queue is not self.data_queue:
+                return
+            idx = index_list[i]
+            deadline = time.perf_counter() + waittime * 1e-3
+            self._tune_freq(x[idx])
+            self._dwell(deadline)
+            if data_queue is not self.data_queue:
+                return
+            elif time.perf_counter() < deadline or not self._resume.is_set():
+                # woken up before the lockin settles. Redo this point
+                continue
+            else:
+                data_queue.put((idx, self._read_lockin(), time.perf_counter()))
+                i += 1
+
+        data_queue.put((SWEEP_END, 0, time.perf_counter()))
+
+    def _sweep_buffer(self, x, index_list, waittime, data_queue):
+        ''' Take data points in x[index_list] with the lockin buffer.
+            The lockin is triggered once the signal settles at each step,
+            and stored points are read out in one binary transfer at the end
+            of the sweep (or whenever the buffer is full).
+        '''
+
+        if self.test_mode:
+            pass
+        else:
+            api_lia.init_buffer(self.liaHandle)
+            api_lia.start_buffer(self.liaHandle)
+
+        i = 0
+        stamps = []     # trigger timestamps of points in the buffer
+        while i < len(index_list):
+            self._resume.wait()
+            if data_queue is not self.data_queue:
+                return
+            idx = index_list[i]
+            deadline = time.perf_counter() + waittime * 1e-3
+            self._tune_freq(x[idx])
+            self._dwell(deadline)
+            if data_queue is not self.data_queue:
+                return
+            elif time.perf_counter() < deadline or not self._resume.is_set():
+                # woken up before the lockin settles. Redo this point
+                continue
+            else:
+                if self.test_mode:
+                    pass
+                else:
+                    api_lia.trigger(self.liaHandle)
+                stamps.append(time.perf_counter())
+                i += 1
+            if len(stamps) == api_lia.BUFFER_SIZE:
+                self._flush_buffer(index_list[i-len(stamps):i], stamps, data_queue)
+                stamps = []
+            else:
+                pass
+
+        if stamps:
+            self._flush_buffer(index_list[i-len(stamps):i], stamps, data_queue)
+        else:
+            pass
+        data_queue.put((SWEEP_END, 0, time.perf_counter()))
+
+    def _sweep_list(self, x, index_list, waittime, data_queue):
+        ''' Take data points in x[index_list] with a synthesizer list sweep.
+            The sweep is split in chunks that fit in the lockin buffer.
+            If the lockin receives no trigger, the rest of the sweep
+            falls back to the lockin buffer mode.
+        '''
+
+        i = 0
+        while i < len(index_list):
+            self._resume.wait()
+            if data_queue is not self.data_queue:
+                return
+            index_chunk = index_list[i:i+api_lia.BUFFER_SIZE-1]
+            n, stalled = self._list_chunk(x, index_chunk, waittime, data_queue)
+            i += n
+            if stalled:
+                self.acq_mode = 1
+                self.warning.emit('No trigger received from the synthesizer. Check that synthesizer TRIG OUT is connected to lockin TRIG IN. Switched to lockin buffer mode.')
+                self._sweep_buffer(x, index_list[i:], waittime, data_queue)
+                return
+            else:
+                pass
+
+        data_queue.put((SWEEP_END, 0, time.perf_counter()))
+
+    def _list_chunk(self, x, index_chunk, waittime, data_queue):
+        ''' Run one synthesizer list sweep over x[index_chunk].
+            The synthesizer triggers the lockin at the start of each point,
+            so the value of a point is stored at the start of the next one.
+            One extra trailing point is programmed to trigger the last
+            value, and the first (unsettled) sample is discarded.
+            Returns
+                n: number of points acquired, int
+                stalled: True if the lockin stopped receiving triggers
+        '''
+
+        dwell = waittime * 1e-3
+        syn_freq = x[index_chunk] * 1e6 / self.multiplier
+        if len(syn_freq) > 1:
+            syn_freq = np.append(syn_freq, 2 * syn_freq[-1] - syn_freq[-2])
+        else:
+            syn_freq = np.append(syn_freq, syn_freq[-1])
+
+        if self.test_mode:
+            pass
+        else:
+            api_lia.init_buffer(self.liaHandle)
+            api_lia.start_buffer(self.liaHandle)
+            api_syn.set_list_sweep(self.synHandle, syn_freq, dwell)
+            api_syn.start_list_sweep(self.synHandle)
+
+        t0 = time.perf_counter()
+        t_last = t0     # time of the last stored sample
+        n_read = 0      # samples read from the buffer, including the first
+        stalled = False
+        while n_read < len(syn_freq):
+            self._dwell(time.perf_counter() + max(LIST_POLL_INTERVAL, dwell))
+            if data_queue is not self.data_queue or not self._resume.is_set():
+                break
+            if self.test_mode:
+                n_stored = min(len(syn_freq), int((time.perf_counter() - t0) / dwell) + 1)
+            else:
+                n_stored = api_lia.read_buffer_len(self.liaHandle)
+            if n_stored > n_read:
+                if self.test_mode:
+                    y = np.random.random_sample(n_stored - n_read)
+                else:
+                    y = api_lia.read_buffer(self.liaHandle, n_stored - n_read, start=n_read)
+                for j, value in enumerate(y, start=n_read):
+                    if j > 0:
+                        data_queue.put((index_chunk[j-1], value, t0 + j * dwell))
+                    else:
+                        pass
+                if len(y):
+                    n_read += len(y)
+                    t_last = time.perf_counter()
+                else:
+                    pass
+            else:
+                pass
+            if time.perf_counter() - t_last > LIST_STALL_FACTOR * dwell + 1:
+                stalled = True
+                break
+            else:
+                pass
+
+        if self.test_mode:
+            pass
+        else:
+            api_syn.stop_list_sweep(self.synHandle)
+            api_lia.pause_buffer(self.liaHandle)
+
+        return max(n_read - 1, 0), stalled
+
+    def _flush_buffer(self, index_chunk, stamps, data_queue):
+        ''' Read stored points from the lockin buffer, push them into
+            data_queue and reset the buffer for the following points
+        '''
+
+        if self.test_mode:
+            y = np.random.random_sample(len(stamps))
+        else:
+            api_lia.pause_buffer(self.liaHandle)
+            y = api_lia.read_buffer(self.liaHandle, len(stamps))
+            api_lia.init_buffer(self.liaHandle)
+            api_lia.start_buffer(self.liaHandle)
+
+        # points lost in a failed transfer are left as 0
+        for idx, value, timestamp in zip(index_chunk, y, stamps):
+            data_queue.put((idx, value, timestamp))
+
 
 class SingleScan(QtGui.QWidget):
     ''' Take a scan in a single freq window '''
@@ -398,6 +957,7 @@ class SingleScan(QtGui.QWidget):
         self.main = main
         self.parent = parent
         self.filename = filename
+        self.worker = parent.worker
 
         # Initialize shared settings
         self.multiplier = self.main.synInfo.vdiBandMultiplication
@@ -410,11 +970,21 @@ class SingleScan(QtGui.QWidget):
         self.step = 0
         self.sens_index = 0
         self.waittime = 60
-
-        self.waitTimer = QtCore.QTimer()
-        self.waitTimer.setInterval(self.waittime)
-        self.waitTimer.setSingleShot(True)
-        self.waitTimer.timeout.connect(self.query_lockin)
+        self.data_queue = queue.Queue()
+        # journal entry of the current scan window, and points of the
+        # running sweep not yet written to the journal
+        self.journal_id = 0
+        self.journal_idx = []
+        self.journal_val = []
+        # (acquired_avg, y_sweeps, journal_id) restored from a checkpoint
+        self.resume_state = None
+
+        # samples are consumed in batches to decouple the GUI from the daq
+        self.drainTimer = QtCore.QTimer()
+        self.drainTimer.setInterval(DRAIN_INTERVAL)
+        self.drainTimer.timeout.connect(self.drain)
+        self.worker.tuned.connect(self.refresh_status)
+        self.worker.warning.connect(self.show_warning)
 
         # set up main layout
         buttons = QtGui.QWidget()
@@ -425,6 +995,12 @@ class SingleScan(QtGui.QWidget):
         redoButton = QtGui.QPushButton('Redo Current Sweep')
         restartWinButton = QtGui.QPushButton('Restart Current Batch')
         saveButton = QtGui.QPushButton('Save and Continue')
+        self.snrLabel = QtGui.QLabel()
+        self.combineSel = QtGui.QComboBox()
+        self.combineSel.addItems(average.COMBINE_MODE_LIST)
+        self.combineSel.setToolTip('Method to combine sweeps when the data is saved')
+        self.saveSweepsCheck = QtGui.QCheckBox('Save individual sweeps')
+        self.saveSweepsCheck.setToolTip('Also save the scan with all sweeps in the binary store (.npyd) next to the data file')
         buttonLayout = QtGui.QGridLayout()
         buttonLayout.addWidget(self.pauseButton, 0, 0)
         buttonLayout.addWidget(redoButton, 0, 1)
@@ -432,6 +1008,10 @@ class SingleScan(QtGui.QWidget):
         buttonLayout.addWidget(saveButton, 1, 0)
         buttonLayout.addWidget(jumpButton, 1, 1)
         buttonLayout.addWidget(abortAllButton, 1, 2)
+        buttonLayout.addWidget(QtGui.QLabel('Combine Sweeps'), 2, 0)
+        buttonLayout.addWidget(self.combineSel, 2, 1)
+        buttonLayout.addWidget(self.saveSweepsCheck, 2, 2)
+        buttonLayout.addWidget(self.snrLabel, 3, 0, 1, 3)
         buttons.setLayout(buttonLayout)
 
         pgWin = pg.GraphicsWindow(title='Live Monitor')
@@ -440,12 +1020,8 @@ class SingleScan(QtGui.QWidget):
         self.yPlot.setLabel('bottom', text='Frequency (MHz)')
         self.ySumPlot = pgWin.addPlot(0, 0, title='Sum sweep')
         self.ySumPlot.setLabel('left', text='Intensity', units='V')
-        self.yCurve = self.yPlot.plot()
-        self.yCurve.setDownsampling(auto=True, method='peak')
-        self.yCurve.setPen(pg.mkPen(220, 220, 220))
-        self.ySumCurve = self.ySumPlot.plot()
-        self.ySumCurve.setDownsampling(auto=True, method='peak')
-        self.ySumCurve.setPen(pg.mkPen(219, 112, 147))
+        self.yCurve = Shared.LiveCurve(self.yPlot, pen=pg.mkPen(220, 220, 220), parent=self)
+        self.ySumCurve = Shared.LiveCurve(self.ySumPlot, pen=pg.mkPen(219, 112, 147), parent=self)
         self.ySumPlot.setXLink(self.yPlot)
         mainLayout = QtGui.QVBoxLayout()
         mainLayout.addWidget(pgWin)
@@ -464,40 +1040,85 @@ class SingleScan(QtGui.QWidget):
         ''' Update scan entry setting. Starts a scan after setting update.
             entry = (comment, start_freq <MHz>, stop_freq <MHz>, step <MHz>,
              averages [int], sens_index [int], timeConst [int],
-             waittime <ms>, mod Mode index [int], mod freq <Hz>, mod Amp [float], harmonics [int], phase [float])
+             waittime <ms>, mod Mode index [int], mod freq <Hz>, mod Amp [float], harmonics [int], phase [float],
+             snr target [float, 0 if off], max averages [int])
         '''
 
+        self.entry_setting = entry_setting
         self.x = Shared.gen_x_array(*entry_setting[1:4])
         self.x_min = min(entry_setting[1], entry_setting[2])
         self.step = entry_setting[3]
         self.current_x_index = 0
         self.target_avg = entry_setting[4]
+        # with an SNR target, the planned averages are updated after each sweep
+        if len(entry_setting) > 13 and entry_setting[13] > 0:
+            self.snr_target = entry_setting[13]
+            self.max_avg = max(entry_setting[14], self.target_avg)
+        else:
+            self.snr_target = 0
+            self.max_avg = self.target_avg
+        self.planned_avg = Shared.jpl_planned_avg(entry_setting)
         self.acquired_avg = 0
         self.sens_index = entry_setting[5]
         self.tc_index = entry_setting[6]
         self.waittime = entry_setting[7]
-        self.waitTimer.setInterval(self.waittime)
         self.current_comment = entry_setting[0]
         self.y = np.zeros_like(self.x)
         self.y_sum = np.zeros_like(self.x)
-        self.ySumCurve.setData(self.x, self.y_sum)
-        total_pts =  len(self.x) * self.target_avg
-        self.pts_taken = 0
+        # running sum of squares for the noise estimation
+        self.y_sqsum = np.zeros_like(self.x)
+        # every sweep is kept for robust averaging at save time
+        self.y_sweeps = np.zeros((self.max_avg, len(self.x)), dtype=np.float32)
+        self.snrLabel.setText('')
+        if self.resume_state:
+            self.acquired_avg, y_sweeps, self.journal_id = self.resume_state
+            self.y_sweeps[:self.acquired_avg] = y_sweeps
+            self.y_sum[:] = np.sum(y_sweeps, axis=0)
+            self.y_sqsum[:] = np.sum(np.square(y_sweeps, dtype=float), axis=0)
+            self.resume_state = None
+            # the next sweep starts from the end of the previous one
+            if self.acquired_avg % 2:
+                self.current_x_index = len(self.x) - 1
+            else:
+                pass
+            new_journal_entry = False
+        else:
+            new_journal_entry = True
+        self.yCurve.set_data(self.x, self.y)
+        self.ySumCurve.set_data(self.x, self.y_sum)
+        total_pts =  len(self.x) * self.planned_avg
+        self.pts_taken = len(self.x) * self.acquired_avg
         self.parent.currentProgBar.setRange(0, ceil(total_pts * self.waittime * 1e-3))
         self.parent.currentProgBar.setValue(ceil(self.pts_taken * self.waittime * 1e-3))
+        if self.snr_target:
+            self.update_plan()
+        else:
+            pass
 
         # tune instrument
         self.tune_inst(entry_setting)
+        if new_journal_entry:
+            self.journal_id = self.parent.journal.begin_entry(self.x, self.header_info(entry_setting[0]))
+        else:
+            pass
+        self.journal_idx = []
+        self.journal_val = []
 
-        # refresh [inst]Status Panels
-        self.main.synStatus.print_info()
-        self.main.liaStatus.print_info()
+        # start daq
+        self.start_sweep()
+        self.parent.save_checkpoint()
 
-        # start daq timer
-        self.waitTimer.start()
+    def resume_from(self, acquired_avg, y_sweeps, journal_id):
+        ''' Restore the averages of the entry where a batch job stopped.
+            They are applied by the next update_setting.
+        '''
+
+        self.resume_state = (acquired_avg, y_sweeps, journal_id)
 
     def tune_inst(self, entry_setting):
-        ''' Tune instrument '''
+        ''' Tune instrument. Instrument communication is carried out
+            by the acquisition thread.
+        '''
 
         self.main.synInfo.modModeIndex = entry_setting[8]
         self.main.synInfo.modModeText = api_syn.MOD_MODE_LIST[entry_setting[8]]
@@ -525,91 +1146,180 @@ class SingleScan(QtGui.QWidget):
             self.main.liaInfo.refHarmText = str(entry_setting[11])
             self.main.liaInfo.refPhase = entry_setting[12]
         else:
-            api_syn.set_syn_freq(self.main.synHandle, self.x[self.current_x_index]/self.multiplier)
-            api_syn.set_mod_mode(self.main.synHandle, entry_setting[8])
-            if self.main.synInfo.modModeIndex == 1:
-                api_syn.set_am(self.main.synHandle, entry_setting[9], entry_setting[10], True)
-            elif self.main.synInfo.modModeIndex == 2:
-                api_syn.set_fm(self.main.synHandle, entry_setting[9], entry_setting[10], True)
-            else:
-                pass
-            api_lia.set_sens(self.main.liaHandle, self.sens_index)
-            api_lia.set_tc(self.main.liaHandle, self.tc_index)
-            api_lia.set_harm(self.main.liaHandle, entry_setting[11])
-            api_lia.set_phase(self.main.liaHandle, entry_setting[12])
+            pass
 
-            self.main.synInfo.full_info_query(self.main.synHandle)
-            self.main.liaInfo.full_info_query(self.main.liaHandle)
+        self.worker.tune(entry_setting)
 
-    def tune_syn_freq(self):
-            ''' Simply tune synthesizer frequency '''
+    def refresh_status(self, syn_info, lia_info):
+        ''' Take the instrument info queried by the acquisition thread, and
+            refresh [inst]Status Panels. Triggered by worker.tuned
+        '''
 
-            self.main.synInfo.probFreq = self.x[self.current_x_index] * 1e6
-            self.main.synInfo.synFreq = self.main.synInfo.probFreq / self.multiplier
-            self.main.synStatus.print_info()
+        self.main.synInfo = syn_info
+        self.main.liaInfo = lia_info
+        self.main.synStatus.print_info()
+        self.main.liaStatus.print_info()
 
-            if self.main.testModeAction.isChecked():
-                pass
-            else:
-                api_syn.set_syn_freq(self.main.synHandle, self.main.synInfo.synFreq)
+    def show_warning(self, text):
+        ''' Show a warning from the acquisition thread without blocking it '''
 
-            self.waitTimer.start()
+        msg = Shared.MsgWarning(self.main, 'Data acquisition', text)
+        msg.setModal(False)
+        msg.show()
 
-    def query_lockin(self):
-        ''' Query lockin data. Triggered by waitTimer.timeout() '''
+    def start_sweep(self):
+        ''' Send the rest of the current sweep to the acquisition thread,
+            starting at self.current_x_index
+        '''
 
-        # append data to data list
-        if self.main.testModeAction.isChecked():
-            self.y[self.current_x_index] = np.random.random_sample()
+        # current sweep is even average, decrease index (sweep backward)
+        if self.acquired_avg % 2:
+            index_list = np.arange(self.current_x_index, -1, -1)
+        # current sweep is odd average, increase index (sweep forward)
         else:
-            self.y[self.current_x_index] = api_lia.query_single_x(self.main.liaHandle)
-        # update plot
-        self.yCurve.setData(self.x, self.y)
-        # move to the next frequency, update freq index and average counter
-        self.next_freq()
-        # if done
-        if self.acquired_avg == self.target_avg:
-            self.save_data()
-            self.parent.batch_time_taken += ceil(len(self.x) * self.target_avg * self.waittime * 1e-3)
-            self.parent.next_entry_signal.emit()
+            index_list = np.arange(self.current_x_index, len(self.x))
+
+        # a new queue for every sweep, so that no sample of a cancelled
+        # sweep can leak into this one
+        self.data_queue = queue.Queue()
+        self.worker.sweep(self.x, index_list, self.waittime, self.data_queue)
+        self.drainTimer.start()
+
+    def drain(self):
+        ''' Consume samples from the acquisition thread.
+            Triggered by drainTimer.timeout()
+        '''
+
+        sweep_end = False
+        updated = False
+        # index range of updated points
+        idx_min = len(self.x)
+        idx_max = -1
+        while True:
+            try:
+                idx, value, timestamp = self.data_queue.get_nowait()
+            except queue.Empty:
+                break
+            if idx == SWEEP_END:
+                sweep_end = True
+                break
+            else:
+                self.y[idx] = value
+                self.current_x_index = idx
+                self.journal_idx.append(idx)
+                self.journal_val.append(value)
+                idx_min = min(idx_min, idx)
+                idx_max = max(idx_max, idx)
+                updated = True
+
+        if updated:
+            # update plot. The curve is redrawn at the next frame
+            self.yCurve.mark_dirty(idx_min, idx_max + 1)
+            self.main.synInfo.probFreq = self.x[self.current_x_index] * 1e6
+            self.main.synInfo.synFreq = self.main.synInfo.probFreq / self.multiplier
+            self.main.synStatus.print_info()
+            self.update_progress()
         else:
-            # tune syn to the next freq
-            self.tune_syn_freq()
+            pass
 
-    def next_freq(self):
-        ''' move to the next frequency point '''
+        if sweep_end:
+            self.next_sweep()
+        elif len(self.journal_idx) >= JOURNAL_CHUNK:
+            self.parent.journal.add_points(self.journal_id, self.acquired_avg,
+                                           self.journal_idx, self.journal_val)
+            self.journal_idx = []
+            self.journal_val = []
+        else:
+            pass
 
-        # current sweep is even average, decrease index (sweep backward)
+    def update_progress(self):
+        ''' Update progress bars '''
+
+        # current sweep is even average, sweeping backward
         if self.acquired_avg % 2:
             self.pts_taken = (self.acquired_avg+1)*len(self.x) - self.current_x_index
-            if self.current_x_index > 0:
-                self.current_x_index -= 1
-            else:
-                self.acquired_avg += 1
-                self.update_ysum()
-                self.y = np.zeros_like(self.x)
-        # current sweep is odd average, increase index (sweep forward)
+        # current sweep is odd average, sweeping forward
         else:
             self.pts_taken = self.acquired_avg*len(self.x) + self.current_x_index
-            if self.current_x_index < len(self.x)-1:
-                self.current_x_index += 1
-            else:
-                self.acquired_avg += 1
-                self.update_ysum()
-                self.y = np.zeros_like(self.x)
 
-        # update progress bar
         self.parent.currentProgBar.setValue(ceil(self.pts_taken * self.waittime * 1e-3))
         self.parent.totalProgBar.setValue(self.parent.batch_time_taken +
                                           ceil(self.pts_taken * self.waittime * 1e-3))
 
+    def next_sweep(self):
+        ''' Wrap up the finished sweep and start the next one '''
+
+        self.parent.journal.add_sweep(self.journal_id, self.acquired_avg, self.y)
+        self.journal_idx = []
+        self.journal_val = []
+        self.acquired_avg += 1
+        self.update_ysum()
+        self.y = np.zeros_like(self.x)
+        self.yCurve.set_data(self.x, self.y)
+        if self.snr_target:
+            self.update_plan()
+        else:
+            pass
+        # if done
+        if self.acquired_avg >= self.planned_avg:
+            self.drainTimer.stop()
+            self.save_data()
+            self.parent.refine_entry(self.x, self.y_sum / self.acquired_avg)
+            self.parent.batch_time_taken += ceil(len(self.x) * self.planned_avg * self.waittime * 1e-3)
+            self.parent.next_entry_signal.emit()
+        else:
+            # the turning point is taken again by the reversed sweep
+            self.start_sweep()
+            self.parent.save_checkpoint()
+
     def update_ysum(self):
         ''' Update sum plot '''
 
-        # add current y array to y_sum
+        # keep the sweep, and add current y array to y_sum
+        self.y_sweeps[self.acquired_avg - 1] = self.y
         self.y_sum += self.y
+        self.y_sqsum += self.y**2
         # update plot
-        self.ySumCurve.setData(self.x, self.y_sum)
+        self.ySumCurve.mark_dirty(0, len(self.y_sum))
+
+    def update_plan(self):
+        ''' Estimate the SNR, and update the planned averages needed to reach
+            the SNR target (between acquired averages and max averages).
+            Progress bars follow the new plan.
+        '''
+
+        snr = average.estimate_snr(self.y_sum, self.y_sqsum, self.acquired_avg)
+        # no noise estimate yet (or zero noise): keep the current plan
+        if snr > 0 and np.isfinite(snr):
+            planned_avg = average.plan_avg(snr, self.acquired_avg, self.snr_target)
+            planned_avg = min(max(planned_avg, self.acquired_avg), self.max_avg)
+            self.snrLabel.setText('SNR {:.1f} / {:g}, planned averages {:d}'.format(snr, self.snr_target, planned_avg))
+        else:
+            planned_avg = self.planned_avg
+
+        sweep_time = len(self.x) * self.waittime * 1e-3
+        self.parent.total_time += (planned_avg - self.planned_avg) * sweep_time
+        self.parent.totalProgBar.setRange(0, ceil(self.parent.total_time))
+        self.parent.currentProgBar.setRange(0, ceil(planned_avg * sweep_time))
+        self.planned_avg = planned_avg
+
+    def header_info(self, comment):
+        ''' Prepare the save.save_lwa header tuple of the current entry '''
+
+        if self.entry_setting[8] == 2:
+            mod_amp = self.entry_setting[10] * 1e-3
+        elif self.entry_setting[8] == 1:
+            mod_amp = self.entry_setting[10]
+        else:
+            mod_amp = 0
+
+        return (self.multiplier, self.waittime,
+                api_val.LIASENSLIST[self.sens_index],
+                api_val.LIATCLIST[self.tc_index]*1e-3,
+                self.entry_setting[9] * 1e-3, mod_amp,
+                api_syn.MOD_MODE_LIST[self.entry_setting[8]],
+                self.entry_setting[11], self.entry_setting[12],
+                self.x_min, self.step, self.acquired_avg, comment)
 
     def save_data(self):
         ''' Save data array '''
@@ -617,28 +1327,24 @@ class SingleScan(QtGui.QWidget):
         # Grab current comment (in case edited during the scan) before saving data
         entry = self.parent.batchListWidget.entryList[self.parent.current_entry_index]
 
-        if self.main.synInfo.modModeIndex == 2:
-            mod_amp = self.main.synInfo.modAmp * 1e-3
-        elif self.main.synInfo.modModeIndex == 1:
-            mod_amp = self.main.synInfo.modAmp
-        else:
-            mod_amp = 0
-
         # prepare header
-        h_info = (self.multiplier, self.waittime,
-                  api_val.LIASENSLIST[self.sens_index],
-                  api_val.LIATCLIST[self.tc_index]*1e-3,
-                  self.main.synInfo.modFreq * 1e-3, mod_amp,
-                  self.main.synInfo.modModeText,
-                  self.main.liaInfo.refHarm, self.main.liaInfo.refPhase,
-                  self.x_min, self.step, self.acquired_avg,
-                  entry.commentFill.text())
+        h_info = self.header_info(entry.commentFill.text())
 
         # if already finishes at least one sweep
         if self.acquired_avg > 0:
-            save.save_lwa(self.filename, self.y_sum / self.acquired_avg, h_info)
+            y_sweeps = self.y_sweeps[:self.acquired_avg]
+            y = average.combine_sweeps(y_sweeps, self.combineSel.currentIndex())
+        else:
+            y_sweeps = self.y[np.newaxis, :]
+            y = self.y
+        save.save_lwa(self.filename, y, h_info)
+
+        if self.saveSweepsCheck.isChecked():
+            store = npystore.store_name(self.filename)
+            npystore.save_entry(store, self.x, y, h_info, y_sweeps=y_sweeps)
         else:
-            save.save_lwa(self.filename, self.y, h_info)
+            pass
+        self.parent.journal.mark_saved(self.journal_id, self.acquired_avg)
 
     def pause_current(self, btn_pressed):
         ''' Pause/resume data acquisition '''
@@ -646,17 +1352,17 @@ class SingleScan(QtGui.QWidget):
         if btn_pressed:
             self.pauseButton.setText('Resume')
             #print('pause')
-            self.waitTimer.stop()
+            self.worker.pause()
         else:
             self.pauseButton.setText('Pause')
             #print('resume')
-            self.waitTimer.start()
+            self.worker.resume()
 
     def redo_current(self):
         ''' Erase current y array and restart a scan '''
 
         #print('redo current')
-        self.waitTimer.stop()
+        self.worker.cancel_sweep()
         if self.pauseButton.isChecked():
             self.pauseButton.click()
         else:
@@ -668,7 +1374,11 @@ class SingleScan(QtGui.QWidget):
             self.current_x_index = 0
 
         self.y = np.zeros_like(self.x)
-        self.tune_syn_freq()
+        self.yCurve.set_data(self.x, self.y)
+        # drop the buffered journal points of the cancelled sweep
+        self.journal_idx = []
+        self.journal_val = []
+        self.start_sweep()
 
     def restart_avg(self):
         ''' Erase all current averages and start over '''
@@ -679,22 +1389,31 @@ class SingleScan(QtGui.QWidget):
 
         if q == QtGui.QMessageBox.Yes:
             #print('restart average')
-            self.waitTimer.stop()
+            self.worker.cancel_sweep()
             self.acquired_avg = 0
             self.current_x_index = 0
             self.y = np.zeros_like(self.x)
             self.y_sum = np.zeros_like(self.x)
-            self.ySumCurve.setData(self.x, self.y_sum)
-            self.tune_syn_freq()
+            self.y_sqsum = np.zeros_like(self.x)
+            self.y_sweeps.fill(0)
+            self.yCurve.set_data(self.x, self.y)
+            self.ySumCurve.set_data(self.x, self.y_sum)
+            # cached averages are gone. Start over in the journal too
+            self.parent.journal.discard_entry(self.journal_id)
+            self.journal_id = self.parent.journal.begin_entry(self.x, self.header_info(self.current_comment))
+            self.journal_idx = []
+            self.journal_val = []
+            self.start_sweep()
+            self.parent.save_checkpoint()
         else:
             pass
 
     def save_current(self):
-        ''' Save what's got so far and continue '''
+        ''' Save what's got so far and continue.
+            The acquisition thread keeps running in the background.
+        '''
 
-        self.waitTimer.stop()
         self.save_data()
-        self.waitTimer.start()
 
     def jump(self):
         ''' Jump to next batch item '''
@@ -705,14 +1424,17 @@ class SingleScan(QtGui.QWidget):
 
         if q == QtGui.QMessageBox.Yes:
             #print('abort current')
-            self.waitTimer.stop()
-            self.parent.batch_time_taken += ceil(len(self.x) * self.target_avg * self.waittime * 1e-3)
+            self.worker.cancel_sweep()
+            self.drainTimer.stop()
+            self.parent.batch_time_taken += ceil(len(self.x) * self.planned_avg * self.waittime * 1e-3)
             self.save_data()
             self.parent.next_entry_signal.emit()
         elif q == QtGui.QMessageBox.No:
             #print('abort current')
-            self.waitTimer.stop()
-            self.parent.batch_time_taken += ceil(len(self.x) * self.target_avg * self.waittime * 1e-3)
+            self.worker.cancel_sweep()
+            self.drainTimer.stop()
+            self.parent.journal.discard_entry(self.journal_id)
+            self.parent.batch_time_taken += ceil(len(self.x) * self.planned_avg * self.waittime * 1e-3)
             self.parent.next_entry_signal.emit()
         else:
             pass
@@ -0,0 +1,239 @@
+#! encoding = utf-8
+
+''' Lockin settle time calibration routine '''
+
+
+from PyQt5 import QtGui, QtCore
+import numpy as np
+import time
+from math import ceil
+import pyqtgraph as pg
+from gui import SharedWidgets as Shared
+from api import validator as api_val
+from api import lockin as api_lia
+from api import synthesizer as api_syn
+from data import settle
+
+
+# lockin buffer sample rate during the calibration: index 13, 512 Hz
+CALIB_SRATE_INDEX = 13
+CALIB_SRATE = 512
+
+# lockin output recorded before the frequency step (s)
+PRE_STEP = 0.2
+
+# record length after the frequency step, in time constants per filter pole
+RECORD_TC = 5
+
+# minimum record length after the frequency step (s)
+MIN_RECORD = 0.2
+
+
+class SettleCalibDialog(QtGui.QDialog):
+    ''' Calibrate the minimum safe dwell time of lockin scans.
+        The synthesizer steps onto a strong line, and the lockin output is
+        recorded by the lockin buffer at high sample rate. The step response
+        is fitted and the settle time is stored in the settle time table.
+    '''
+
+    def __init__(self, main=None):
+        QtGui.QDialog.__init__(self, main)
+        self.main = main
+        self.setWindowTitle('Settle time calibration')
+        self.setMinimumSize(900, 600)
+        self.table = settle.load_table()
+        self.worker = None
+
+        self.freqFill = QtGui.QLineEdit('{:.3f}'.format(self.main.synInfo.probFreq*1e-6))
+        self.freqFill.setToolTip('Tune on a strong line. The synthesizer steps onto this frequency')
+        self.stepsFill = QtGui.QLineEdit('0.01, 0.1, 1')
+        self.tcMinSel = Shared.LIATCBox()
+        self.tcMaxSel = Shared.LIATCBox()
+        self.tcMinSel.setCurrentIndex(self.main.liaInfo.tcIndex)
+        self.tcMaxSel.setCurrentIndex(self.main.liaInfo.tcIndex)
+        self.slopeSel = QtGui.QComboBox()
+        self.slopeSel.addItems(api_lia.LPSLOPE_LIST)
+        self.slopeSel.setCurrentIndex(self.main.liaInfo.lpSlopeIndex)
+        self.statusLabel = QtGui.QLabel()
+        settingLayout = QtGui.QFormLayout()
+        settingLayout.addRow(QtGui.QLabel('Line Frequency (MHz)'), self.freqFill)
+        settingLayout.addRow(QtGui.QLabel('Step Sizes (MHz)'), self.stepsFill)
+        settingLayout.addRow(QtGui.QLabel('Time Const From'), self.tcMinSel)
+        settingLayout.addRow(QtGui.QLabel('Time Const To'), self.tcMaxSel)
+        settingLayout.addRow(QtGui.QLabel('LP Slope'), self.slopeSel)
+        settingLayout.addRow(self.statusLabel)
+        settingPanel = QtGui.QWidget()
+        settingPanel.setLayout(settingLayout)
+
+        self.startButton = QtGui.QPushButton('Start')
+        self.stopButton = QtGui.QPushButton('Stop')
+        closeButton = QtGui.QPushButton('Close')
+        buttonLayout = QtGui.QHBoxLayout()
+        buttonLayout.addWidget(self.startButton)
+        buttonLayout.addWidget(self.stopButton)
+        buttonLayout.addWidget(closeButton)
+        buttons = QtGui.QWidget()
+        buttons.setLayout(buttonLayout)
+
+        self.pgPlot = pg.PlotWidget(title='Step Response')
+        self.pgPlot.setLabel('left', text='Lockin Signal', units='V')
+        self.pgPlot.setLabel('bottom', text='Time', units='s')
+        self.dataCurve = self.pgPlot.plot()
+        self.fitCurve = self.pgPlot.plot()
+        self.fitCurve.setPen(pg.mkPen(219, 112, 147))
+
+        mainLayout = QtGui.QGridLayout()
+        mainLayout.addWidget(settingPanel, 0, 0)
+        mainLayout.addWidget(self.pgPlot, 0, 1)
+        mainLayout.addWidget(buttons, 1, 0, 1, 2)
+        self.setLayout(mainLayout)
+
+        self.startButton.clicked.connect(self.start)
+        self.stopButton.clicked.connect(self.stop)
+        closeButton.clicked.connect(self.reject)
+
+    def start(self):
+
+        code, freq = api_val.val_float(self.freqFill.text(), safe=[('>', 0)])
+        try:
+            steps = [float(text) for text in self.stepsFill.text().split(',')]
+        except ValueError:
+            steps = []
+        if code == 2 and steps and min(steps) > 0:
+            pass
+        else:
+            msg = Shared.MsgError(self, 'Invalid input!', 'Please fix invalid inputs before proceeding.')
+            msg.exec_()
+            return None
+
+        tc_min = min(self.tcMinSel.currentIndex(), self.tcMaxSel.currentIndex())
+        tc_max = max(self.tcMinSel.currentIndex(), self.tcMaxSel.currentIndex())
+        combos = [(tc_index, step) for tc_index in range(tc_min, tc_max+1) for step in steps]
+
+        self.worker = SettleCalibWorker(freq, combos, self.slopeSel.currentIndex(), main=self.main)
+        self.worker.measured.connect(self.fit)
+        self.worker.finished.connect(self.calib_finished)
+        self.startButton.setEnabled(False)
+        self.statusLabel.setText('Calibrating...')
+        self.worker.start()
+
+    def stop(self):
+
+        if self.worker:
+            self.worker.stop()
+        else:
+            pass
+
+    def fit(self, tc_index, step, t, y):
+        ''' Fit a step response and store the settle time '''
+
+        slope_index = self.slopeSel.currentIndex()
+        self.dataCurve.setData(t, y)
+        try:
+            settle_time, popt = settle.fit_settle_time(t, y, slope_index, api_val.LIATCLIST[tc_index]*1e-3)
+        except (RuntimeError, ValueError):
+            self.statusLabel.setText('TC {:s}, step {:g} MHz: fit failed'.format(api_lia.TC_LIST[tc_index], step))
+            return None
+
+        self.fitCurve.setData(t, settle.step_response(t, *popt, n_pole=slope_index+1))
+        settle.set_dwell(self.table, tc_index, slope_index, step, ceil(settle_time))
+        settle.save_table(self.table)
+        self.statusLabel.setText('TC {:s}, step {:g} MHz: settle time {:.0f} ms'.format(api_lia.TC_LIST[tc_index], step, settle_time))
+
+    def calib_finished(self):
+
+        self.startButton.setEnabled(True)
+        self.worker = None
+        msg = Shared.MsgInfo(self, 'Calibration Finished!',
+                             'Settle times are saved to {:s}'.format(settle.SETTLE_TABLE_FILE))
+        msg.exec_()
+
+    def reject(self):
+
+        self.stop()
+        if self.worker:
+            self.worker.wait()
+        else:
+            pass
+        self.accept()
+
+
+class SettleCalibWorker(QtCore.QThread):
+    ''' Measure step responses in a separate thread.
+        Restores the lockin time constant, lp slope and the synthesizer
+        frequency when done.
+    '''
+
+    # (tc_index, step <MHz>, t <s>, y <V>) of each step response
+    measured = QtCore.pyqtSignal(int, float, object, object)
+
+    def __init__(self, freq, combos, slope_index, main=None):
+        ''' Arguments
+                freq: mm frequency of the line (MHz), float
+                combos: list of (tc_index, step <MHz>) to be calibrated
+                slope_index: int, index in api_lia.LPSLOPE_LIST
+        '''
+        QtCore.QThread.__init__(self)
+        self.main = main
+        self.freq = freq
+        self.combos = combos
+        self.slope_index = slope_index
+        self.synHandle = main.synHandle
+        self.liaHandle = main.liaHandle
+        self.test_mode = main.testModeAction.isChecked()
+        self.multiplier = main.synInfo.vdiBandMultiplication
+        self._stopped = False
+
+    def stop(self):
+
+        self._stopped = True
+
+    def run(self):
+
+        for tc_index, step in self.combos:
+            if self._stopped:
+                break
+            t, y = self._measure(tc_index, step)
+            if len(y):
+                self.measured.emit(tc_index, step, t, y)
+            else:
+                pass
+
+        if self.test_mode:
+            pass
+        else:
+            api_lia.set_tc(self.liaHandle, self.main.liaInfo.tcIndex)
+            api_lia.set_lp_slope(self.liaHandle, self.main.liaInfo.lpSlopeIndex)
+            api_syn.set_syn_freq(self.synHandle, self.main.synInfo.synFreq)
+
+    def _measure(self, tc_index, step):
+        ''' Step the synthesizer onto the line from freq - step, and record
+            the lockin output.
+            Returns
+                t: time after the frequency step (s), np.array
+                y: lockin output (V), np.array
+        '''
+
+        tc = api_val.LIATCLIST[tc_index] * 1e-3
+        record = max(RECORD_TC * tc * (self.slope_index + 1), MIN_RECORD)
+
+        if self.test_mode:
+            t = np.arange(-PRE_STEP, record, 1/CALIB_SRATE)
+            y = settle.step_response(t, 0, 1e-3, 0.01, tc, self.slope_index+1)
+            return t, y + np.random.normal(0, 1e-5, len(t))
+        else:
+            api_lia.set_tc(self.liaHandle, tc_index)
+            api_lia.set_lp_slope(self.liaHandle, self.slope_index)
+            api_syn.set_syn_freq(self.synHandle, (self.freq - step) * 1e6 / self.multiplier)
+            time.sleep(record)
+            api_lia.init_buffer(self.liaHandle, srate_index=CALIB_SRATE_INDEX)
+            api_lia.start_buffer(self.liaHandle)
+            t_start = time.perf_counter()
+            time.sleep(PRE_STEP)
+            t_step = time.perf_counter() - t_start
+            api_syn.set_syn_freq(self.synHandle, self.freq * 1e6 / self.multiplier)
+            time.sleep(record)
+            api_lia.pause_buffer(self.liaHandle)
+            y = api_lia.read_buffer(self.liaHandle, api_lia.read_buffer_len(self.liaHandle))
+            t = np.arange(len(y)) / CALIB_SRATE - t_step
+            return t, y
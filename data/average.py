@@ -0,0 +1,144 @@
+#! encoding = utf-8
+
+''' Combine the sweeps of a scan window into one spectrum '''
+
+import numpy as np
+from math import ceil
+
+
+# sweep combination modes
+# 0: plain mean
+# 1: median of each point
+# 2: mean of each point, excluding outliers beyond CLIP_SIGMA
+# 3: mean of all sweeps but the one deviating the most from the median
+COMBINE_MODE_LIST = ['Mean', 'Median', 'Sigma-clipped mean', 'Drop worst sweep']
+
+# outlier threshold of the sigma-clipped mean, in standard deviations
+CLIP_SIGMA = 3
+
+# scale factor from the median absolute deviation to the standard deviation
+MAD_TO_SIGMA = 1.4826
+
+# minimum number of sweeps to estimate the noise
+SNR_MIN_AVG = 2
+
+
+def combine_sweeps(y_sweeps, mode=0):
+    ''' Combine sweeps into one spectrum.
+        Robust modes fall back to the mean if there are less than 3 sweeps.
+        Arguments
+            y_sweeps: 2D np.array, (number of sweeps, number of points)
+            mode: int, index in COMBINE_MODE_LIST
+        Returns
+            y: combined spectrum, np.array
+    '''
+
+    y_sweeps = np.asarray(y_sweeps, dtype=float)
+
+    if len(y_sweeps) < 3 or mode == 0:
+        return np.mean(y_sweeps, axis=0)
+    elif mode == 1:
+        return np.median(y_sweeps, axis=0)
+    elif mode == 2:
+        return clipped_mean(y_sweeps)
+    elif mode == 3:
+        worst = np.argmax(sweep_deviation(y_sweeps))
+        return np.mean(np.delete(y_sweeps, worst, axis=0), axis=0)
+    else:
+        return np.mean(y_sweeps, axis=0)
+
+
+def clipped_mean(y_sweeps, nsigma=CLIP_SIGMA):
+    ''' Mean of each point excluding outliers. The spread of each point is
+        estimated by the median absolute deviation across sweeps.
+        Quantized readings often give a point no spread at all (MAD = 0),
+        so the spread is floored by the median spread over the window,
+        or by the smallest deviation if most points have no spread.
+    '''
+
+    y_median = np.median(y_sweeps, axis=0)
+    dev = np.abs(y_sweeps - y_median)
+    sigma = np.median(dev, axis=0) * MAD_TO_SIGMA
+    floor = np.median(sigma)
+    if floor > 0:
+        pass
+    elif np.any(dev > 0):
+        floor = np.min(dev[dev > 0]) * MAD_TO_SIGMA
+    else:
+        # all sweeps are identical
+        return y_median
+    mask = dev > nsigma * np.maximum(sigma, floor)
+    n_kept = np.sum(~mask, axis=0)
+
+    return np.sum(np.where(mask, 0, y_sweeps), axis=0) / n_kept
+
+
+def sweep_deviation(y_sweeps):
+    ''' RMS deviation of each sweep from the median spectrum '''
+
+    y_median = np.median(y_sweeps, axis=0)
+
+    return np.sqrt(np.mean((y_sweeps - y_median)**2, axis=1))
+
+
+def estimate_snr(y_sum, y_sqsum, n):
+    ''' Estimate the SNR of the averaged spectrum from running sums.
+        The noise of each point is its standard deviation across sweeps.
+        Lines only cover a small part of a window, so the median variance
+        over the window is taken as the noise level. The signal is the
+        largest deviation of the averaged spectrum from its median.
+        Arguments
+            y_sum: sum of sweeps, np.array
+            y_sqsum: sum of squared sweeps, np.array
+            n: number of sweeps, int
+        Returns
+            snr: float. 0 if there are less than SNR_MIN_AVG sweeps, or
+                 if the noise is 0 (dead detector, overload, clipped
+                 or constant signal), which carries no information
+    '''
+
+    if n < SNR_MIN_AVG:
+        return 0
+
+    y_mean = y_sum / n
+    var = (y_sqsum - y_sum * y_mean) / (n - 1)
+    # the median of the sample variance is biased low with few sweeps.
+    # Correct it by the median of chi-square with n-1 degrees of freedom
+    k = n - 1
+    noise = np.sqrt(max(np.median(var), 0) / (1 - 2 / (9 * k))**3 / n)
+    signal = np.max(np.abs(y_mean - np.median(y_mean)))
+
+    if noise > 0 and np.isfinite(noise):
+        return signal / noise
+    else:
+        return 0
+
+
+def plan_avg(snr, n, snr_target):
+    ''' Number of sweeps needed to reach snr_target, given the SNR of n
+        sweeps. The SNR grows with the square root of the sweep number.
+        Keeps n if the SNR is unknown (0 or not finite).
+    '''
+
+    if snr > 0 and np.isfinite(snr):
+        return ceil(n * (snr_target / snr)**2)
+    else:
+        return n
+
+
+def spectrum_noise(y):
+    ''' Estimate the noise of a single spectrum from the differences of
+        neighbouring points. Lines only cover a small part of a window,
+        so the median absolute difference is taken.
+        Returns
+            sigma: noise standard deviation, float. nan if y has less than 3 points
+    '''
+
+    y = np.asarray(y, dtype=float)
+    y = y[np.isfinite(y)]
+    if len(y) < 3:
+        return np.nan
+
+    diff = np.diff(y)
+    # the difference of two points has sqrt(2) times the noise of each
+    return np.median(np.abs(diff - np.median(diff))) * MAD_TO_SIGMA / np.sqrt(2)
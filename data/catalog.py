@@ -0,0 +1,283 @@
+#! encoding = utf-8
+
+''' Catalog of scans across lwa files.
+
+The catalog is a SQLite database holding the header of every scan entry of
+the cataloged lwa files. The frequency coverage of the scans is indexed by
+an R*Tree, so that "which scans cover this frequency" is answered without
+opening any lwa file. The R*Tree stores 32-bit floats rounded outwards, so
+its candidates are checked against the exact frequencies of the scans.
+
+A file is indexed again only if its size or mtime changed. If the file only
+grew, only the new entries are added.
+
+The stopf column is the last sampled frequency, startf + step*(pts-1).
+It is one step below the stop frequency listed by lwaparser.scan_header,
+which is startf + step*pts.
+'''
+
+import os
+import sqlite3
+import datetime
+from data import lwaparser
+
+
+CATALOG_FILE = os.path.join(os.path.expanduser('~'), '.pyspec', 'catalog.sqlite')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    file_id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER,
+    mtime INTEGER
+);
+CREATE TABLE IF NOT EXISTS scans (
+    scan_id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    scan_num INTEGER,
+    offset INTEGER,
+    comment TEXT,
+    date TEXT,
+    time TEXT,
+    it REAL,
+    sens REAL,
+    tc REAL,
+    mmode TEXT,
+    mf REAL,
+    ma REAL,
+    harm INTEGER,
+    phase REAL,
+    startf REAL,
+    stopf REAL,
+    step REAL,
+    pts INTEGER,
+    avg INTEGER
+);
+CREATE INDEX IF NOT EXISTS scans_file ON scans (file_id, scan_num);
+CREATE INDEX IF NOT EXISTS scans_date ON scans (date);
+CREATE VIRTUAL TABLE IF NOT EXISTS scan_range USING rtree(scan_id, fmin, fmax);
+'''
+
+# PRAGMA user_version of the catalog.
+# 1: stopf is the last sampled frequency
+CATALOG_VERSION = 1
+
+SCAN_COLUMNS = ('scan_num', 'offset', 'comment', 'date', 'time', 'it', 'sens',
+                'tc', 'mmode', 'mf', 'ma', 'harm', 'phase', 'startf', 'stopf',
+                'step', 'pts', 'avg')
+
+
+def connect(filename=CATALOG_FILE):
+    ''' Open the catalog database. The database is created if it does not exist.
+        Returns
+            conn: sqlite3.Connection
+    '''
+
+    if filename == ':memory:':
+        pass
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+    conn = sqlite3.connect(filename)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    if conn.execute('PRAGMA user_version').fetchone()[0] < CATALOG_VERSION:
+        # older catalogs stored stopf one step past the last point
+        with conn:
+            conn.execute('UPDATE scans SET stopf = startf + step*(pts - 1)')
+            conn.execute('DELETE FROM scan_range')
+            conn.execute('INSERT INTO scan_range SELECT scan_id, MIN(startf, stopf), MAX(startf, stopf) FROM scans')
+        conn.execute('PRAGMA user_version = {:d}'.format(CATALOG_VERSION))
+    else:
+        pass
+
+    return conn
+
+
+def _iso_date(date):
+    ''' Convert the lwa date (mm-dd-yyyy) to ISO format for comparisons.
+        Returns None if the date is invalid
+    '''
+
+    try:
+        return datetime.datetime.strptime(date, lwaparser.DATE_FMT).date().isoformat()
+    except ValueError:
+        return None
+
+
+def _insert_scans(conn, file_id, records, first_num):
+    ''' Insert index records of a file, starting at scan # first_num '''
+
+    for scan_num, record in enumerate(records, start=first_num):
+        # last sampled frequency
+        stopf = record['startf'] + record['step']*(record['pts'] - 1)
+        values = (scan_num, record['offset'], record['comment'], _iso_date(record['date']),
+                  record['time'], record['it'], record['sens'], record['tc'],
+                  record['mmode'], record['mf'], record['ma'], record['harm'],
+                  record['phase'], record['startf'], stopf, record['step'],
+                  record['pts'], record['avg'])
+        cursor = conn.execute('INSERT INTO scans (file_id, {:s}) VALUES (?{:s})'.format(
+                              ', '.join(SCAN_COLUMNS), ', ?'*len(SCAN_COLUMNS)),
+                              (file_id,) + values)
+        conn.execute('INSERT INTO scan_range VALUES (?, ?, ?)',
+                     (cursor.lastrowid, min(record['startf'], stopf), max(record['startf'], stopf)))
+
+
+def _delete_scans(conn, file_id, first_num=1):
+    ''' Delete scans of a file from scan # first_num on '''
+
+    conn.execute('DELETE FROM scan_range WHERE scan_id IN '
+                 '(SELECT scan_id FROM scans WHERE file_id = ? AND scan_num >= ?)',
+                 (file_id, first_num))
+    conn.execute('DELETE FROM scans WHERE file_id = ? AND scan_num >= ?', (file_id, first_num))
+
+
+def update_file(conn, path):
+    ''' Catalog an lwa file, or update it if it changed.
+        Arguments
+            conn: sqlite3.Connection
+            path: lwa file name, str
+        Returns
+            n: number of scans added, int
+    '''
+
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    row = conn.execute('SELECT file_id, size, mtime FROM files WHERE path = ?', (path,)).fetchone()
+    if row and row['size'] == stat.st_size and row['mtime'] == stat.st_mtime_ns:
+        return 0
+    else:
+        pass
+
+    records = lwaparser.load_index(path)
+    with conn:
+        if row:
+            file_id = row['file_id']
+            # keep the scans that are still at the same place in the file
+            kept = 0
+            for scan in conn.execute('SELECT offset, comment, date, time FROM scans '
+                                     'WHERE file_id = ? ORDER BY scan_num', (file_id,)):
+                if (kept < len(records) and scan['offset'] == records[kept]['offset']
+                        and scan['comment'] == records[kept]['comment']
+                        and scan['time'] == records[kept]['time']):
+                    kept += 1
+                else:
+                    break
+            # the last kept scan may have grown
+            kept = max(kept - 1, 0)
+            _delete_scans(conn, file_id, kept + 1)
+            conn.execute('UPDATE files SET size = ?, mtime = ? WHERE file_id = ?',
+                         (stat.st_size, stat.st_mtime_ns, file_id))
+        else:
+            kept = 0
+            file_id = conn.execute('INSERT INTO files (path, size, mtime) VALUES (?, ?, ?)',
+                                   (path, stat.st_size, stat.st_mtime_ns)).lastrowid
+        _insert_scans(conn, file_id, records[kept:], kept + 1)
+
+    return len(records) - kept
+
+
+def remove_file(conn, path):
+    ''' Remove a file and its scans from the catalog '''
+
+    with conn:
+        row = conn.execute('SELECT file_id FROM files WHERE path = ?',
+                           (os.path.abspath(path),)).fetchone()
+        if row:
+            _delete_scans(conn, row['file_id'])
+            conn.execute('DELETE FROM files WHERE file_id = ?', (row['file_id'],))
+        else:
+            pass
+
+
+def update_catalog(conn, paths=None):
+    ''' Catalog lwa files and directories.
+        Arguments
+            conn: sqlite3.Connection
+            paths: list of lwa file or directory names. Directories are
+                   searched recursively for lwa files
+                   (.lwa, .lwa.gz, .lwa.xz).
+                   Default: all files already in the catalog.
+                   Cataloged files that no longer exist are removed.
+        Returns
+            n: number of scans added, int
+    '''
+
+    if paths is None:
+        paths = [row['path'] for row in conn.execute('SELECT path FROM files')]
+    else:
+        pass
+
+    n = 0
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith(lwaparser.LWA_EXTS):
+                        n += update_file(conn, os.path.join(root, name))
+                    else:
+                        pass
+        elif os.path.isfile(path):
+            n += update_file(conn, path)
+        else:
+            remove_file(conn, path)
+
+    return n
+
+
+def query(conn, freq=None, freq_range=None, date_range=None, mmode=None, harm=None):
+    ''' Find scans in the catalog.
+        Arguments
+            conn: sqlite3.Connection
+            freq: mm frequency covered by the scan (MHz), float
+            freq_range: (min, max) mm frequency (MHz). Scans overlapping the
+                        range are found
+            date_range: (first, last) datetime.date of the scan, inclusive
+            mmode: modulation mode, str ('NONE', 'AM', 'FM')
+            harm: lockin harmonics, int
+            None skips the filter
+        Returns
+            scans: list of sqlite3.Row with keys path & SCAN_COLUMNS,
+                   ordered by start frequency
+    '''
+
+    sql = ('SELECT files.path, {:s} FROM scans JOIN files USING (file_id)'.format(
+           ', '.join('scans.' + col for col in SCAN_COLUMNS)))
+    conditions = []
+    args = []
+
+    if freq is None:
+        pass
+    else:
+        freq_range = (freq, freq)
+    if freq_range:
+        # rtree candidates, then the exact frequency check
+        sql += ' JOIN scan_range ON scan_range.scan_id = scans.scan_id'
+        conditions.append('scan_range.fmax >= ? AND scan_range.fmin <= ?')
+        conditions.append('MAX(scans.startf, scans.stopf) >= ? AND MIN(scans.startf, scans.stopf) <= ?')
+        args.extend(freq_range)
+        args.extend(freq_range)
+    else:
+        pass
+    if date_range:
+        conditions.append('scans.date BETWEEN ? AND ?')
+        args.extend(date.isoformat() for date in date_range)
+    else:
+        pass
+    if mmode is None:
+        pass
+    else:
+        conditions.append('scans.mmode = ?')
+        args.append(mmode)
+    if harm is None:
+        pass
+    else:
+        conditions.append('scans.harm = ?')
+        args.append(harm)
+
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    else:
+        pass
+    sql += ' ORDER BY scans.startf'
+
+    return conn.execute(sql, args).fetchall()
@@ -0,0 +1,56 @@
+#! encoding = utf-8
+
+''' Checkpoint of batch scan jobs.
+
+A checkpoint is a single .npz file holding the batch state as a JSON
+string (key 'state') and the data arrays. It is written to a temporary
+file and moved over the old checkpoint, so that a crash during the write
+never leaves a broken checkpoint behind.
+'''
+
+import os
+import json
+import numpy as np
+from data import save
+
+
+CHECKPOINT_EXT = '.checkpoint.npz'
+
+
+def save_checkpoint(filename, state, **arrays):
+    ''' Save a checkpoint.
+        Arguments
+            filename: str
+            state: dict of JSON serializable batch state
+            arrays: np.array data to be saved along with the state
+    '''
+
+    tmp_name = filename + '.tmp'
+    with open(tmp_name, 'wb') as f:
+        np.savez(f, state=np.array(json.dumps(state, default=save.to_builtin)), **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_name, filename)
+
+
+def load_checkpoint(filename):
+    ''' Load a checkpoint.
+        Returns
+            state: dict
+            arrays: dict of np.array
+    '''
+
+    with np.load(filename) as npz:
+        state = json.loads(str(npz['state']))
+        arrays = {key: npz[key] for key in npz.files if key != 'state'}
+
+    return state, arrays
+
+
+def remove_checkpoint(filename):
+    ''' Remove the checkpoint once the job is done '''
+
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
@@ -0,0 +1,279 @@
+#! encoding = utf-8
+
+''' Append-only binary journal of in-progress scans.
+
+The journal keeps every finished sweep (and chunks of the running sweep)
+of a JPL lockin scan on disk, so that a batch job can be recovered if the
+program dies before the data is saved into the .lwa file.
+
+File layout: JOURNAL_MAGIC, followed by records.
+Each record is a RECORD_HEAD (type, payload length, crc32 of payload)
+followed by the payload:
+    REC_ENTRY:  entry id, json length, json header, x (float64)
+    REC_POINTS: entry id, sweep #, indices (uint32), values (float64)
+    REC_SWEEP:  entry id, sweep #, y (float64)
+    REC_SAVED:  entry id, number of sweeps saved in the lwa file
+A truncated or corrupted record marks the end of the journal.
+
+Recover a journal from the command line:
+    python -m data.journal scan.lwa.journal -o recovered.lwa
+'''
+
+import os
+import json
+import queue
+import struct
+import threading
+import zlib
+import argparse
+import numpy as np
+from data import save
+
+
+JOURNAL_MAGIC = b'PYSPECJ1'
+JOURNAL_EXT = '.journal'
+RECORD_HEAD = struct.Struct('<BII')
+ID_HEAD = struct.Struct('<II')
+
+REC_ENTRY = 1
+REC_POINTS = 2
+REC_SWEEP = 3
+REC_SAVED = 4
+
+# saved sweep number of an entry discarded by the user
+DISCARDED = 0xFFFFFFFF
+
+
+class Journal():
+    ''' Journal writer. Records are serialized in the calling thread and
+        written to disk by a background thread, so that disk access never
+        blocks data acquisition.
+    '''
+
+    def __init__(self, filename):
+
+        self.filename = filename
+        self.entry_count = 0
+        self._queue = queue.Queue()
+
+        if os.path.isfile(filename):
+            entries, end = _read(filename)
+            # cut off a truncated record left by a crash
+            os.truncate(filename, end)
+            # continue the entry numbering of the existing journal
+            self.entry_count = len(entries)
+        else:
+            end = 0
+        self._file = open(filename, 'ab')
+        if end:
+            pass
+        else:
+            self._file.write(JOURNAL_MAGIC)
+
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def begin_entry(self, x, h_info):
+        ''' Start a new scan entry.
+            Arguments
+                x: mm frequency array (MHz), np.array
+                h_info: save.save_lwa header tuple. The average number
+                        is filled in at recovery.
+            Returns
+                entry_id: int
+        '''
+
+        entry_id = self.entry_count
+        self.entry_count += 1
+        header = json.dumps({'h_info': list(h_info)}, default=save.to_builtin).encode('utf-8')
+        self._put(REC_ENTRY, ID_HEAD.pack(entry_id, len(header)) + header +
+                  np.asarray(x, dtype='<f8').tobytes())
+        return entry_id
+
+    def add_points(self, entry_id, sweep, indices, values):
+        ''' Record points of the running sweep '''
+
+        self._put(REC_POINTS, ID_HEAD.pack(entry_id, sweep) +
+                  np.asarray(indices, dtype='<u4').tobytes() +
+                  np.asarray(values, dtype='<f8').tobytes())
+
+    def add_sweep(self, entry_id, sweep, y):
+        ''' Record a finished sweep '''
+
+        self._put(REC_SWEEP, ID_HEAD.pack(entry_id, sweep) +
+                  np.asarray(y, dtype='<f8').tobytes())
+
+    def mark_saved(self, entry_id, n_sweeps):
+        ''' Record that the first n_sweeps sweeps are saved in the lwa file '''
+
+        self._put(REC_SAVED, ID_HEAD.pack(entry_id, n_sweeps))
+
+    def discard_entry(self, entry_id):
+        ''' Record that the entry is discarded and must not be recovered '''
+
+        self.mark_saved(entry_id, DISCARDED)
+
+    def close(self):
+        ''' Write out pending records and close the file '''
+
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+
+    def _put(self, rec_type, payload):
+
+        self._queue.put(RECORD_HEAD.pack(rec_type, len(payload),
+                                         zlib.crc32(payload)) + payload)
+
+    def _write_loop(self):
+
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            else:
+                self._file.write(record)
+            # sync once the queue is empty, so that bursts share one fsync
+            if self._queue.empty():
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            else:
+                pass
+
+        self._file.flush()
+
+
+def remove_journal(filename):
+    ''' Remove the journal once all its entries are saved in the lwa file '''
+
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+def read_journal(filename):
+    ''' Read scan entries from a journal.
+        Returns
+            entries: list of dict with keys
+                x: mm frequency array (MHz), np.array
+                h_info: save.save_lwa header tuple
+                sweeps: list of finished sweeps (np.array)
+                partial: last unfinished sweep, np.array or None
+                saved: number of sweeps already saved in the lwa file,
+                       DISCARDED if the entry is discarded
+    '''
+
+    return _read(filename)[0]
+
+
+def _read(filename):
+    ''' Read scan entries from a journal.
+        Returns
+            entries: see read_journal
+            end: byte length of the valid part of the journal, int
+    '''
+
+    entries = []
+    with open(filename, 'rb') as f:
+        if f.read(len(JOURNAL_MAGIC)) != JOURNAL_MAGIC:
+            return entries, 0
+        else:
+            end = f.tell()
+
+        while True:
+            head = f.read(RECORD_HEAD.size)
+            if len(head) < RECORD_HEAD.size:
+                break
+            rec_type, length, crc = RECORD_HEAD.unpack(head)
+            payload = f.read(length)
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            end = f.tell()
+            entry_id, arg = ID_HEAD.unpack_from(payload)
+            body = payload[ID_HEAD.size:]
+
+            if rec_type == REC_ENTRY:
+                header = json.loads(body[:arg].decode('utf-8'))
+                entries.append({'x': np.frombuffer(body[arg:], dtype='<f8'),
+                                'h_info': tuple(header['h_info']),
+                                'sweeps': [], 'partial': None, 'saved': 0})
+            elif entry_id >= len(entries):
+                # record of an entry whose header is lost
+                continue
+            elif rec_type == REC_POINTS:
+                entry = entries[entry_id]
+                if len(entry['sweeps']) == arg:
+                    if entry['partial'] is None:
+                        entry['partial'] = np.zeros_like(entry['x'])
+                    else:
+                        pass
+                    n = len(body) // 12
+                    idx = np.frombuffer(body[:n*4], dtype='<u4')
+                    entry['partial'][idx] = np.frombuffer(body[n*4:], dtype='<f8')
+                else:
+                    pass
+            elif rec_type == REC_SWEEP:
+                entry = entries[entry_id]
+                entry['sweeps'].append(np.frombuffer(body, dtype='<f8'))
+                entry['partial'] = None
+            elif rec_type == REC_SAVED:
+                entries[entry_id]['saved'] = arg
+            else:
+                pass
+
+    return entries, end
+
+
+def recover(filename, lwa_file, include_saved=False):
+    ''' Rebuild scan entries from a journal and append them to lwa_file.
+        Entries with finished sweeps are saved as the average of all sweeps.
+        Entries without any finished sweep are saved with the partial sweep.
+        Arguments
+            filename: journal file name, str
+            lwa_file: output lwa file name, str
+            include_saved: bool, also recover entries that have been saved
+        Returns
+            n: number of recovered entries, int
+    '''
+
+    n = 0
+    for entry in read_journal(filename):
+        if entry['saved'] == DISCARDED:
+            continue
+        acquired_avg = len(entry['sweeps'])
+        if acquired_avg > 0:
+            y = np.sum(entry['sweeps'], axis=0) / acquired_avg
+        elif entry['partial'] is not None:
+            y = entry['partial']
+        else:
+            continue
+
+        if (acquired_avg > entry['saved'] or (acquired_avg == 0 and entry['partial'] is not None)
+                or include_saved):
+            h_info = entry['h_info'][:11] + (acquired_avg,) + entry['h_info'][12:]
+            save.save_lwa(lwa_file, y, h_info)
+            n += 1
+        else:
+            pass
+
+    return n
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Recover scans from a PySpec journal file')
+    parser.add_argument('journal', help='Journal file name')
+    parser.add_argument('-o', '--out', nargs=1, help='Output lwa file name. Default: journal name without {:s}'.format(JOURNAL_EXT))
+    parser.add_argument('-all', action='store_true', help='Also recover entries that have been saved')
+    args = parser.parse_args()
+
+    if args.out:
+        out_name = args.out[0]
+    elif args.journal.endswith(JOURNAL_EXT):
+        out_name = args.journal[:-len(JOURNAL_EXT)]
+    else:
+        out_name = args.journal + '.lwa'
+
+    n = recover(args.journal, out_name, include_saved=args.all)
+    print('{:d} entries recovered to {:s}'.format(n, out_name))
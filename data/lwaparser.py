@@ -1,10 +1,80 @@
 #! encoding = utf-8
 
-''' LWA file parser '''
+''' LWA file parser.
 
+Scan entries of an lwa file are located through a sidecar index file
+(<filename>.lwai), so that the file does not need to be parsed line by line
+each time it is opened. The index is a JSON line holding the index version,
+followed by one JSON list per entry with the fields in INDEX_FIELDS.
+
+Compressed lwa files (.lwa.gz, .lwa.xz) are written with one compressed
+member per scan entry. The result is a valid multi-member gzip / xz file
+that decompresses to the plain lwa text, and the index keeps the byte range
+of each member, so that reading one entry only decompresses its own member.
+Files compressed as a whole are also read, by decompressing the whole file.
+'''
+
+import os
 import re
+import mmap
+import json
+import gzip
+import lzma
+import zlib
+import locale
+import datetime
+import concurrent.futures
 import numpy as np
 
+
+INDEX_EXT = '.lwai'
+INDEX_VERSION = 3
+
+# offset, data_offset & end: byte offsets of the header, the data block
+#   and the end of the entry, in the (decompressed) lwa text
+# line & end_line: line numbers of the header and of the line after the entry
+# zoffset & zend: byte range in the file of the compressed members holding
+#   the entry. Same as offset & end for plain lwa files
+# zstart: offset in the lwa text where the member at zoffset starts
+# mtime: st_mtime_ns of the lwa file when the entry was indexed
+INDEX_FIELDS = ('offset', 'data_offset', 'end', 'line', 'end_line',
+                'zoffset', 'zend', 'zstart', 'date', 'time', 'sh', 'it', 'sens', 'tc', 'mmode', 'mf', 'ma',
+                'comment', 'startf', 'step', 'pts', 'avg', 'harm', 'phase',
+                'mtime')
+
+# position of the first header field in index records
+HEADER_START = INDEX_FIELDS.index('date')
+
+RE_HEADER = re.compile(b'^DATE', re.M)
+
+# lwa file name extensions, plain and compressed
+LWA_EXTS = ('.lwa', '.lwa.gz', '.lwa.xz')
+
+# compressed lwa file extensions
+COMPRESS_EXT = {'.gz': gzip, '.xz': lzma}
+# gzip compression level. 6 is about as small as 9, and much faster
+GZIP_LEVEL = 6
+
+# lwa files are written in text mode with the default encoding
+TEXT_ENCODING = locale.getpreferredencoding(False)
+
+# scan date & time format of lwa headers
+DATE_FMT = '%m-%d-%Y'
+TIME_FMT = '%H:%M:%S'
+
+# chunk size of byte range copies (bytes)
+COPY_CHUNK = 1 << 20
+
+# minimum number of entries for export_xy to start worker processes
+EXPORT_POOL_MIN = 4
+
+# data values are written as {:10.3f}, 10 values per row
+DATA_WIDTH = 10
+DATA_POINT = 6      # position of the decimal point in the field
+# weight of each character of a field, to get the value in 1e-3
+DATA_WEIGHT = np.array([1e8, 1e7, 1e6, 1e5, 1e4, 1e3, 0, 1e2, 1e1, 1])
+
+
 def _file_filter(file_list, pattern):
     ''' Filter out file names with a given pattern '''
     extract = []
@@ -29,223 +99,630 @@ def _flatten(nested_list):
     return flat
 
 
+def _parse_header(hd_lines):
+    ''' Parse the 3 header lines of a scan entry.
+        Arguments
+            hd_lines: list of header lines, str
+        Returns
+            fields: list of header values, in the order of
+                    INDEX_FIELDS from 'date' to 'phase'
+    '''
+
+    _temp_list = hd_lines[0].split()
+    date = _temp_list[1]
+    time = _temp_list[3]
+    sh = int(_temp_list[5])
+    it = float(_temp_list[7])
+    sens = float(_temp_list[9])
+    tc = float(_temp_list[11])
+    mf = float(_temp_list[13])
+    ma = float(_temp_list[15])
+
+    # the following fields are newly introduced in PySpec
+    # make it compatible with old "standard" JPL LWA header
+    try:
+        mmode = _temp_list[17]
+        harm = int(_temp_list[19])
+        phase = float(_temp_list[21])
+    except IndexError:
+        mmode = 'UNKNOWN'
+        harm = 0
+        phase = 0
+
+    comment = hd_lines[1].strip()    # remove the new line char
+
+    _temp_list = hd_lines[2].split()
+    startf = float(_temp_list[0])
+    step = float(_temp_list[1])
+    pts = int(_temp_list[2])
+    avg = int(_temp_list[3])
+
+    return [date, time, sh, it, sens, tc, mmode, mf, ma, comment,
+            startf, step, pts, avg, harm, phase]
+
+
+def _index_entries(buf, start, line, mtime):
+    ''' Index scan entries in buf from byte offset start.
+        Arguments
+            buf: file content, bytes or mmap
+            start: byte offset of the first header to index, int
+            line: line number at start, int
+            mtime: st_mtime_ns of the file, int
+        Returns
+            records: list of index records (list)
+    '''
+
+    offsets = [m.start() for m in RE_HEADER.finditer(buf, start)]
+    ends = offsets[1:] + [len(buf)]
+    records = []
+    for offset, end in zip(offsets, ends):
+        line += buf[start:offset].count(b'\n')
+        end_line = line + buf[offset:end].count(b'\n')
+        # the data block starts after 3 header lines
+        data_offset = offset
+        for i in range(3):
+            data_offset = buf.find(b'\n', data_offset, end) + 1
+        hd_lines = bytes(buf[offset:data_offset]).decode(TEXT_ENCODING, 'replace').split('\n')
+        records.append([offset, data_offset, end, line, end_line, offset, end, offset]
+                       + _parse_header(hd_lines) + [mtime])
+        start = offset
+
+    return records
+
+
+def get_codec(filename):
+    ''' Compression module (gzip or lzma) of the lwa file, None if plain '''
+
+    return COMPRESS_EXT.get(os.path.splitext(filename)[1].lower())
+
+
+def compress(codec, data):
+    ''' Compress data as one member '''
+
+    if codec is gzip:
+        return gzip.compress(data, compresslevel=GZIP_LEVEL)
+    else:
+        return codec.compress(data)
+
+
+def _members(f, codec):
+    ''' Iterate over the compressed members of a file.
+        Yields
+            zoffset, zend: byte range of the member in the file, int
+            data: decompressed member, bytes
+    '''
+
+    def new_decompressor():
+        if codec is gzip:
+            return zlib.decompressobj(wbits=31)
+        else:
+            return lzma.LZMADecompressor(format=lzma.FORMAT_XZ)
+
+    zoffset = 0
+    pos = 0
+    buf = b''
+    parts = []
+    dec = None
+    while True:
+        if not buf:
+            buf = f.read(COPY_CHUNK)
+            if not buf:
+                break
+            else:
+                pass
+        if dec is None:
+            # xz stream padding between streams
+            stripped = buf.lstrip(b'\x00')
+            pos += len(buf) - len(stripped)
+            buf = stripped
+            if buf:
+                zoffset = pos
+                dec = new_decompressor()
+            else:
+                continue
+        parts.append(dec.decompress(buf))
+        if dec.eof:
+            rest = dec.unused_data
+            pos += len(buf) - len(rest)
+            yield zoffset, pos, b''.join(parts)
+            parts = []
+            dec = None
+            buf = rest
+        else:
+            pos += len(buf)
+            buf = b''
+
+    if dec is None:
+        pass
+    else:
+        raise EOFError('Compressed file ended before the end of a member')
+
+
+def _index_compressed(f, codec, mtime):
+    ''' Index a compressed lwa file.
+        Members are grouped until the next member starts with a header,
+        so that an entry never spans two groups.
+    '''
+
+    records = []
+    groups = []
+    line = 1
+
+    def flush():
+        nonlocal line
+        zoffset, zend, zstart = groups[0][0], groups[-1][1], groups[0][2]
+        buf = b''.join(group[3] for group in groups)
+        for record in _index_entries(buf, 0, line, mtime):
+            record[0:3] = [pos + zstart for pos in record[0:3]]
+            record[5:8] = [zoffset, zend, zstart]
+            records.append(record)
+        line += buf.count(b'\n')
+
+    zstart = 0
+    for zoffset, zend, data in _members(f, codec):
+        if groups and data.startswith(b'DATE'):
+            flush()
+            groups = []
+        else:
+            pass
+        groups.append((zoffset, zend, zstart, data))
+        zstart += len(data)
+    if groups:
+        flush()
+    else:
+        pass
+
+    return records
+
+
+def _read_index(filename):
+    ''' Read all records of the index file. Returns [] if invalid '''
+
+    try:
+        with open(filename, 'r') as f:
+            lines = f.read().splitlines()
+        if lines and json.loads(lines[0]).get('version') == INDEX_VERSION:
+            # parse all records in one call
+            return json.loads('[' + ','.join(lines[1:]) + ']')
+        else:
+            return []
+    except (OSError, ValueError, AttributeError):
+        return []
+
+
+def _write_index(filename, records):
+    ''' Write the whole index. The old index is replaced atomically '''
+
+    tmp_name = filename + '.tmp'
+    with open(tmp_name, 'w') as f:
+        f.write(json.dumps({'version': INDEX_VERSION}) + '\n')
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+    os.replace(tmp_name, filename)
+
+
+def _last_record(filename):
+    ''' Read the last record of the index without reading the whole file.
+        Returns
+            record: list. None if the index has no record
+    '''
+
+    with open(filename, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        chunk = 4096
+        while True:
+            f.seek(max(size - chunk, 0))
+            lines = f.read().splitlines()
+            # the first line may be cut unless the chunk covers the file
+            if len(lines) > 1 or chunk >= size:
+                break
+            else:
+                chunk *= 2
+
+    record = json.loads(lines[-1].decode('utf-8')) if lines else None
+    if isinstance(record, list):
+        return record
+    else:
+        return None
+
+
+def load_index(filename):
+    ''' Load the sidecar index of the lwa file.
+        The index is checked against the size and mtime of the lwa file.
+        Entries appended to the lwa file since the last indexing are
+        indexed from the last known entry on, and the index file is updated.
+        If the index is missing or does not match the file, it is rebuilt.
+        Arguments
+            filename: lwa file name, str
+        Returns
+            records: list of dict with keys INDEX_FIELDS
+    '''
+
+    index_file = filename + INDEX_EXT
+    records = _read_index(index_file)
+    stat = os.stat(filename)
+
+    codec = get_codec(filename)
+
+    if records and records[-1][6] == stat.st_size and records[-1][-1] == stat.st_mtime_ns:
+        # index is up to date
+        pass
+    elif stat.st_size == 0:
+        records = []
+    elif codec:
+        with open(filename, 'rb') as f:
+            records = _index_compressed(f, codec, stat.st_mtime_ns)
+        try:
+            _write_index(index_file, records)
+        except OSError:
+            pass
+    else:
+        with open(filename, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if records and records[-1][2] <= stat.st_size:
+                # the last known entry may have grown. The tail is valid
+                # only if the header of that entry has not changed
+                last = records.pop()
+                tail = _index_entries(mm, last[0], last[3], stat.st_mtime_ns)
+                if tail and tail[0][:2] == last[:2] and tail[0][HEADER_START:-1] == last[HEADER_START:-1]:
+                    records.extend(tail)
+                else:
+                    records = _index_entries(mm, 0, 1, stat.st_mtime_ns)
+            else:
+                records = _index_entries(mm, 0, 1, stat.st_mtime_ns)
+        try:
+            _write_index(index_file, records)
+        except OSError:
+            # read-only location. Index again next time
+            pass
+
+    return [dict(zip(INDEX_FIELDS, record)) for record in records]
+
+
+def append_index(filename, hd_lines, zoffset, hd_len, data_len, n_lines, mtime):
+    ''' Add the entry just appended to the lwa file to its index.
+        The index is left untouched if it did not match the file before this
+        entry, and is then updated at the next load_index.
+        Arguments
+            filename: lwa file name, str
+            hd_lines: the 3 header lines of the entry, list of str
+            zoffset: size of the lwa file before this entry, int
+            hd_len: byte length of the header lines, int
+            data_len: byte length of the data block, int
+            n_lines: number of lines of the entry, int
+            mtime: st_mtime_ns of the lwa file before this entry, int.
+                   Not used if zoffset is 0
+    '''
+
+    index_file = filename + INDEX_EXT
+
+    try:
+        if zoffset == 0:
+            # new file, start a new index
+            _write_index(index_file, [])
+            offset = 0
+            line = 1
+        else:
+            last = _last_record(index_file)
+            if last and last[6] == zoffset and last[-1] == mtime:
+                offset = last[2]
+                line = last[4]
+            else:
+                return None
+
+        stat = os.stat(filename)
+        # the entry starts its own member in compressed files
+        record = ([offset, offset + hd_len, offset + hd_len + data_len, line, line + n_lines,
+                   zoffset, stat.st_size, offset]
+                  + _parse_header(hd_lines) + [stat.st_mtime_ns])
+        with open(index_file, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+    except (OSError, ValueError):
+        # the index is rebuilt at the next load_index
+        pass
+
+    return None
+
+
 def scan_header(filename):
-    ''' Scan headers in the lwa file.
+    ''' Scan headers in the lwa file, using its sidecar index.
     Returns
         entry_settings: list of entry setting tuples. Scan # starts at 1.
-        hd_line_num: start line number of each header in the file
+        entry_index: index record (dict) of each entry, see load_index
     '''
 
     if filename:
-        re_header = re.compile('DATE')
-        # header's line number list
-        hd_line_num = []
-        # entry setting list
         entry_settings = []
+        entry_index = load_index(filename)
+        for scan_num, record in enumerate(entry_index, start=1):
+            stopf = record['startf'] + record['step']*record['pts']
+            entry_settings.append((scan_num, record['comment'], record['date'], record['time'],
+                record['it'], record['sens'], record['tc'], record['mmode'], record['mf'],
+                record['ma'], record['startf'], stopf, record['step'], record['pts'],
+                record['avg'], record['harm'], record['phase']))
+    else:
+        entry_settings = None
+        entry_index = None
 
-        # open file
-        a_file = open(filename, 'r')
-        a_line = a_file.readline()
-        line_num = 1
-        scan_num = 0
-        while a_line:       # not EOF
-            # this is the header
-            if re_header.match(a_line):
-                scan_num += 1
-                hd_line_num.append(line_num)
-                _temp_list = a_line.split()
-                date = _temp_list[1]
-                time = _temp_list[3]
-                it = float(_temp_list[7])
-                sens = float(_temp_list[9])
-                tc = float(_temp_list[11])
-                mf = float(_temp_list[13])
-                ma = float(_temp_list[15])
-
-                # the following fields are newly introduced in PySpec
-                # make it compatible with old "standard" JPL LWA header
-                try:
-                    mmode = _temp_list[17]
-                    harm = int(_temp_list[19])
-                    phase = float(_temp_list[21])
-                except IndexError:
-                    mmode = 'UNKNOWN'
-                    harm = 0
-                    phase = 0
-
-                # move to next line to read comment
-                a_line = a_file.readline()
-                line_num += 1
-                comment = a_line.strip()    # remove the new line char
-
-                # move to next line to read freqs
-                a_line = a_file.readline()
-                line_num += 1
-                _temp_list = a_line.split()
-                startf = float(_temp_list[0])
-                step = float(_temp_list[1])
-                pts = int(_temp_list[2])
-                stopf = startf + step*pts
-                avg = int(_temp_list[3])
-
-                # append settings
-                entry_settings.append((scan_num, comment, date, time,
-                    it, sens, tc, mmode, mf, ma, startf, stopf,
-                    step, pts, avg, harm, phase))
-            else:
-                a_line = a_file.readline()
-                line_num += 1
+    return entry_settings, entry_index
 
-        a_file.close()
-        hd_line_num.sort()
+
+def decode_data(block, pts=None):
+    ''' Decode the data block of a scan entry.
+        Blocks written in the fixed-width {:10.3f} format are decoded by
+        slicing the bytes into fields, and summing up the digits of all
+        fields at once. Blocks in any other layout are split by whitespace.
+        Arguments
+            block: data block, bytes
+            pts: number of data points, int. Not checked if None
+        Returns
+            y: data values, np.array
+    '''
+
+    buf = block.translate(None, b'\r\n')
+    n = len(buf) // DATA_WIDTH
+    if len(buf) % DATA_WIDTH == 0 and (pts is None or n == pts) and n > 0:
+        fields = np.frombuffer(buf, dtype=np.uint8).reshape(n, DATA_WIDTH)
+        fixed_width = np.all(fields[:, DATA_POINT] == ord('.'))
     else:
-        entry_settings = None
-        hd_line_num = None
+        fixed_width = False
+
+    if fixed_width:
+        digits = fields - np.uint8(ord('0'))
+        # blanks and signs wrap around to values > 9
+        digits[digits > 9] = 0
+        y = (digits.astype(float) @ DATA_WEIGHT) / 1000
+        neg = fields[:, 0] == ord('-')
+        for i in range(1, DATA_POINT):
+            neg |= fields[:, i] == ord('-')
+        y[neg] *= -1
+        return y
+    else:
+        # legacy layout with irregular whitespace
+        return np.array(block.split(), dtype=float)
+
+
+def read_entry(f, record):
+    ''' Read the data of one scan entry.
+        Arguments
+            f: lwa file opened in binary mode (plain or compressed)
+            record: index record of the entry, dict
+        Returns
+            x: frequency array (MHz), np.array
+            y: lockin intensity (V), np.array
+    '''
+
+    block = read_bytes(f, record, record['data_offset'], record['end'])
+
+    return _entry_xy(block, record)
+
+
+def read_bytes(f, record, start, stop):
+    ''' Read the byte range [start, stop) of the lwa text within an entry.
+        Only the members of the entry are decompressed in compressed files.
+        Arguments
+            f: lwa file opened in binary mode
+            record: index record of the entry, dict
+            start, stop: byte offsets in the lwa text, int
+        Returns
+            data: bytes
+    '''
+
+    codec = get_codec(f.name)
+    if codec:
+        f.seek(record['zoffset'])
+        data = codec.decompress(f.read(record['zend'] - record['zoffset']))
+        return data[start-record['zstart']:stop-record['zstart']]
+    else:
+        f.seek(start)
+        return f.read(stop - start)
+
+
+def _entry_xy(block, record):
+    ''' Frequency & intensity arrays of an entry from its data block '''
 
-    return entry_settings, hd_line_num
+    x = np.linspace(record['startf'], record['startf'] + record['step']*record['pts'],
+                    num=record['pts'], endpoint=False)
+    y = decode_data(block, record['pts']) * 1e-4 * record['sens']
 
+    return x, y
 
-def export_lwa(id_list, hd_line_num, src='src.lwa', output='output.lwa'):
+
+def export_lwa(id_list, entry_index, src='src.lwa', output='output.lwa'):
     ''' Export partial LWA file to new LWA file,
-        based on scan id (id starts at 0) '''
-
-    srcfile = open(src, 'r')
-    outputfile = open(output, 'w')
-
-    # get line number window to be copied
-    hd_line_num.append(0)   # add 0 for the last one
-    win = lambda id_, hd: list((hd[i], hd[i+1]-1) for i in id_)
-    line_num_win = win(id_list, hd_line_num)
-    # reverse list order for pop ups
-    line_num_win.reverse()
-
-    line_num = 1
-    a_line = srcfile.readline()
-    start, stop = line_num_win.pop()
-    # start read source file
-    while a_line:   # source file not EOF
-        if (line_num >= start) and ((line_num <= stop) or (stop == -1)):
-            # write this line to output file
-            outputfile.write(a_line)
-        elif line_num > stop and stop != -1:
-            # pop the next line number window
-            try:
-                start, stop = line_num_win.pop()
-            except IndexError:
-                break
-        # move to next line
-        a_line = srcfile.readline()
-        line_num += 1
+        based on scan id (id starts at 0).
+        Entries of plain lwa files are copied as byte ranges.
+        The source and output files can be compressed.
+    '''
+
+    src_codec = get_codec(src)
+    out_codec = get_codec(output)
 
-    srcfile.close()
-    outputfile.close()
+    with open(src, 'rb') as srcfile, open(output, 'wb') as outputfile:
+        for id_ in sorted(id_list):
+            record = entry_index[id_]
+            if src_codec or out_codec:
+                data = read_bytes(srcfile, record, record['offset'], record['end'])
+                outputfile.write(compress(out_codec, data) if out_codec else data)
+            else:
+                srcfile.seek(record['offset'])
+                remain = record['end'] - record['offset']
+                # copy in chunks to bound the memory for huge entries
+                while remain > 0:
+                    chunk = srcfile.read(min(remain, COPY_CHUNK))
+                    if chunk:
+                        outputfile.write(chunk)
+                        remain -= len(chunk)
+                    else:
+                        break
+
+
+def _write_xy(out_name, block, record):
+    ''' Decode one entry and write it to an xy file.
+        Runs in the export worker processes.
+    '''
 
+    x, y = _entry_xy(block, record)
+    xy = np.empty(2*len(x))
+    xy[0::2] = x
+    xy[1::2] = y
+    # one format call for the whole file
+    text = 'Frequency(MHz),LockinInten(V)\n' + ('{:.3f},{:.6e}\n' * len(x)).format(*xy.tolist())
+    with open(out_name, 'w') as f:
+        f.write(text)
 
-def export_xy(id_list, hd_line_num, src='src.lwa', output_dir='export/'):
+
+def export_xy(id_list, entry_index, src='src.lwa', output_dir='export/', progress=None, workers=None):
     ''' Export partial LWA file to new xy files,
-        based on scan id (id starts at 0) '''
-
-    global ylist, sens, x, out_name
-    ylist = []
-
-    # get line number window to be copied
-    hd_line_num.append(0)   # add 0 for the last one
-    win = lambda id_, hd: list((hd[i], hd[i+1]-1) for i in id_)
-    line_num_win = win(id_list, hd_line_num)
-    # reverse list order for pop ups
-    line_num_win.reverse()
-
-    line_num = 1
-    srcfile = open(src, 'r')
-    a_line = srcfile.readline()
-    start, stop = line_num_win.pop()
-    # start read source file
-    while a_line:   # source file not EOF
-        if (line_num >= start) and ((line_num <= stop) or (stop == -1)):
-            if line_num == start: # get 1st header for sensitivity
-                a_list = a_line.split()
-                sens = float(a_list[9])
-            elif line_num == start+1: # get comment and generate file name
-                comment = a_line.split()[0]
-                out_name = output_dir + '/' + 'Scan_{:d}_{:s}.csv'.format(len(line_num_win)+1, comment)
-            elif line_num == start+2: # get 3rd header line for x array
-                a_list = a_line.split()
-                xstart = float(a_list[0])
-                xstep = float(a_list[1])
-                pts = int(a_list[2])
-                x = np.linspace(xstart, xstart + xstep*pts, num=pts, endpoint=False)
-            else:   # data lines, read data
-                # add this line to y list
-                ylist.append(a_line.split())
-        elif line_num > stop and stop != -1:    # end of this scan entry
-            # save this entry
-            # column_stack array
-            y = [i for j in ylist for i in j]
-            np.savetxt(out_name,
-                np.column_stack((x, np.asarray(y, dtype=float)*1e-4*sens)),
-                delimiter=',', fmt=['%.3f', '%.6e'], comments='',
-                header='Frequency(MHz),LockinInten(V)')
-            # erase ylist
-            ylist = []
-            # pop the next line number window
-            try:
-                start, stop = line_num_win.pop()
-            except IndexError:
-                break
-        # move to next line
-        a_line = srcfile.readline()
-        line_num += 1
-
-    srcfile.close()
-
-    if ylist:   # if the last one is not saved yet
-        y = [i for j in ylist for i in j]
-        np.savetxt(out_name,
-            np.column_stack((x, np.asarray(y, dtype=float)*1e-4*sens)),
-            delimiter=',', fmt=['%.3f', '%.6e'], comments='',
-            header='Frequency(MHz),LockinInten(V)')
+        based on scan id (id starts at 0).
+        The source file is read once, in file order. Entries are decoded,
+        formatted and written by a pool of worker processes.
+        Arguments
+            progress: function(n_done, n_total) called after each entry.
+                      If it returns False, the remaining entries are skipped
+            workers: number of worker processes. Default: number of CPUs
+        Returns
+            n: number of exported entries, int
+    '''
+
+    id_list = sorted(id_list)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    else:
+        pass
+    # starting the processes does not pay off for a few entries
+    if len(id_list) < EXPORT_POOL_MIN:
+        workers = 1
     else:
         pass
 
+    def tasks():
+        with open(src, 'rb') as srcfile:
+            for id_ in id_list:
+                record = entry_index[id_]
+                block = read_bytes(srcfile, record, record['data_offset'], record['end'])
+                comment = record['comment'].split()[0] if record['comment'] else ''
+                out_name = os.path.join(output_dir, 'Scan_{:d}_{:s}.csv'.format(id_+1, comment))
+                yield out_name, block, record
+
+    n = 0
+    if workers > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = set()
+            for task in tasks():
+                pending.add(pool.submit(_write_xy, *task))
+                # bound the number of data blocks in flight
+                if len(pending) >= 2*workers:
+                    done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        future.result()
+                    n += len(done)
+                    if progress and progress(n, len(id_list)) is False:
+                        for future in pending:
+                            future.cancel()
+                        break
+                    else:
+                        pass
+                else:
+                    pass
+            else:
+                for future in concurrent.futures.as_completed(pending):
+                    future.result()
+                    n += 1
+                    if progress and progress(n, len(id_list)) is False:
+                        for future in pending:
+                            future.cancel()
+                        break
+                    else:
+                        pass
+    else:
+        for task in tasks():
+            _write_xy(*task)
+            n += 1
+            if progress and progress(n, len(id_list)) is False:
+                break
+            else:
+                pass
 
-def preview(id_, hd_line_num, src='src.lwa'):
+    return n
+
+
+def preview(id_, entry_index, src='src.lwa'):
     ''' Preview the scan #id.
         Returns np.array (x, y)
             x, frequency vector, unit in Hz
             y, intensity vector
     '''
 
-    srcfile = open(src, 'r')
-    ylist = []
-
-    # get line number window to be copied
-    hd_line_num.append(0)   # add 0 for the last one
-    line_num = 1
-    start = hd_line_num[id_]
-    stop = hd_line_num[id_+1] - 1
-
-    # start reading
-    a_line = srcfile.readline()
-    while a_line:
-        if (line_num >= start+3) and ((line_num <= stop) or (stop == -1)):
-            # add this line to y list
-            ylist.append(a_line.split())
-        elif line_num == start: # get 1st header for sensitivity
-            a_list = a_line.split()
-            sens = float(a_list[9])
-        elif line_num == start+2: # get 3rd header line for x array
-            a_list = a_line.split()
-            xstart = float(a_list[0])
-            xstep = float(a_list[1])
-            pts = int(a_list[2])
-            x = np.linspace(xstart, xstart + xstep*pts, num=pts, endpoint=False)
+    with open(src, 'rb') as srcfile:
+        x, y = read_entry(srcfile, entry_index[id_])
+
+    return np.column_stack((x*1e6, y))
+
+
+def match_entry(record, freq_range=None, date_range=None, comment=None):
+    ''' Check the index record of an entry against the filters of
+        iter_entries. comment is a regular expression, str or compiled
+    '''
+
+    if freq_range:
+        # last sampled point, as in data.catalog and data.stitch
+        stopf = record['startf'] + record['step']*(record['pts'] - 1)
+        if max(record['startf'], stopf) < freq_range[0] or min(record['startf'], stopf) > freq_range[1]:
+            return False
+        else:
             pass
-        a_line = srcfile.readline()
-        line_num += 1
 
-    srcfile.close()
+    if date_range:
+        try:
+            date = datetime.datetime.strptime(record['date'], DATE_FMT).date()
+        except ValueError:
+            return False
+        if date < date_range[0] or date > date_range[1]:
+            return False
+        else:
+            pass
 
-    # flatten ylist
-    y = [i for j in ylist for i in j]
+    if comment and not re.search(comment, record['comment']):
+        return False
+    else:
+        return True
+
+
+def iter_entries(filenames, freq_range=None, date_range=None, comment=None):
+    ''' Iterate over the scan entries of one or many lwa files.
+        Entries are filtered by their headers before the data block is read,
+        and only one entry is held in memory at a time.
+        Arguments
+            filenames: lwa file name (str), or list of file names
+            freq_range: (min, max) mm frequency (MHz). Entries overlapping
+                        the range are kept. Default: all
+            date_range: (first, last) datetime.date of the scan, inclusive.
+                        Default: all
+            comment: regular expression searched in the comment, str.
+                     Default: all
+        Yields
+            record: index record of the entry (dict, see load_index), with
+                    the additional keys filename and scan_num (starts at 1)
+            x: frequency array (MHz), np.array
+            y: lockin intensity (V), np.array
+    '''
+
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    else:
+        pass
+    if comment:
+        comment = re.compile(comment)
+    else:
+        pass
 
-    return np.column_stack((x*1e6, np.asarray(y, dtype=float)*1e-4*sens))
+    for filename in filenames:
+        entry_index = load_index(filename)
+        with open(filename, 'rb') as f:
+            for scan_num, record in enumerate(entry_index, start=1):
+                if match_entry(record, freq_range, date_range, comment):
+                    x, y = read_entry(f, record)
+                    record = dict(record, filename=filename, scan_num=scan_num)
+                    yield record, x, y
+                else:
+                    pass
@@ -0,0 +1,170 @@
+#! encoding = utf-8
+
+''' Binary companion store of lockin scans.
+
+A store is a directory (<name>.npyd) with one sub-directory per scan entry:
+    00000/header.json   h_info tuple of save.save_lwa, scan date & time,
+                        and the names of the arrays
+    00000/x.npy         mm frequency (MHz)
+    00000/y.npy         lockin intensity (V), in full precision
+    00000/sweeps.npy    individual sweeps (V), (number of sweeps, len(x)).
+                        Optional
+    00000/<name>.npy    any other array of the scan, e.g. X/Y quadratures.
+                        Optional
+Arrays are plain .npy files and are loaded memory-mapped, so that nothing
+is copied or parsed until the data is used.
+'''
+
+import os
+import json
+import shutil
+import datetime
+import numpy as np
+from data import save
+from data import lwaparser
+
+
+STORE_EXT = '.npyd'
+HEADER_FILE = 'header.json'
+
+
+def store_name(lwa_file):
+    ''' Name of the companion store of an lwa file. data.lwa, data.lwa.gz
+        and data.lwa.xz all map to data.npyd
+    '''
+
+    for ext in lwaparser.LWA_EXTS:
+        if lwa_file.lower().endswith(ext):
+            return lwa_file[:-len(ext)] + STORE_EXT
+        else:
+            pass
+
+    return os.path.splitext(lwa_file)[0] + STORE_EXT
+
+
+def list_entries(dirname):
+    ''' List the entry numbers in the store, starting at 0 '''
+
+    try:
+        names = os.listdir(dirname)
+    except OSError:
+        return []
+
+    return sorted(int(name) for name in names if name.isdigit())
+
+
+def save_entry(dirname, x, y, h_info, y_sweeps=None, date=None, **arrays):
+    ''' Add a scan entry to the store. The entry appears in the store only
+        once all its files are written.
+        Arguments
+            dirname: store directory, str. Created if it does not exist
+            x: mm frequency array (MHz), np.array
+            y: lockin intensity (V), np.array
+            h_info: header information tuple, same as save.save_lwa
+            y_sweeps: individual sweeps, 2D np.array, optional
+            date: datetime.datetime of the scan. Default: now
+            arrays: other np.array of the scan
+        Returns
+            entry_id: int
+    '''
+
+    os.makedirs(dirname, exist_ok=True)
+    entries = list_entries(dirname)
+    entry_id = entries[-1] + 1 if entries else 0
+    d = date or datetime.datetime.today()
+
+    if y_sweeps is None:
+        pass
+    else:
+        arrays['sweeps'] = y_sweeps
+    arrays['x'] = x
+    arrays['y'] = y
+
+    tmp_dir = os.path.join(dirname, '.tmp_{:05d}'.format(entry_id))
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, name + '.npy'), np.asarray(array))
+    header = {'h_info': list(h_info),
+              'date': d.strftime(lwaparser.DATE_FMT),
+              'time': d.strftime(lwaparser.TIME_FMT),
+              'arrays': sorted(arrays)}
+    with open(os.path.join(tmp_dir, HEADER_FILE), 'w') as f:
+        json.dump(header, f, default=save.to_builtin)
+    os.rename(tmp_dir, os.path.join(dirname, '{:05d}'.format(entry_id)))
+
+    return entry_id
+
+
+def load_entry(dirname, entry_id, mmap_mode='r'):
+    ''' Load a scan entry from the store.
+        Arguments
+            dirname: store directory, str
+            entry_id: int
+            mmap_mode: np.load mmap_mode. None loads arrays into memory
+        Returns
+            entry: dict with keys
+                h_info: header information tuple, same as save.save_lwa
+                date: datetime.datetime of the scan
+                x, y: np.array
+                sweeps: 2D np.array, or None if not saved
+                and the other arrays by their names
+    '''
+
+    entry_dir = os.path.join(dirname, '{:05d}'.format(entry_id))
+    with open(os.path.join(entry_dir, HEADER_FILE), 'r') as f:
+        header = json.load(f)
+
+    entry = {'h_info': tuple(header['h_info']),
+             'date': datetime.datetime.strptime(header['date'] + ' ' + header['time'],
+                                                lwaparser.DATE_FMT + ' ' + lwaparser.TIME_FMT),
+             'sweeps': None}
+    for name in header['arrays']:
+        entry[name] = np.load(os.path.join(entry_dir, name + '.npy'), mmap_mode=mmap_mode)
+
+    return entry
+
+
+def lwa_to_store(lwa_file, dirname):
+    ''' Convert all entries of an lwa file into the store.
+        Returns
+            n: number of converted entries, int
+    '''
+
+    n = 0
+    for record, x, y in lwaparser.iter_entries(lwa_file):
+        h_info = (record['sh'], record['it'], record['sens'], record['tc'],
+                  record['mf'], record['ma'], record['mmode'], record['harm'],
+                  record['phase'], record['startf'], record['step'],
+                  record['avg'], record['comment'])
+        try:
+            date = datetime.datetime.strptime(record['date'] + ' ' + record['time'],
+                                              lwaparser.DATE_FMT + ' ' + lwaparser.TIME_FMT)
+        except ValueError:
+            date = None
+        save_entry(dirname, x, y, h_info, date=date)
+        n += 1
+
+    return n
+
+
+def store_to_lwa(dirname, lwa_file, entry_ids=None):
+    ''' Append entries of the store to an lwa file.
+        Arguments
+            dirname: store directory, str
+            lwa_file: lwa file name, str
+            entry_ids: list of entry numbers. Default: all entries
+        Returns
+            n: number of converted entries, int
+    '''
+
+    if entry_ids is None:
+        entry_ids = list_entries(dirname)
+    else:
+        pass
+
+    for entry_id in entry_ids:
+        entry = load_entry(dirname, entry_id)
+        save.save_lwa(lwa_file, entry['y'], entry['h_info'], date=entry['date'])
+
+    return len(entry_ids)
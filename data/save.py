@@ -3,58 +3,96 @@
 ''' Save data '''
 
 
+import os
 import numpy as np
 import datetime
+from data import lwaparser
 
 
-def save_lwa(filename, y, h_info):
+def to_builtin(obj):
+    ''' Convert numpy scalars for json, as json.dump(default=to_builtin) '''
+
+    return obj.item()
+
+
+def save_lwa(filename, y, h_info, date=None):
     ''' Save lockin scan in the JPL .lwa format
         Arguments
-            filename: str
+            filename: str. Entries are compressed if it ends with .gz or .xz
             y: y data, np.array
             h_info: header information tuple
               (synmulti [int], itgtime [ms], sens [V], tc [sec],
                mod_freq [kHz], mod_depth/dev [%|kHz], mod_mode [str], lia_harm [int], lia_phase [float deg])
+            date: datetime.datetime of the scan. Default: now
         Lwa header format:
             DATE mm-dd-year TIME hh:mm:ss SH %d IT %g SENS %g TAU %g MF %.3f MA %.3f MOD [NONE|AM|FM] HARM %d PHA %.2f
             [COMMENT]
             [START FREQ MHZ %.3f] [STEP MHZ %.6f] [PTS %d] [AVG %d] 1 1 1.887 0.000 0 0 START
     '''
 
-    d = datetime.datetime.today()
+    d = date or datetime.datetime.today()
     synmulti, itgtime, sens, tc, mod_freq, mod_depth, mod_mode, lia_harm, lia_phase, start_freq, step, avg, comment = h_info
     # rescale y based on sensitivity, full scale is 1e4
     y = y / sens * 1e4
 
-    with open(filename, 'a') as f:
-        # write first line
-        f.write('DATE ' + d.strftime('%m-%d-%Y'))
-        f.write(' TIME ' + d.strftime('%H:%M:%S'))
-        f.write(' SH {:d}'.format(synmulti))
-        f.write(' IT {:.3g}'.format(itgtime))
-        f.write(' SENS {:.3g}'.format(sens))
-        f.write(' TAU {:.3g}'.format(tc))
-        f.write(' MF {:.3f}'.format(mod_freq))
-        f.write(' MA {:.3f}'.format(mod_depth))
-        f.write(' MOD {:s}'.format(mod_mode))
-        f.write(' HARM {:d}'.format(lia_harm))
-        f.write(' PHA {:.2f}'.format(lia_phase))
-
-        # write second line
-        f.write('\n {:s}'.format(comment))
-
-        # write third line
-        f.write('\n {:.3f}   {:.6f}  {:d}'.format(start_freq, step, len(y)))
-        f.write(' {:d} 1 1  1.887  0.000 0 0 START\n'.format(avg))
-
-        # write y data
-        fmt = '{:10.3f}'*10     # 10 numbers each row
-        for i in range(len(y)//10):
-            f.write(fmt.format(*y[i*10:(i+1)*10]))
-            f.write('\n')
-        # for the last row which may not have 10 numbers. Avoid index error
-        for i in range(len(y) - len(y)//10*10):
-            f.write('{:10.3f}'.format(y[len(y)//10*10+i]))
-        f.write('\n')
+    # file state before this entry, to keep the sidecar index in sync
+    try:
+        mtime = os.stat(filename).st_mtime_ns
+    except OSError:
+        mtime = 0
+
+    # first line
+    hd_lines = ['DATE ' + d.strftime('%m-%d-%Y') +
+                ' TIME ' + d.strftime('%H:%M:%S') +
+                ' SH {:d}'.format(synmulti) +
+                ' IT {:.3g}'.format(itgtime) +
+                ' SENS {:.3g}'.format(sens) +
+                ' TAU {:.3g}'.format(tc) +
+                ' MF {:.3f}'.format(mod_freq) +
+                ' MA {:.3f}'.format(mod_depth) +
+                ' MOD {:s}'.format(mod_mode) +
+                ' HARM {:d}'.format(lia_harm) +
+                ' PHA {:.2f}'.format(lia_phase)]
+    # second line
+    hd_lines.append(' {:s}'.format(comment))
+    # third line
+    hd_lines.append(' {:.3f}   {:.6f}  {:d}'.format(start_freq, step, len(y)) +
+                    ' {:d} 1 1  1.887  0.000 0 0 START'.format(avg))
+
+    hd_text = '\n'.join(hd_lines) + '\n'
+    data_text = _format_data(y)
+
+    codec = lwaparser.get_codec(filename)
+    if codec:
+        # each entry is its own compressed member
+        hd_bytes = hd_text.encode(lwaparser.TEXT_ENCODING)
+        data_bytes = data_text.encode(lwaparser.TEXT_ENCODING)
+        with open(filename, 'ab') as f:
+            zoffset = f.tell()
+            f.write(lwaparser.compress(codec, hd_bytes + data_bytes))
+    else:
+        with open(filename, 'a') as f:
+            zoffset = f.tell()
+            # one buffered write for the whole entry
+            f.write(hd_text + data_text)
+            # text mode writes os.linesep for each new line char
+            hd_bytes = hd_text.replace('\n', os.linesep).encode(f.encoding)
+            data_bytes = data_text.replace('\n', os.linesep).encode(f.encoding)
+
+    lwaparser.append_index(filename, hd_lines, zoffset, len(hd_bytes), len(data_bytes),
+                           hd_text.count('\n') + data_text.count('\n'), mtime)
 
     return None
+
+
+def _format_data(y):
+    ''' Format the lwa data block: {:10.3f} values, 10 numbers each row.
+        The last row may have less than 10 numbers, and is always followed
+        by a new line (an empty row if the last full row is complete).
+        The whole block is formatted by a single format call.
+    '''
+
+    n = len(y)
+    template = ('{:10.3f}'*10 + '\n') * (n//10) + '{:10.3f}'*(n%10) + '\n'
+
+    return template.format(*np.asarray(y, dtype=float).tolist())
@@ -0,0 +1,114 @@
+#! encoding = utf-8
+
+''' Lockin settle time calibration.
+
+The step response of the lockin low pass filter with n poles
+(n = 1, 2, 3, 4 for 6, 12, 18, 24 dB/oct) and time constant tau is
+    y(t) = y_inf + (y0 - y_inf) * Q(n, (t - t0) / tau)
+where Q is the regularized upper incomplete gamma function, and t0 is the
+dead time of the frequency switching. The output settles within
+SETTLE_TOL of the step after
+    t_settle = t0 + tau * Q^-1(n, SETTLE_TOL)
+
+Minimum safe dwell times are kept in a persistent table, by
+(time constant index, lp slope index, step size).
+'''
+
+import os
+import json
+import numpy as np
+from scipy.optimize import curve_fit
+from scipy.special import gammaincc, gammainccinv
+
+
+SETTLE_TABLE_FILE = os.path.join(os.path.expanduser('~'), '.pyspec', 'settle_table.json')
+
+# residual fraction of the step at which the signal is considered settled
+SETTLE_TOL = 0.01
+
+
+def step_response(t, y0, y_inf, t0, tau, n_pole=1):
+    ''' Step response of an n_pole low pass filter. The step happens at t0 '''
+
+    t_rel = np.clip((t - t0) / tau, 0, None)
+
+    return y_inf + (y0 - y_inf) * gammaincc(n_pole, t_rel)
+
+
+def fit_settle_time(t, y, slope_index, tc):
+    ''' Fit the step response and calculate the settle time.
+        Arguments
+            t: time after the frequency step (s), np.array
+            y: lockin output, np.array
+            slope_index: int, index in api.lockin.LPSLOPE_LIST
+            tc: nominal time constant (s), float
+        Returns
+            settle_time: (ms), float
+            popt: fitted (y0, y_inf, t0, tau)
+    '''
+
+    n_pole = slope_index + 1
+    before = y[t < 0]
+    y0 = np.mean(before) if len(before) else y[0]
+    # the last quarter of the record is taken as settled
+    y_inf = np.mean(y[-max(len(y)//4, 1):])
+
+    popt, pcov = curve_fit(lambda t, y0, y_inf, t0, tau: step_response(t, y0, y_inf, t0, tau, n_pole),
+                           t, y, p0=(y0, y_inf, 0, tc),
+                           bounds=([-np.inf, -np.inf, 0, tc*1e-2], [np.inf, np.inf, t[-1], t[-1]]))
+    settle_time = (popt[2] + popt[3] * gammainccinv(n_pole, SETTLE_TOL)) * 1e3
+
+    return settle_time, popt
+
+
+def _key(tc_index, slope_index):
+
+    return '{:d},{:d}'.format(tc_index, slope_index)
+
+
+def load_table(filename=SETTLE_TABLE_FILE):
+    ''' Load the settle time table.
+        Returns
+            table: dict {'tc_index,slope_index': {step <MHz> (str): dwell <ms>}}
+    '''
+
+    try:
+        with open(filename, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_table(table, filename=SETTLE_TABLE_FILE):
+    ''' Save the settle time table. The old table is replaced atomically '''
+
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    tmp_name = filename + '.tmp'
+    with open(tmp_name, 'w') as f:
+        json.dump(table, f, indent=1, sort_keys=True)
+    os.replace(tmp_name, filename)
+
+
+def set_dwell(table, tc_index, slope_index, step, dwell):
+    ''' Store the dwell time (ms) for a step size (MHz) '''
+
+    table.setdefault(_key(tc_index, slope_index), {})['{:g}'.format(step)] = dwell
+
+
+def lookup_dwell(table, tc_index, slope_index, step):
+    ''' Look up the calibrated dwell time.
+        Uses the smallest calibrated step size not smaller than step,
+        or the largest one if step is larger than all of them.
+        Returns
+            dwell: (ms), float. None if this tc & slope is not calibrated
+    '''
+
+    steps = table.get(_key(tc_index, slope_index), {})
+    if steps:
+        step_list = sorted(steps, key=float)
+        for step_text in step_list:
+            if float(step_text) >= step:
+                return steps[step_text]
+        return steps[step_list[-1]]
+    else:
+        return None
@@ -0,0 +1,140 @@
+#! encoding = utf-8
+
+''' Stitch overlapping lwa scan windows into one continuous spectrum.
+
+Every entry is linearly interpolated onto a common frequency grid, and
+overlapping entries are averaged with weights 1/sigma^2, where sigma is the
+noise of each entry estimated from its own data. Grid points not covered by
+any entry are nan.
+
+The grid is processed in chunks. Only the entries overlapping the current
+chunk are held in memory, and each chunk is written to the output .npy file
+(a memory-mapped array of columns: frequency (MHz), intensity (V),
+noise (V)) before the next one is processed.
+
+Stitch from the command line:
+    python -m data.stitch survey.npy scan1.lwa scan2.lwa -step 0.05
+'''
+
+import argparse
+import numpy as np
+from data import lwaparser
+from data import average
+
+
+# number of grid points per chunk
+CHUNK_POINTS = 1 << 20
+
+
+def _entry_range(record):
+    ''' Frequency range (min, max) of an entry (MHz) '''
+
+    stopf = record['startf'] + record['step']*(record['pts'] - 1)
+
+    return min(record['startf'], stopf), max(record['startf'], stopf)
+
+
+def stitch(filenames, output, step, freq_range=None, date_range=None, comment=None,
+           chunk=CHUNK_POINTS):
+    ''' Stitch lwa entries onto a common frequency grid.
+        Arguments
+            filenames: lwa file name (str), or list of file names
+            output: output .npy file name, str
+            step: grid step (MHz), float
+            freq_range: (min, max) mm frequency of the grid (MHz).
+                        Default: the range of all entries
+            date_range, comment: entry filters, see lwaparser.iter_entries
+            chunk: number of grid points per chunk, int
+        Returns
+            n: number of grid points, int
+            n_entries: number of stitched entries, int
+    '''
+
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    else:
+        pass
+
+    # select entries by their headers only
+    entries = []
+    for filename in filenames:
+        for record in lwaparser.load_index(filename):
+            if record['pts'] > 1 and lwaparser.match_entry(record, freq_range, date_range, comment):
+                entries.append((_entry_range(record), filename, record))
+            else:
+                pass
+    if entries:
+        pass
+    else:
+        raise ValueError('No scan entry to stitch')
+    entries.sort(key=lambda entry: entry[0][0])
+
+    if freq_range:
+        f0, f1 = freq_range
+    else:
+        f0 = entries[0][0][0]
+        f1 = max(entry[0][1] for entry in entries)
+    n = int(np.floor((f1 - f0) / step + 1e-9)) + 1
+
+    out = np.lib.format.open_memmap(output, mode='w+', dtype=np.float64, shape=(n, 3))
+    files = {filename: open(filename, 'rb') for filename in set(filenames)}
+    # entries overlapping the current chunk: [fmax, x, y, weight]
+    active = []
+    next_entry = 0
+    n_entries = 0
+
+    try:
+        for i0 in range(0, n, chunk):
+            grid = f0 + np.arange(i0, min(i0 + chunk, n)) * step
+            # read in the entries starting in this chunk
+            while next_entry < len(entries) and entries[next_entry][0][0] <= grid[-1]:
+                (fmin, fmax), filename, record = entries[next_entry]
+                next_entry += 1
+                x, y = lwaparser.read_entry(files[filename], record)
+                sigma = average.spectrum_noise(y)
+                if sigma > 0:
+                    if x[0] > x[-1]:
+                        x, y = x[::-1], y[::-1]
+                    else:
+                        pass
+                    active.append((fmax, x, y, 1 / sigma**2))
+                    n_entries += 1
+                else:
+                    # the noise cannot be estimated, e.g. an empty scan
+                    pass
+            # drop the entries that ended before this chunk
+            active = [entry for entry in active if entry[0] >= grid[0]]
+
+            y_sum = np.zeros_like(grid)
+            w_sum = np.zeros_like(grid)
+            for fmax, x, y, weight in active:
+                lo = np.searchsorted(grid, x[0], side='left')
+                hi = np.searchsorted(grid, x[-1], side='right')
+                y_sum[lo:hi] += np.interp(grid[lo:hi], x, y) * weight
+                w_sum[lo:hi] += weight
+
+            covered = w_sum > 0
+            out[i0:i0+len(grid), 0] = grid
+            out[i0:i0+len(grid), 1] = np.where(covered, y_sum / np.where(covered, w_sum, 1), np.nan)
+            out[i0:i0+len(grid), 2] = np.where(covered, 1 / np.sqrt(np.where(covered, w_sum, 1)), np.nan)
+            out.flush()
+    finally:
+        for f in files.values():
+            f.close()
+        del out
+
+    return n, n_entries
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Stitch lwa scan windows into one spectrum')
+    parser.add_argument('output', help='Output .npy file name. Columns: frequency (MHz), intensity (V), noise (V)')
+    parser.add_argument('lwa', nargs='+', help='lwa file names')
+    parser.add_argument('-step', type=float, required=True, help='Grid step (MHz)')
+    parser.add_argument('-range', type=float, nargs=2, help='Grid frequency range (MHz)')
+    parser.add_argument('-comment', help='Only stitch entries whose comment matches this regular expression')
+    args = parser.parse_args()
+
+    n, n_entries = stitch(args.lwa, args.output, args.step, freq_range=args.range, comment=args.comment)
+    print('{:d} entries stitched onto {:d} points in {:s}'.format(n_entries, n, args.output))
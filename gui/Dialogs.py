@@ -6,8 +6,11 @@ from PyQt5 import QtGui, QtCore
 from api import general as api_gen
 from api import synthesizer as api_syn
 from api import lockin as api_lia
+from api import validator as api_val
 from gui import SharedWidgets as Shared
 from data import lwaparser
+from data import catalog
+import os
 from pyqtgraph import siFormat
 import pyqtgraph as pg
 
@@ -602,7 +605,10 @@ class LWAParserDialog(QtGui.QDialog):
         self.mainLayout.addWidget(QtGui.QLabel('Source file: {:s}'.format(filename)))
 
         # read lwa batch scan entry from file
-        self.entry_settings, self.hd_line_num = lwaparser.scan_header(filename)
+        self.entry_settings, self.entry_index = lwaparser.scan_header(filename)
+        self.catalogButton = QtGui.QPushButton('Scan Catalog')
+        self.catalogButton.setToolTip('Search scans across all cataloged lwa files')
+        self.catalogButton.clicked.connect(self.open_catalog)
 
         if self.entry_settings:
             # set top buttons
@@ -617,6 +623,7 @@ class LWAParserDialog(QtGui.QDialog):
             topButtonLayout.addWidget(self.exportLWAButton)
             topButtonLayout.addWidget(self.exportXYButton)
             topButtonLayout.addWidget(self.openFileButton)
+            topButtonLayout.addWidget(self.catalogButton)
             topButtons.setLayout(topButtonLayout)
             self.mainLayout.addWidget(topButtons)
 
@@ -687,6 +694,7 @@ class LWAParserDialog(QtGui.QDialog):
             self.exportLWAButtonGroup.buttonClicked[int].connect(self.add_to_export_list)
         else:
             self.mainLayout.addWidget(QtGui.QLabel('Invalid file! No scans found.'))
+            self.mainLayout.addWidget(self.catalogButton)
 
         self.setLayout(self.mainLayout)
 
@@ -694,7 +702,7 @@ class LWAParserDialog(QtGui.QDialog):
         ''' Preview single scan '''
 
         id_ = self.previewButtonGroup.checkedId()
-        preview_data = lwaparser.preview(id_, self.hd_line_num, src=self.filename)
+        preview_data = lwaparser.preview(id_, self.entry_index, src=self.filename)
         self.preview_win.setData(preview_data)
         self.preview_win.show()
 
@@ -721,7 +729,7 @@ class LWAParserDialog(QtGui.QDialog):
 
         # check if entry_id_to_export list is not empty
         if self.entry_id_to_export:
-            output_file, _ = QtGui.QFileDialog.getSaveFileName(self, 'Save lwa file', '', 'SMAP File (*.lwa)')
+            output_file, _ = QtGui.QFileDialog.getSaveFileName(self, 'Save lwa file', '', 'SMAP File (*.lwa *.lwa.gz *.lwa.xz)')
         else:
             d = Shared.MsgError(self, 'Empty List!', 'No scan is selected!')
             d.exec_()
@@ -733,7 +741,7 @@ class LWAParserDialog(QtGui.QDialog):
                              'Output file shall not overwrite source file')
             msg.exec_()
         elif output_file:
-            lwaparser.export_lwa(list(set(self.entry_id_to_export)), self.hd_line_num, src=self.filename, output=output_file)
+            lwaparser.export_lwa(list(set(self.entry_id_to_export)), self.entry_index, src=self.filename, output=output_file)
         else:
             pass
 
@@ -754,7 +762,20 @@ class LWAParserDialog(QtGui.QDialog):
                              'Output file shall not overwrite source file')
             msg.exec_()
         elif output_dir:
-            lwaparser.export_xy(list(set(self.entry_id_to_export)), self.hd_line_num, src=self.filename, output_dir=output_dir)
+            id_list = list(set(self.entry_id_to_export))
+            progressDialog = QtGui.QProgressDialog('Exporting scans...', 'Cancel', 0, len(id_list), self)
+            progressDialog.setWindowTitle('Export (XY Format)')
+            progressDialog.setWindowModality(QtCore.Qt.WindowModal)
+            progressDialog.setMinimumDuration(500)
+
+            def progress(n_done, n_total):
+                progressDialog.setValue(n_done)
+                QtGui.QApplication.processEvents()
+                return not progressDialog.wasCanceled()
+
+            lwaparser.export_xy(id_list, self.entry_index, src=self.filename,
+                                output_dir=output_dir, progress=progress)
+            progressDialog.close()
         else:
             pass
 
@@ -766,6 +787,12 @@ class LWAParserDialog(QtGui.QDialog):
         # launch a new dialog window
         self.parent.on_lwa_parser()
 
+    def open_catalog(self):
+        ''' Launch the scan catalog browser '''
+
+        d = ScanCatalogDialog(self)
+        d.exec_()
+
     def reject(self):
         self.preview_win.close()
         self.preview_win.deleteLater()
@@ -773,6 +800,180 @@ class LWAParserDialog(QtGui.QDialog):
         self.deleteLater()
 
 
+class ScanCatalogDialog(QtGui.QDialog):
+    '''
+        Dialog window to search scans across cataloged lwa files.
+    '''
+
+    def __init__(self, parent):
+        QtGui.QDialog.__init__(self, parent)
+        self.parent = parent
+        self.setMinimumWidth(1200)
+        self.setMinimumHeight(600)
+        self.setWindowTitle('LWA Scan Catalog')
+        self.conn = catalog.connect()
+        self.scans = []
+        self.preview_win = PrevSpectrumDialog(self)
+
+        addDirButton = QtGui.QPushButton('Add Folder')
+        addDirButton.clicked.connect(self.add_dir)
+        addFileButton = QtGui.QPushButton('Add Files')
+        addFileButton.clicked.connect(self.add_files)
+        refreshButton = QtGui.QPushButton('Refresh Catalog')
+        refreshButton.setToolTip('Index changed files again and drop removed files')
+        refreshButton.clicked.connect(self.refresh)
+        topButtons = QtGui.QWidget()
+        topButtonLayout = QtGui.QHBoxLayout()
+        topButtonLayout.addWidget(addDirButton)
+        topButtonLayout.addWidget(addFileButton)
+        topButtonLayout.addWidget(refreshButton)
+        topButtons.setLayout(topButtonLayout)
+
+        self.freqMinFill = QtGui.QLineEdit()
+        self.freqMinFill.setToolTip('Frequency covered by the scans. Fill in both for a range')
+        self.freqMaxFill = QtGui.QLineEdit()
+        self.dateCheck = QtGui.QCheckBox('Date')
+        self.dateFromEdit = QtGui.QDateEdit(QtCore.QDate.currentDate().addMonths(-1))
+        self.dateFromEdit.setCalendarPopup(True)
+        self.dateToEdit = QtGui.QDateEdit(QtCore.QDate.currentDate())
+        self.dateToEdit.setCalendarPopup(True)
+        self.mmodeSel = QtGui.QComboBox()
+        self.mmodeSel.addItems(['Any', 'NONE', 'AM', 'FM'])
+        self.harmSel = QtGui.QSpinBox()
+        self.harmSel.setRange(0, 99)
+        self.harmSel.setSpecialValueText('Any')
+        searchButton = QtGui.QPushButton('Search')
+        searchButton.clicked.connect(self.search)
+        self.freqMinFill.returnPressed.connect(self.search)
+        self.freqMaxFill.returnPressed.connect(self.search)
+        filterBox = QtGui.QWidget()
+        filterLayout = QtGui.QHBoxLayout()
+        filterLayout.addWidget(QtGui.QLabel('Freq (MHz)'))
+        filterLayout.addWidget(self.freqMinFill)
+        filterLayout.addWidget(QtGui.QLabel('to'))
+        filterLayout.addWidget(self.freqMaxFill)
+        filterLayout.addWidget(self.dateCheck)
+        filterLayout.addWidget(self.dateFromEdit)
+        filterLayout.addWidget(QtGui.QLabel('to'))
+        filterLayout.addWidget(self.dateToEdit)
+        filterLayout.addWidget(QtGui.QLabel('Modulation'))
+        filterLayout.addWidget(self.mmodeSel)
+        filterLayout.addWidget(QtGui.QLabel('Harmonics'))
+        filterLayout.addWidget(self.harmSel)
+        filterLayout.addWidget(searchButton)
+        filterBox.setLayout(filterLayout)
+
+        self.statusLabel = QtGui.QLabel()
+        self.resultTable = QtGui.QTableWidget()
+        self.resultTable.setColumnCount(11)
+        self.resultTable.setHorizontalHeaderLabels(['File', 'Scan #', 'Comment', 'Date',
+            'Start Freq (MHz)', 'Stop Freq (MHz)', 'Step Freq', 'Points', 'Average',
+            'Modulation', 'Harmonics'])
+        self.resultTable.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        self.resultTable.setSelectionBehavior(QtGui.QAbstractItemView.SelectRows)
+        self.resultTable.setToolTip('Double click to preview a scan')
+        self.resultTable.cellDoubleClicked.connect(self.preview_scan)
+
+        mainLayout = QtGui.QVBoxLayout()
+        mainLayout.addWidget(topButtons)
+        mainLayout.addWidget(filterBox)
+        mainLayout.addWidget(self.statusLabel)
+        mainLayout.addWidget(self.resultTable)
+        self.setLayout(mainLayout)
+
+        n_files = self.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+        self.statusLabel.setText('{:d} files in the catalog'.format(n_files))
+
+    def add_dir(self):
+
+        dirname = QtGui.QFileDialog.getExistingDirectory(self, 'Select directory of lwa files')
+        if dirname:
+            self.update_catalog([dirname])
+        else:
+            pass
+
+    def add_files(self):
+
+        filenames, _ = QtGui.QFileDialog.getOpenFileNames(self, 'Add LWA Files', '', 'SMAP Data File (*.lwa *.lwa.gz *.lwa.xz)')
+        if filenames:
+            self.update_catalog(filenames)
+        else:
+            pass
+
+    def refresh(self):
+
+        self.update_catalog(None)
+
+    def update_catalog(self, paths):
+
+        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            n = catalog.update_catalog(self.conn, paths)
+        except (OSError, ValueError, IndexError) as err:
+            QtGui.QApplication.restoreOverrideCursor()
+            msg = Shared.MsgError(self, 'Catalog Error!', 'Cannot catalog file: {:s}'.format(str(err)))
+            msg.exec_()
+            return None
+        QtGui.QApplication.restoreOverrideCursor()
+        n_files = self.conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+        self.statusLabel.setText('{:d} files in the catalog. {:d} scans added'.format(n_files, n))
+
+    def search(self):
+        ''' Query the catalog and list the scans found '''
+
+        code_min, freq_min = api_val.val_float(self.freqMinFill.text())
+        code_max, freq_max = api_val.val_float(self.freqMaxFill.text())
+        if code_min and code_max:
+            freq, freq_range = None, (min(freq_min, freq_max), max(freq_min, freq_max))
+        elif code_min:
+            freq, freq_range = freq_min, None
+        else:
+            freq, freq_range = None, None
+        if self.dateCheck.isChecked():
+            date_range = (self.dateFromEdit.date().toPyDate(), self.dateToEdit.date().toPyDate())
+        else:
+            date_range = None
+        mmode = self.mmodeSel.currentText() if self.mmodeSel.currentIndex() else None
+        harm = self.harmSel.value() if self.harmSel.value() else None
+
+        self.scans = catalog.query(self.conn, freq=freq, freq_range=freq_range,
+                                   date_range=date_range, mmode=mmode, harm=harm)
+        self.statusLabel.setText('{:d} scans found'.format(len(self.scans)))
+        self.resultTable.setRowCount(len(self.scans))
+        for row, scan in enumerate(self.scans):
+            items = [os.path.basename(scan['path']), '{:d}'.format(scan['scan_num']),
+                     scan['comment'], scan['date'] or '',
+                     '{:.3f}'.format(scan['startf']), '{:.3f}'.format(scan['stopf']),
+                     '{:.3f}'.format(scan['step']), '{:d}'.format(scan['pts']),
+                     '{:d}'.format(scan['avg']), scan['mmode'], '{:d}'.format(scan['harm'])]
+            for col, text in enumerate(items):
+                self.resultTable.setItem(row, col, QtGui.QTableWidgetItem(text))
+            self.resultTable.item(row, 0).setToolTip(scan['path'])
+
+    def preview_scan(self, row, col):
+        ''' Preview the scan in the double clicked row '''
+
+        scan = self.scans[row]
+        try:
+            entry_index = lwaparser.load_index(scan['path'])
+            if entry_index[scan['scan_num']-1]['offset'] == scan['offset']:
+                preview_data = lwaparser.preview(scan['scan_num']-1, entry_index, src=scan['path'])
+            else:
+                raise IndexError
+        except (OSError, IndexError, ValueError):
+            msg = Shared.MsgError(self, 'Cannot preview!',
+                                  'The file has changed. Please refresh the catalog.')
+            msg.exec_()
+            return None
+        self.preview_win.setData(preview_data)
+        self.preview_win.show()
+
+    def reject(self):
+        self.preview_win.close()
+        self.conn.close()
+        self.accept()
+
+
 class PrevSpectrumDialog(QtGui.QDialog):
     '''
         Preview dialog window for spectrum
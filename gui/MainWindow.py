@@ -8,6 +8,8 @@ from gui import Panels
 from gui import Dialogs
 from daq import ScanLockin
 from daq import PresReader
+from daq import SettleCalib
+from data import checkpoint
 from api import general as api_gen
 from api import synthesizer as api_syn
 from api import lockin as api_lia
@@ -62,6 +64,14 @@ class MainWindow(QtGui.QMainWindow):
         scanJPLAction.setStatusTip('Use the scanning style of the JPL scanning routine')
         scanJPLAction.triggered.connect(self.on_scan_jpl)
 
+        scanJPLResumeAction = QtGui.QAction('Resume JPL Batch', self)
+        scanJPLResumeAction.setStatusTip('Resume an unfinished JPL batch job from its checkpoint')
+        scanJPLResumeAction.triggered.connect(lambda: self.on_scan_jpl(resume=True))
+
+        settleCalibAction = QtGui.QAction('Settle Time Calibration', self)
+        settleCalibAction.setStatusTip('Calibrate the minimum safe wait time of lockin scans on a strong line')
+        settleCalibAction.triggered.connect(self.on_settle_calib)
+
         scanPCIAction = QtGui.QAction('PCI Oscilloscope', self)
         scanPCIAction.setShortcut('Ctrl+Shift+S')
         scanPCIAction.setStatusTip("Use the scanning style of Brian's NIPCI card routine")
@@ -98,6 +108,8 @@ class MainWindow(QtGui.QMainWindow):
         menuInst.addAction(instCloseAction)
         menuScan = self.menuBar().addMenu('&Scan')
         menuScan.addAction(scanJPLAction)
+        menuScan.addAction(scanJPLResumeAction)
+        menuScan.addAction(settleCalibAction)
         menuScan.addAction(scanPCIAction)
         menuScan.addAction(scanCavityAction)
         menuScan.addAction(presReaderAction)
@@ -219,32 +231,67 @@ class MainWindow(QtGui.QMainWindow):
         # simply uncheck panels to prevent the warning dialog
         self.refresh_inst()
 
-    def on_scan_jpl(self):
+    def on_scan_jpl(self, resume=False):
+        ''' Start a JPL batch job.
+            If resume is True, resume an unfinished batch job from its checkpoint
+        '''
 
         # when invoke this dialog, pause live lockin monitor in the main panel
         self.liaMonitor.stop()
 
         # if it is test mode, or real-run mode with instrument correctly connected
         if self.testModeAction.isChecked() or (self.synHandle and self.liaHandle):
-            dconfig = ScanLockin.JPLScanConfig(main=self)
-            entry_settings = None
-            dconfig_result = dconfig.exec_()
+            pass
         else:
             # instrument handle is None, pop up error
             msg = Shared.MsgError(self, 'Instrument Offline!', 'Connect to the synthesizer and lockin first before proceed.')
             msg.exec_()
             return None
 
+        if resume:
+            filename, _ = QtGui.QFileDialog.getOpenFileName(self, 'Resume Batch', '',
+                          'Batch Checkpoint (*{:s})'.format(checkpoint.CHECKPOINT_EXT))
+            if filename:
+                try:
+                    state, arrays = checkpoint.load_checkpoint(filename)
+                except (OSError, KeyError, ValueError):
+                    msg = Shared.MsgError(self, 'Invalid Checkpoint!', 'Cannot read batch checkpoint {:s}'.format(filename))
+                    msg.exec_()
+                    return None
+                entry_settings = [tuple(entry) for entry in state['entry_settings']]
+                dscan = ScanLockin.JPLScanWindow(entry_settings, state['filename'], main=self,
+                                                 acq_mode=state['acq_mode'],
+                                                 checkpoint=(state, arrays))
+                dscan.exec_()
+            else:
+                pass
+            return None
+        else:
+            dconfig = ScanLockin.JPLScanConfig(main=self)
+            entry_settings = None
+            dconfig_result = dconfig.exec_()
+
         # this loop makes sure the config dialog does not disappear
         # unless the settings are all valid / or user hits cancel
         while dconfig_result:  # if dialog accepted
             entry_settings, filename = dconfig.get_settings()
             if entry_settings:
-                total_time = Shared.jpl_scan_time(entry_settings)
+                survey = dconfig.get_survey()
+                if survey:
+                    total_time = Shared.jpl_scan_time(ScanLockin.coarse_entry_settings(entry_settings, survey))
+                else:
+                    total_time = Shared.jpl_scan_time(entry_settings)
                 now = datetime.datetime.today()
                 length = datetime.timedelta(seconds=total_time)
                 then = now + length
                 text = 'This batch job is estimated to take {:s}.\nIt is expected to finish at {:s}.'.format(str(length), then.strftime('%I:%M %p, %m-%d-%Y (%a)'))
+                max_time = Shared.jpl_scan_time(entry_settings, worst_case=True)
+                if survey:
+                    text += '\nThis is the coarse survey only. Fine scans are added over the features found.'
+                elif max_time > total_time:
+                    text += '\nAdaptive averaging may extend it up to {:s}.'.format(str(datetime.timedelta(seconds=max_time)))
+                else:
+                    pass
                 q = Shared.MsgInfo(self, 'Time Estimation', text)
                 q.addButton(QtGui.QMessageBox.Cancel)
                 qres = q.exec_()
@@ -256,11 +303,26 @@ class MainWindow(QtGui.QMainWindow):
                 dconfig_result = dconfig.exec_()
 
         if entry_settings and dconfig_result:
-            dscan = ScanLockin.JPLScanWindow(entry_settings, filename, main=self)
+            dscan = ScanLockin.JPLScanWindow(entry_settings, filename, main=self,
+                                             acq_mode=dconfig.acqModeSel.currentIndex(),
+                                             survey=survey)
             dscan.exec_()
         else:
             pass
 
+    def on_settle_calib(self):
+        ''' Launch the lockin settle time calibration dialog '''
+
+        # pause live lockin monitor during the calibration
+        self.liaMonitor.stop()
+
+        if self.testModeAction.isChecked() or (self.synHandle and self.liaHandle):
+            d = SettleCalib.SettleCalibDialog(main=self)
+            d.exec_()
+        else:
+            msg = Shared.MsgError(self, 'Instrument Offline!', 'Connect to the synthesizer and lockin first before proceed.')
+            msg.exec_()
+
     def on_scan_pci(self):
         d = Dialogs.ViewPG(self)
         d.exec_()
@@ -280,7 +342,7 @@ class MainWindow(QtGui.QMainWindow):
         ''' Launch lwa parser dialog window '''
 
         filename, _ = QtGui.QFileDialog.getOpenFileName(self, 'Open LWA File',
-                                './default.lwa', 'SMAP Data File (*.lwa)')
+                                './default.lwa', 'SMAP Data File (*.lwa *.lwa.gz *.lwa.xz)')
 
         d = Dialogs.LWAParserDialog(self, filename)
         d.exec_()
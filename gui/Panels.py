@@ -1283,7 +1283,6 @@ class LockinMonitor(QtGui.QWidget):
         self.slenFill = QtGui.QLineEdit()
         self.slenFill.setText('100')
         self.slenFill.setStyleSheet('border: 1px solid {:s}'.format(Shared.msgcolor(2)))
-        self.data = np.zeros(100)
         self.yMaxSel = QtGui.QComboBox()
         self.yMaxSel.addItems(['1 V', '100 mV', '10 mV', '1 mV', '100 uV', '10 uV', '1 uV', '100 nV', '10 nV'])
         self.updateRate = QtGui.QComboBox()
@@ -1310,7 +1309,13 @@ class LockinMonitor(QtGui.QWidget):
         self.pgPlot = pg.PlotWidget(title='Lockin Monitor')
         self.pgPlot.setLabel('left', text='Lockin Signal', units='V')
         self.pgPlot.setYRange(0, 1)
-        self.curve = self.pgPlot.plot(self.data)
+        # ring buffer of samples. x holds the sample number, and the slot
+        # after the newest sample is NaN to break the curve at the wrap point
+        self.data = np.full(101, np.nan)
+        self.xdata = np.full(101, np.nan)
+        self.curve = Shared.LiveCurve(self.pgPlot, connect='finite',
+                                       downsampling=False, parent=self)
+        self.curve.set_data(self.xdata, self.data)
         mainLayout = QtGui.QVBoxLayout()
         mainLayout.setAlignment(QtCore.Qt.AlignTop)
         mainLayout.addWidget(self.pgPlot)
@@ -1346,6 +1351,9 @@ class LockinMonitor(QtGui.QWidget):
     def restart(self):
 
         self.counter = 0    # reset counter
+        self.data.fill(np.nan)
+        self.xdata.fill(np.nan)
+        self.curve.mark_dirty(0, len(self.data))
         self.startButton.setChecked(True)   # retrigger start button
         self.startButton.setText('Pause')
         self.timer.start()
@@ -1361,7 +1369,9 @@ class LockinMonitor(QtGui.QWidget):
         status, slen = api_val.val_monitor_sample_len(text)
         self.slenFill.setStyleSheet('border: 1px solid {:s}'.format(Shared.msgcolor(status)))
         if status:
-            self.data = np.zeros(slen)
+            self.data = np.full(slen+1, np.nan)
+            self.xdata = np.full(slen+1, np.nan)
+            self.curve.set_data(self.xdata, self.data)
             self.restart()
         else:
             self.stop()
@@ -1382,24 +1392,23 @@ Automatically reset the update speed to 3pi * time_constant ''')
             self.updateRate.setCurrentIndex(7)
 
     def daq(self):
-        ''' If sampled points are less than the set length, fill up the array
-            If sampled points are more than the set length, roll the array
-            forward and fill the last array element with new data
+        ''' Write the new sample into the ring buffer, overwriting the
+            oldest one once the set length is reached
         '''
 
-        if self.counter < len(self.data):
-            self.data[self.counter] = api_lia.query_single_x(self.parent.liaHandle)
-            self.counter += 1
-        else:
-            self.data = np.roll(self.data, len(self.data)-1)
-            self.data[-1] = api_lia.query_single_x(self.parent.liaHandle)
+        i = self.counter % len(self.data)
+        self.data[i] = api_lia.query_single_x(self.parent.liaHandle)
+        self.xdata[i] = self.counter
+        # clear the next slot to break the curve between newest and oldest
+        i_next = (i + 1) % len(self.data)
+        self.data[i_next] = np.nan
+        self.xdata[i_next] = np.nan
+        self.counter += 1
+        self.curve.mark_dirty(i, i+1)
+        self.curve.mark_dirty(i_next, i_next+1)
 
     def update_plot(self):
         self.daq()
-        if self.counter < len(self.data):
-            self.curve.setData(self.data[0:self.counter])
-        else:
-            self.curve.setData(self.data)
 
 
 class SpectrumMonitor(QtGui.QWidget):
@@ -9,8 +9,16 @@ from api import validator as api_val
 from api import synthesizer as api_syn
 from api import lockin as api_lia
 from api import pci as api_pci
+from data import average
+from data import settle
 
 
+# live plot refresh interval (ms). 50 ms = 20 frames per second
+FRAME_INTERVAL = 50
+
+# number of points drawn by each segment of a LiveCurve
+SEGMENT_SIZE = 2048
+
 # QPushButton label dictionary
 BUTTONLABEL = {'confirm':['Lets do it', 'Go forth and conquer', 'Ready to go',
                           'Looks good', 'Sounds about right'],
@@ -339,7 +347,9 @@ class JPLLIAScanEntry(QtGui.QWidget):
                        'modFreq': True,
                        'modAmp': True,
                        'refHarm': True,
-                       'refPhase': True}      # overall validator status
+                       'refPhase': True,
+                       'snrTarget': True,
+                       'maxAvg': True}      # overall validator status
 
         self.commentFill = QtGui.QLineEdit()
         self.startFreqFill = QtGui.QLineEdit()
@@ -358,6 +368,12 @@ class JPLLIAScanEntry(QtGui.QWidget):
         self.harmSel = QtGui.QComboBox()
         self.harmSel.addItems(['1', '2', '3', '4'])
         self.refPhaseFill = QtGui.QLineEdit()
+        self.snrTargetFill = QtGui.QLineEdit()
+        self.snrTargetFill.setToolTip('Finish the window once the SNR reaches this target. 0 to disable')
+        self.maxAvgFill = QtGui.QLineEdit()
+        self.maxAvgFill.setToolTip('Maximum averages to reach the SNR target')
+        # val_max_avg needs the SNR target before its field is filled
+        self.snrTarget = default[13]
 
         self.startFreqFill.textChanged.connect(self.val_start_freq)
         self.stopFreqFill.textChanged.connect(self.val_stop_freq)
@@ -367,11 +383,23 @@ class JPLLIAScanEntry(QtGui.QWidget):
         self.avgFill.textChanged.connect(self.val_avg)
         self.tcSel.currentIndexChanged.connect(self.val_waittime)
         self.waitTimeFill.textChanged.connect(self.val_waittime)
+        # default wait time follows the settle time calibration,
+        # until the user types in a wait time
+        self.settleTable = settle.load_table()
+        self.calibWaittime = None
+        self.waittimeAuto = True
+        self.waitTimeFill.textEdited.connect(self.set_manual_waittime)
+        self.tcSel.currentIndexChanged.connect(self.set_calib_waittime)
+        self.stepFill.textChanged.connect(self.set_calib_waittime)
         self.modModeSel.currentIndexChanged.connect(self.set_mod_mode)
         self.modFreqFill.textChanged.connect(self.val_syn_mod_freq)
         self.modAmpFill.textChanged.connect(self.val_syn_amp)
         self.harmSel.currentIndexChanged[str].connect(self.update_lia_harm)
         self.refPhaseFill.textChanged.connect(self.val_lia_phase)
+        self.snrTargetFill.textChanged.connect(self.val_snr_target)
+        self.snrTargetFill.textChanged.connect(self.val_max_avg)
+        self.avgFill.textChanged.connect(self.val_max_avg)
+        self.maxAvgFill.textChanged.connect(self.val_max_avg)
 
         # set up default values
         self.commentStr = str(default[0])
@@ -399,8 +427,14 @@ class JPLLIAScanEntry(QtGui.QWidget):
         self.harmSel.setCurrentIndex(self.refHarm-1 if self.refHarm < 5 else 0)
         self.refPhase = default[12]
         self.refPhaseFill.setText('{:.2f}'.format(self.refPhase))
+        self.snrTarget = default[13]
+        self.snrTargetFill.setText('{:g}'.format(self.snrTarget))
+        # max avg defaults to the planned averages
+        self.maxAvg = max(default[14], self.avg)
+        self.maxAvgFill.setText(str(self.maxAvg))
         self.modModeSel.setCurrentIndex(default[8])
         self.set_mod_mode(default[8])
+        self.set_calib_waittime()
 
     def set_mod_mode(self, index):
 
@@ -462,11 +496,29 @@ class JPLLIAScanEntry(QtGui.QWidget):
         self.avgFill.setStyleSheet('border: 1px solid {:s}'.format(msgcolor(status)))
         self.status['avg'] = bool(status)
 
+    def set_manual_waittime(self, text):
+
+        self.waittimeAuto = False
+
+    def set_calib_waittime(self):
+        ''' Look up the calibrated settle time of the current time constant,
+            lp slope and step size. Fill it in as the wait time unless
+            the wait time is typed in by the user.
+        '''
+
+        self.calibWaittime = settle.lookup_dwell(self.settleTable, self.tcSel.currentIndex(),
+                                                 self.main.liaInfo.lpSlopeIndex, self.step)
+        if self.calibWaittime and self.waittimeAuto:
+            self.waitTimeFill.setText('{:g}'.format(ceil(self.calibWaittime)))
+            self.waitTimeFill.setToolTip('Calibrated settle time')
+        else:
+            self.val_waittime()
+
     def val_waittime(self):
 
         text = self.waitTimeFill.text()
         tc_index = self.tcSel.currentIndex()
-        status, self.waittime = api_val.val_lia_waittime(text, tc_index)
+        status, self.waittime = api_val.val_lia_waittime(text, tc_index, self.calibWaittime)
         self.waitTimeFill.setStyleSheet('border: 1px solid {:s}'.format(msgcolor(status)))
         self.status['waittime'] = bool(status)
 
@@ -518,6 +570,24 @@ class JPLLIAScanEntry(QtGui.QWidget):
 
         self.refHarm = int(text)
 
+    def val_snr_target(self, text):
+
+        status, self.snrTarget = api_val.val_float(text, safe=[('>=', 0)])
+        self.snrTargetFill.setStyleSheet('border: 1px solid {:s}'.format(msgcolor(status)))
+        self.status['snrTarget'] = (status == 2)
+
+    def val_max_avg(self):
+        ''' Maximum averages cannot be less than the planned averages,
+            if adaptive averaging is on (SNR target > 0)
+        '''
+
+        if self.snrTarget > 0:
+            status, self.maxAvg = api_val.val_int(self.maxAvgFill.text(), safe=[('>=', max(self.avg, 1))])
+        else:
+            status, self.maxAvg = api_val.val_int(self.maxAvgFill.text(), safe=[('>', 0)])
+        self.maxAvgFill.setStyleSheet('border: 1px solid {:s}'.format(msgcolor(status)))
+        self.status['maxAvg'] = bool(status)
+
 class JPLLIABatchListEntry(QtGui.QWidget):
     ''' Single batch list entry in display mode.
     entry = (comment [str], start [float, MHz], stop [float, MHz],
@@ -647,6 +717,89 @@ class LWAScanHdEntry(QtGui.QWidget):
         self.phaseLabel.setText('{:.2f} deg'.format(entry_setting[16]))
 
 
+class LiveCurve(QtCore.QObject):
+    ''' Frame-rate-limited curve for live data.
+        The curve is split into segments of SEGMENT_SIZE points, each drawn
+        by its own PlotDataItem. Data changes only mark the touched points
+        dirty, and dirty segments are redrawn at most once per frame.
+    '''
+
+    def __init__(self, plot, pen=None, connect='all', downsampling=True,
+                 parent=None, seg_size=SEGMENT_SIZE, interval=FRAME_INTERVAL):
+        ''' Arguments
+                plot: pyqtgraph PlotItem / PlotWidget to draw the curve in
+                pen: pyqtgraph pen
+                connect: str, connect argument of PlotDataItem.
+                         'finite' breaks the curve at NaN points
+                downsampling: bool, peak downsampling of x-sorted data
+                parent: QObject, owner of the refresh timer
+                seg_size: int, number of points in each segment
+                interval: int, refresh interval (ms)
+        '''
+        QtCore.QObject.__init__(self, parent)
+        self.plot = plot
+        self.pen = pen
+        self.connect = connect
+        self.downsampling = downsampling
+        self.seg_size = seg_size
+        self.x = np.zeros(0)
+        self.y = np.zeros(0)
+        self.segments = []
+        self.dirty = set()
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.redraw)
+        self.timer.start()
+
+    def set_data(self, x, y):
+        ''' Replace the whole curve. x and y are kept by reference,
+            so that in-place changes are drawn after mark_dirty.
+        '''
+
+        self.x = x
+        self.y = y
+        n_seg = ceil(len(x) / self.seg_size)
+        while len(self.segments) < n_seg:
+            item = self.plot.plot(connect=self.connect)
+            if self.downsampling:
+                item.setDownsampling(auto=True, method='peak')
+            else:
+                pass
+            if self.pen:
+                item.setPen(self.pen)
+            else:
+                pass
+            self.segments.append(item)
+        while len(self.segments) > n_seg:
+            self.plot.removeItem(self.segments.pop())
+        self.dirty = set(range(n_seg))
+
+    def mark_dirty(self, start, stop):
+        ''' Mark points in [start, stop) as changed '''
+
+        # the first point of a segment is also drawn by the previous one
+        if stop > start:
+            self.dirty.update(range(max(start - 1, 0) // self.seg_size,
+                                    min((stop - 1) // self.seg_size + 1, len(self.segments))))
+        else:
+            pass
+
+    def redraw(self):
+        ''' Redraw dirty segments. Triggered by self.timer '''
+
+        for i in self.dirty:
+            start = i * self.seg_size
+            # one point of overlap joins neighbouring segments
+            stop = min(start + self.seg_size + 1, len(self.x))
+            self.segments[i].setData(self.x[start:stop], self.y[start:stop])
+        self.dirty.clear()
+
+    def stop(self):
+
+        self.timer.stop()
+
+
 def msgcolor(status_code):
     ''' Return message color based on status_code.
         0: fatal, red
@@ -692,8 +845,22 @@ def gen_x_array(start, stop, step):
         return x
 
 
-def jpl_scan_time(jpl_entry_settings):
-    ''' Estimate the time expense of batch scan JPL style '''
+def jpl_planned_avg(entry_setting):
+    ''' Planned averages of a JPL scan entry before the scan starts.
+        With an SNR target, at least average.SNR_MIN_AVG sweeps are needed
+        to estimate the noise, as far as the maximum averages allow.
+    '''
+
+    if len(entry_setting) > 13 and entry_setting[13] > 0:
+        return max(entry_setting[4], min(average.SNR_MIN_AVG, entry_setting[14]))
+    else:
+        return entry_setting[4]
+
+
+def jpl_scan_time(jpl_entry_settings, worst_case=False):
+    ''' Estimate the time expense of batch scan JPL style.
+        If worst_case, entries with an SNR target take their maximum averages.
+    '''
 
     if isinstance(jpl_entry_settings, list):
         pass
@@ -703,8 +870,12 @@ def jpl_scan_time(jpl_entry_settings):
     total_time = 0
     for entry in jpl_entry_settings:
         start, stop, step = entry[1:4]
+        if worst_case and len(entry) > 13 and entry[13] > 0:
+            avg = entry[14]
+        else:
+            avg = jpl_planned_avg(entry)
         # estimate total data points to be taken
-        data_points = ceil((abs(stop - start) + step) / step) * entry[4]
+        data_points = ceil((abs(stop - start) + step) / step) * avg
         # time expense for this entry in seconds
         total_time += data_points * entry[7] * 1e-3
 
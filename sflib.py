@@ -11,7 +11,7 @@ calculation. Fit up to 4-th derivative.
 
 The script supports comma, tab and space delimited xy files with any
 number of lines of header information.
-Requires numpy1.8+ and scipy0.16+
+Requires numpy1.8+ and scipy0.18+
 '''
 
 import os
@@ -19,10 +19,19 @@ import re
 import numpy as np
 from scipy.optimize import curve_fit
 from scipy.optimize import leastsq
+from scipy.optimize import least_squares
 from math import pi
 from math import isinf
 from scipy import interpolate
 
+# fit status codes
+FIT_STAT = {0: 'Fit successful',
+            1: 'Fit failed',
+            2: 'File not found',
+            3: 'Unsupported file format',
+            4: 'Baseline removal failed',
+            5: 'Input Invalid'}
+
 # ----------------------------------------
 # ---- Class and Function Declaration ----
 # ----------------------------------------
@@ -30,10 +39,15 @@ from scipy import interpolate
 class Function:
     ''' Function class stores all sorts of function form. In spectroscopic
     context, gaussian/lorentzian function families are supported. Also,
-    up to second derivative of these functions are defined to descibe the
+    up to 4-th derivative of these functions are defined to descibe the
     common spectra lineshape obtained by spectroscopic experiments.
     Coefficients are defined so as 0-derivative functions are normalized.
     The user may add more customized funtion form to it.
+
+    All peaks are evaluated at once on a (peak x points) grid. The grid
+    buffers are kept between calls, because curve_fit calls the function
+    with the same x many times. Each function also accepts an optional
+    out array of len(x) for the result.
     '''
 
     # Class variable: function family name list. User may add their own.
@@ -43,6 +57,8 @@ class Function:
         self.ftype = ftype
         self.der = der
         self.peak = peak
+        # reusable grid buffers
+        self._buf = None
 
     def get_func(self):
         # get gaussian function family
@@ -71,113 +87,264 @@ class Function:
             elif self.der == 4:
                 return self.lder4
 
+    def get_jac(self):
+        # get the jacobian of get_func, for curve_fit
+        # gaussian function family
+        if not self.ftype:
+            if self.der == 0:
+                return self.gjac0
+            elif self.der == 1:
+                return self.gjac1
+            elif self.der == 2:
+                return self.gjac2
+            elif self.der == 3:
+                return self.gjac3
+            elif self.der == 4:
+                return self.gjac4
+
+        # lorentzian function family
+        if self.ftype == 1:
+            if self.der == 0:
+                return self.ljac0
+            elif self.der == 1:
+                return self.ljac1
+            elif self.der == 2:
+                return self.ljac2
+            elif self.der == 3:
+                return self.ljac3
+            elif self.der == 4:
+                return self.ljac4
+
+    def _grid(self, n):
+        ''' Get 3 grid buffers of shape (peak, n) '''
+        if self._buf is None or self._buf[0].shape != (self.peak, n):
+            self._buf = tuple(np.empty((self.peak, n)) for i in range(3))
+        return self._buf
+
+    def _par(self, p):
+        ''' Split the parameter vector to mu & width columns, and A '''
+        par = np.asarray(p[:3*self.peak], dtype=float).reshape(self.peak, 3)
+        return par[:, 0:1], par[:, 1:2], par[:, 2]
+
+    def _gaussian(self, x, p, der, out=None):
+        ''' Sum of gaussian der-th derivatives of all peaks.
+        With u = (x-mu)/sigma, the der-th derivative is
+            A/(sqrt(2pi)*sigma^(der+1)) * (-1)^der He_der(u) * exp(-u^2/2)
+        where He is the (probabilists') Hermite polynomial.
+        '''
+        x = np.asarray(x, dtype=float)
+        mu, sigma, A = self._par(p)
+        u, e, _ = self._grid(x.size)
+        # u = (x-mu)/sigma
+        np.subtract(x.reshape(1, -1), mu, out=u)
+        u /= sigma
+        # e = exp(-u^2/2)
+        np.multiply(u, u, out=e)
+        e *= -0.5
+        np.exp(e, out=e)
+        c = A/(np.sqrt(2*pi)*sigma[:, 0]**(der+1))
+        # e *= (-1)^der He_der(u). u is overwritten
+        if der == 1:
+            e *= u
+            c = -c
+        elif der == 2:
+            u *= u
+            u -= 1
+            e *= u
+        elif der == 3:
+            e *= u
+            u *= u
+            np.subtract(3, u, out=u)
+            e *= u
+        elif der == 4:
+            # u^4 - 6u^2 + 3 = (u^2-3)^2 - 6
+            u *= u
+            u -= 3
+            u *= u
+            u -= 6
+            e *= u
+        else:
+            pass
+        # sum over peaks
+        return np.dot(c, e, out=out).reshape(x.shape)
+
+    def _lorentzian(self, x, p, der, out=None):
+        ''' Sum of lorentzian der-th derivatives of all peaks.
+        With d = x-mu, h = gamma/2 and q = d^2 + h^2, the der-th derivative is
+            A*gamma/pi * poly_der(d) / q^(der+1)
+        '''
+        x = np.asarray(x, dtype=float)
+        mu, gamma, A = self._par(p)
+        d, q, t = self._grid(x.size)
+        h2 = gamma**2/4
+        # d = x-mu, t = d^2, q = d^2 + h^2
+        np.subtract(x.reshape(1, -1), mu, out=d)
+        np.multiply(d, d, out=t)
+        np.add(t, h2, out=q)
+        c = A*gamma[:, 0]/pi
+        # t = poly_der(d). d is overwritten
+        if der == 0:
+            c = c/2
+        elif der == 1:
+            np.negative(d, out=t)
+        elif der == 2:
+            # h^2 - 3d^2
+            t *= -3
+            t += h2
+        elif der == 3:
+            # d*(3d^2 + 5h^2)
+            t *= 3
+            t += 5*h2
+            t *= d
+        elif der == 4:
+            # 5gamma^4/256 - 13(d*gamma)^2/2 - 15d^4
+            np.multiply(t, -15, out=d)
+            d -= 26*h2
+            t *= d
+            t += 5*h2**2/16
+        else:
+            pass
+        # t /= q^(der+1)
+        if der == 0:
+            np.reciprocal(q, out=t)
+        else:
+            np.reciprocal(q, out=q)
+            for i in range(der+1):
+                t *= q
+        # sum over peaks
+        return np.dot(c, t, out=out).reshape(x.shape)
+
+    def _jac_table(self, x, dmu, dwidth, dA):
+        ''' Arrange (peak, points) partial derivatives to the
+        (points, 3*peak) jacobian, in the parameter order of p '''
+        jac = np.empty((x.size, self.peak, 3))
+        jac[:, :, 0] = dmu.T
+        jac[:, :, 1] = dwidth.T
+        jac[:, :, 2] = dA.T
+        return jac.reshape(x.size, 3*self.peak)
+
+    def _gaussian_jac(self, x, p, der):
+        ''' Partial derivatives of _gaussian to (mu, sigma, A) of each peak.
+        With H_n = (-1)^n He_n(u) and E = exp(-u^2/2)/(sqrt(2pi)*sigma^(n+1)),
+            d/dmu = -A*E*H_(n+1)/sigma
+            d/dsigma = -A*E*((n+1)*H_n + u*H_(n+1))/sigma
+            d/dA = E*H_n
+        '''
+        x = np.asarray(x, dtype=float).reshape(-1)
+        mu, sigma, A = self._par(p)
+        A = A[:, np.newaxis]
+        u = (x - mu)/sigma
+        e = np.exp(-u**2/2)/(np.sqrt(2*pi)*sigma**(der+1))
+        # H_(k+1) = -u*H_k - k*H_(k-1)
+        h_prev = np.zeros_like(u)
+        h = np.ones_like(u)
+        for k in range(der+1):
+            h_prev, h = h, -u*h - k*h_prev
+        # h_prev = H_n, h = H_(n+1)
+        dA = e*h_prev
+        dmu = -A*e*h/sigma
+        dsigma = -A*e*((der+1)*h_prev + u*h)/sigma
+        return self._jac_table(x, dmu, dsigma, dA)
+
+    def _lorentzian_jac(self, x, p, der):
+        ''' Partial derivatives of _lorentzian to (mu, gamma, A) of each peak.
+        With s = h^2 = gamma^2/4, m = der+1, F = A*gamma*k/pi * P(d, s)/q^m,
+            d/dmu = -A*gamma*k/pi * (dP/dd - 2m*d*P/q)/q^m
+            d/dgamma = F/gamma + A*gamma^2*k/(2pi) * (dP/ds - m*P/q)/q^m
+            d/dA = F/A
+        k = 1/2 for der 0 and 1 otherwise
+        '''
+        x = np.asarray(x, dtype=float).reshape(-1)
+        mu, gamma, A = self._par(p)
+        A = A[:, np.newaxis]
+        s = gamma**2/4
+        d = x - mu
+        qi = 1/(d**2 + s)
+        # P(d, s), dP/dd, dP/ds
+        if der == 0:
+            P, Pd, Ps = np.ones_like(d), 0, 0
+        elif der == 1:
+            P, Pd, Ps = -d, -1, 0
+        elif der == 2:
+            P, Pd, Ps = s - 3*d**2, -6*d, 1
+        elif der == 3:
+            P, Pd, Ps = d*(3*d**2 + 5*s), 9*d**2 + 5*s, 5*d
+        elif der == 4:
+            P = -15*d**4 - 26*s*d**2 + 5*s**2/16
+            Pd = -60*d**3 - 52*s*d
+            Ps = -26*d**2 + 5*s/8
+        m = der + 1
+        k = 0.5 if der == 0 else 1
+        qm = qi**m
+        dA = gamma*k/pi*P*qm
+        dmu = -A*gamma*k/pi*(Pd - 2*m*d*P*qi)*qm
+        dgamma = A*k/pi*P*qm + A*gamma**2*k/(2*pi)*(Ps - m*P*qi)*qm
+        return self._jac_table(x, dmu, dgamma, dA)
+
     # Gaussian family functions. Integrate[g(x; mu, sigma, A)] = A
-    def gder0(self, x, *p):
-        #! g = p[-1]
-        g = 0
-        for n in range(self.peak):
-            A = p[3*n+2]
-            sigma = p[3*n+1]
-            mu = p[3*n]
-            g += A/(np.sqrt(2*pi)*sigma)*np.exp(-(x-mu)**2/(2*sigma**2))
-        return g
-
-    def gder1(self, x, *p):
-        #! g = p[-1]
-        g = 0
-        for n in range(self.peak):
-            A = p[3*n+2]
-            sigma = p[3*n+1]
-            mu = p[3*n]
-            g += -A*(x-mu)/(np.sqrt(2*pi)*sigma**3)*np.exp(-(x-mu)**2/(2*sigma**2))
-        return g
-
-    def gder2(self, x, *p):
-        #! g = p[-1]
-        g = 0
-        for n in range(self.peak):
-            A = p[3*n+2]
-            sigma = p[3*n+1]
-            mu = p[3*n]
-            g += A/(np.sqrt(2*pi)*sigma**3)*(np.exp(-(x-mu)**2/(2*sigma**2))
-                                             *((x-mu)**2/(sigma**2)-1))
-        return g
-
-    def gder3(self, x, *p):
-        #! g = p[-1]
-        g = 0
-        for n in range(self.peak):
-            A = p[3*n+2]
-            sigma = p[3*n+1]
-            mu = p[3*n]
-            g += A/(np.sqrt(2*pi)*sigma**5)*(x-mu)*np.exp(
-                 -(x-mu)**2/(2*sigma**2))*(3-((x-mu)/sigma)**2)
-        return g
-
-    def gder4(self, x, *p):
-        #! g = p[-1]
-        g = 0
-        for n in range(self.peak):
-            A = p[3*n+2]
-            sigma = p[3*n+1]
-            mu = p[3*n]
-            g += A/(np.sqrt(2*pi)*sigma**5)*(3-6*((x-mu)/sigma)**2+
-                 ((x-mu)/sigma)**4)*np.exp(-(x-mu)**2/(2*sigma**2))
-        return g
+    # p = (mu, sigma, A) of each peak
+    def gder0(self, x, *p, out=None):
+        return self._gaussian(x, p, 0, out)
+
+    def gder1(self, x, *p, out=None):
+        return self._gaussian(x, p, 1, out)
+
+    def gder2(self, x, *p, out=None):
+        return self._gaussian(x, p, 2, out)
+
+    def gder3(self, x, *p, out=None):
+        return self._gaussian(x, p, 3, out)
+
+    def gder4(self, x, *p, out=None):
+        return self._gaussian(x, p, 4, out)
 
     # Lorentzian family functions. Integrate[l(x; mu, gamma, A)] = A
-    # gamma is FWHM
-    def lder0(self, x, *p):
-        #! l = p[-1]
-        l = 0
-        for n in range(self.peak):
-            mu = p[3*n]
-            gamma = p[3*n+1]
-            A = p[3*n+2]
-            l += A*gamma/(2*pi*((x-mu)**2+gamma**2/4))
-        return l
-
-    def lder1(self, x, *p):
-        #! l = p[-1]
-        l = 0
-        for n in range(self.peak):
-            mu = p[3*n]
-            gamma = p[3*n+1]
-            A = p[3*n+2]
-            l += -A*gamma*(x-mu)/(pi*((x-mu)**2+gamma**2/4)**2)
-        return l
-
-    def lder2(self, x, *p):
-        #! l = p[-1]
-        l = 0
-        for n in range(self.peak):
-            mu = p[3*n]
-            gamma = p[3*n+1]
-            A = p[3*n+2]
-            l += A*gamma*(-3*(x-mu)**2+gamma**2/4)/(pi*((x-mu)**2+gamma**2/4)**3)
-        return l
-
-    def lder3(self, x, *p):
-        #! l = p[-1]
-        l = 0
-        for n in range(self.peak):
-            mu = p[3*n]
-            gamma = p[3*n+1]
-            A = p[3*n+2]
-            l += A*gamma*(x-mu)/(pi*((x-mu)**2+gamma**2/4)**4)*(
-                 3*(x-mu)**2+5*gamma**2/4)
-        return l
-
-    def lder4(self, x, *p):
-        #! l = p[-1]
-        l = 0
-        for n in range(self.peak):
-            mu = p[3*n]
-            gamma = p[3*n+1]
-            A = p[3*n+2]
-            l += A*gamma/(pi*((x-mu)**2+gamma**2/4)**5)*(
-                 5*gamma**4/256-13*((x-mu)*gamma)**2/2-15*(x-mu)**4)
-        return l
+    # gamma is FWHM. p = (mu, gamma, A) of each peak
+    def lder0(self, x, *p, out=None):
+        return self._lorentzian(x, p, 0, out)
+
+    def lder1(self, x, *p, out=None):
+        return self._lorentzian(x, p, 1, out)
+
+    def lder2(self, x, *p, out=None):
+        return self._lorentzian(x, p, 2, out)
+
+    def lder3(self, x, *p, out=None):
+        return self._lorentzian(x, p, 3, out)
+
+    def lder4(self, x, *p, out=None):
+        return self._lorentzian(x, p, 4, out)
+
+    # Jacobians of the function families, (len(x), 3*peak)
+    def gjac0(self, x, *p):
+        return self._gaussian_jac(x, p, 0)
+
+    def gjac1(self, x, *p):
+        return self._gaussian_jac(x, p, 1)
+
+    def gjac2(self, x, *p):
+        return self._gaussian_jac(x, p, 2)
+
+    def gjac3(self, x, *p):
+        return self._gaussian_jac(x, p, 3)
+
+    def gjac4(self, x, *p):
+        return self._gaussian_jac(x, p, 4)
+
+    def ljac0(self, x, *p):
+        return self._lorentzian_jac(x, p, 0)
+
+    def ljac1(self, x, *p):
+        return self._lorentzian_jac(x, p, 1)
+
+    def ljac2(self, x, *p):
+        return self._lorentzian_jac(x, p, 2)
+
+    def ljac3(self, x, *p):
+        return self._lorentzian_jac(x, p, 3)
+
+    def ljac4(self, x, *p):
+        return self._lorentzian_jac(x, p, 4)
 
 
 def base(xdata, popt, f):
@@ -254,6 +421,186 @@ def fit_baseline(xdata, ydata, deg):
         return [], [], 0, [], stat
 
 
+def _extrema(y, delta):
+    ''' Local extrema of y that stand out from their neighbouring extrema
+    by more than delta (peak-valley detection). Wiggles smaller than delta
+    are skipped. Returns the indices in ascending order, alternating
+    between maxima and minima
+    '''
+    ext = []
+    hi = lo = 0
+    look = 0    # 1: looking for a maximum, -1: for a minimum, 0: either
+    for k in range(1, len(y)):
+        if y[k] > y[hi]:
+            hi = k
+        else:
+            pass
+        if y[k] < y[lo]:
+            lo = k
+        else:
+            pass
+        if look >= 0 and y[k] < y[hi] - delta:
+            ext.append(hi)
+            lo = k
+            look = -1
+        elif look <= 0 and y[k] > y[lo] + delta:
+            ext.append(lo)
+            hi = k
+            look = 1
+        else:
+            pass
+    return np.array(ext, dtype=int)
+
+
+def _profile_shape(ftype, der):
+    ''' Shape of the unit profile (mu=0, width=1, A=1), used to scale guesses.
+    Paired profiles are those whose strongest extrema are a pair of lobes
+    around the center: odd derivatives, and the 4th derivative of the
+    Lorentzian, whose side lobes are much stronger than its central one.
+
+    Returns:
+    center -- profile value at the center, or the distance between the
+              pair of lobes (paired)
+    lobe -- half width at half maximum of the central lobe, or the value
+            of the left lobe of the pair (paired)
+    reach -- distance from the center to the last lobe above 5% of the
+             strongest one
+    paired -- bool
+    '''
+    x = np.linspace(-10, 10, 20001)
+    y = Function(ftype, der, 1).get_func()(x, 0, 1, 1)
+    ext = np.nonzero(np.diff(np.sign(np.diff(y))))[0] + 1
+    reach = np.max(np.abs(x[ext[np.abs(y[ext]) > 0.05*np.abs(y).max()]]))
+    c = len(x)//2
+    # the pair is the extrema closest to the center
+    left = ext[x[ext] < 0][-1] if der else c
+    right = ext[x[ext] > 0][0] if der else c
+    if der % 2 or abs(y[left]) > abs(y[c]):
+        return x[right] - x[left], y[left], reach, True
+    else:
+        half = np.nonzero(np.abs(y[c:]) < np.abs(y[c])/2)[0][0]
+        return y[c], x[c+half], max(reach, x[c+half]), False
+
+
+def guess_init(xdata, ydata, ftype, der, peak, smooth=None):
+    ''' Guess the initial parameters (mu, width, A) of the peaks.
+    The spectrum is smoothed and its linear baseline removed. Peak centers
+    are the strongest extrema for even derivatives, and the centers between
+    the strongest pairs of lobes for paired profiles (see _profile_shape).
+    Widths and intensities are scaled from the unit profile of
+    Function(ftype, der, 1). Extrema and half maximum crossings are
+    interpolated to sub-sample precision.
+
+    Arguments:
+    xdata -- x data vector, evenly spaced
+    ydata -- y data vector
+    ftype -- function type, 0 Gaussian, 1 Lorentzian
+    der -- order of derivative
+    peak -- number of peaks
+
+    Keyword Arguments:
+    smooth -- boxcar smooth window. Default 3. Noise wiggles are skipped by
+              the extrema search, and a wider window blurs narrow lines
+
+    Returns: parameter initial guess vector, sorted by mu
+    '''
+    n = len(ydata)
+    if smooth is None:
+        smooth = 3
+    else:
+        pass
+    ys = np.convolve(ydata, np.ones(smooth)/smooth, 'same')
+    idx = np.arange(n)
+    ys -= np.polyval(np.polyfit(idx, ys, 1), idx)
+    # drop the edges distorted by the smooth
+    edge = smooth//2 + 1
+    # local extrema of the smoothed spectrum, skipping noise wiggles.
+    # The noise is estimated from the point to point differences
+    noise = np.median(np.abs(np.diff(ydata))) * 1.4826/np.sqrt(2*smooth)
+    ext = _extrema(ys, 4*noise)
+    ext = ext[(ext >= edge) & (ext < n-edge)]
+    # sub-sample position of the extrema, from the parabola through 3 points
+    curv = ys[ext-1] - 2*ys[ext] + ys[ext+1]
+    curv[curv == 0] = np.inf
+    xext = ext + 0.5*(ys[ext-1] - ys[ext+1])/curv
+    step = (xdata[-1] - xdata[0])/(n - 1)
+
+    center, lobe, reach, paired = _profile_shape(ftype, der)
+    if paired:
+        if der % 2:
+            # pairs of adjacent lobes of opposite sign
+            left, right = np.arange(len(ext)-1), np.arange(1, len(ext))
+            pair = np.sign(ys[ext[left]]) != np.sign(ys[ext[right]])
+        else:
+            # pairs of lobes of the same sign around the central lobe. The
+            # central lobe is narrow, and often smoothed to a shallow dent
+            left, right = np.arange(len(ext)-2), np.arange(2, len(ext))
+            pair = np.sign(ys[ext[left]]) == np.sign(ys[ext[right]])
+        left, right = left[pair], right[pair]
+        yl, yr = ys[ext[left]], ys[ext[right]]
+        # width from the lobe distance, A from the lobe values
+        width = (xext[right] - xext[left])/center
+        if der % 2:
+            strength = (yl - yr)/(2*lobe)
+            # zero crossing between the lobes
+            pos = xext[left] + yl/(yl - yr)*(xext[right] - xext[left])
+        else:
+            strength = (yl + yr)/(2*lobe)
+            pos = (xext[left] + xext[right])/2
+        amp = strength * (width*step)**(der+1)
+        strength = np.abs(strength)
+    else:
+        # walk down the central lobe to half maximum, and interpolate
+        # the crossing between the samples
+        half = np.abs(ys[ext])/2
+        hw = np.ones(len(ext))
+        for i, k in enumerate(ext):
+            below = np.nonzero(np.abs(ys[k:]) < half[i])[0]
+            if len(below):
+                j = k + below[0]
+                y0, y1 = abs(ys[j-1]), abs(ys[j])
+                hw[i] = j - 1 + (y0 - half[i])/(y0 - y1) - xext[i]
+            else:
+                pass
+        width = np.maximum(hw, 0.5)/lobe
+        amp = ys[ext]/center * (width*step)**(der+1)
+        strength = np.abs(ys[ext])
+        pos = xext
+
+    # strongest candidates first. Lines share the sign of the strongest one,
+    # and candidates within the lobes of a chosen line are its side lobes
+    order = np.argsort(strength)[::-1]
+    if len(order):
+        order = np.concatenate((order[np.sign(amp[order]) == np.sign(amp[order[0]])],
+                                order[np.sign(amp[order]) != np.sign(amp[order[0]])]))
+    else:
+        pass
+    chosen = []
+    for i in order:
+        if all(abs(pos[i] - pos[j]) > (reach+1)*max(width[i], width[j]) for j in chosen):
+            chosen.append(i)
+        else:
+            pass
+        if len(chosen) == peak:
+            break
+        else:
+            pass
+
+    init = []
+    for i in chosen:
+        init.append([np.interp(pos[i], idx, xdata), abs(width[i]*step), amp[i]])
+    # not enough lines found: add weaker copies next to the strongest one
+    while len(init) < peak:
+        if init:
+            mu, w, a = init[0]
+            init.append([mu + w*len(init), w, a/2])
+        else:
+            init.append([np.median(xdata), abs(step)*smooth, 0])
+    init.sort()
+
+    return np.array(init, dtype=float).reshape(-1)
+
+
 def get_delm(testline):
     ''' Analyse delimiter in a line '''
     try:
@@ -286,12 +633,12 @@ def read_file(file_name, boxwin=1, rescale=1):
     try:        # Try to open the file
         with open(file_name, 'r') as testfile:
             testline = testfile.readline()
-            while not get_delm(testline):
+            # stop at the end of file
+            while testline and not get_delm(testline):
                 testline = testfile.readline()
                 hd += 1
-        try:
-            delm = get_delm(testline)
-        except AttributeError:
+        delm = get_delm(testline)
+        if not delm:
             fit_stat = 3   # error: unsupported file format
             return [], [], fit_stat
     except OSError:
@@ -319,7 +666,8 @@ def read_file(file_name, boxwin=1, rescale=1):
         ydata = ydata * rescale
     if boxwin > 1:
         ydata = box_smooth(ydata, boxwin)
-        xdata = xdata[boxwin/2:-boxwin/2]
+        # box_smooth drops boxwin-1 points at the edges
+        xdata = xdata[(boxwin-1)//2:len(xdata)-boxwin//2]
 
     return xdata, ydata, fit_stat
 
@@ -450,10 +798,10 @@ def fit_spectrum(f, xdata, ydata, init, deg, smooth_edge=False, THRESHOLD=1e-2):
 
         # Let's fit curve
         try:
-            popt, pcov = curve_fit(f.get_func(), xdata, ydata_db, init)
+            popt, pcov = curve_fit(f.get_func(), xdata, ydata_db, init, jac=f.get_jac())
         except (TypeError, ValueError, RuntimeError):
             stat = 1                   # error_1: fit failed
-            return [], [], 0, [], fit_stat
+            return [], [], 0, [], stat
 
         # update residual and initial vector
         residual = ydata_db - f.get_func()(xdata, *popt)
@@ -476,3 +824,95 @@ def fit_spectrum(f, xdata, ydata, init, deg, smooth_edge=False, THRESHOLD=1e-2):
         stat = 0       # fit successful
 
     return popt, uncertainty, noise, ppoly, stat
+
+
+def fit_spectrum_vp(f, xdata, ydata, init, deg, smooth_edge=False):
+    ''' Joint fit of the line-profile function and the polynomial baseline
+    by variable projection.
+
+    Only the line-profile parameters are nonlinear. For any of them, the
+    best baseline is a linear least squares solution, so the residual is
+    projected onto the complement of the polynomial basis and only the
+    line-profile parameters are optimized. The baseline is then solved once
+    from the optimized profile.
+
+    Arguments:
+    f -- fitted function
+    xdata -- x data vector
+    ydata -- y data vector
+    init -- parameter initial guess vector
+    deg -- orders of polynomial for the baseline fit
+
+    Keyword Arguments:
+    smooth_edge -- estimate noise on the smoothed baseline, see noise_db
+
+    Returns:
+    popt -- optimized parameter vector
+    uncertainty -- uncertainty of popt followed by that of ppoly, from the
+                   joint covariance of line-profile and baseline parameters
+    noise -- noise level
+    ppoly -- coefficient vector of baseline polynomial
+    fit_stat -- tracker of fit status
+    '''
+
+    xshift = xdata - np.median(xdata)
+    try:
+        # orthonormal basis of the baseline polynomials
+        basis = np.vander(xshift, deg+1)
+        q, r = np.linalg.qr(basis)
+    except (TypeError, ValueError, np.linalg.LinAlgError):
+        stat = 4           # error: baseline fit failed
+        return [], [], 0, [], stat
+
+    func = f.get_func()
+    jac = f.get_jac()
+
+    def project(a):
+        # remove the baseline component of a (along axis 0)
+        return a - q.dot(q.T.dot(a))
+
+    def residual(p):
+        return project(ydata - func(xdata, *p))
+
+    def residual_jac(p):
+        # the basis does not depend on p, so the projected jacobian is exact
+        return -project(jac(xdata, *p))
+
+    try:
+        res = least_squares(residual, init, jac=residual_jac, method='lm', x_scale='jac')
+    except (TypeError, ValueError, np.linalg.LinAlgError):
+        stat = 1           # error: fit failed
+        return [], [], 0, [], stat
+    if res.status > 0:
+        pass
+    else:
+        stat = 1           # error: fit failed
+        return [], [], 0, [], stat
+
+    popt = res.x
+    ydata_fit = ydata - func(xdata, *popt)
+    ppoly = np.linalg.solve(r, q.T.dot(ydata_fit))
+    residual = ydata_fit - np.polyval(ppoly, xshift)
+
+    # joint covariance of (popt, ppoly), scaled by the reduced chi square
+    jac_all = np.column_stack((jac(xdata, *popt), basis))
+    dof = len(ydata) - jac_all.shape[1]
+    try:
+        pcov = np.linalg.inv(jac_all.T.dot(jac_all)) * np.sum(residual**2) / dof
+    except np.linalg.LinAlgError:
+        pcov = np.full((jac_all.shape[1], jac_all.shape[1]), np.inf)
+
+    if smooth_edge:
+        noise, baseline = noise_db(xdata, residual, base(xdata, popt, f))
+    else:
+        noise = np.std(residual, dtype=np.float64)
+
+    # catch the case when fit fails and pcov is infinity
+    if dof <= 0 or np.any(np.isinf(pcov)) or np.any(np.diag(pcov) < 0):
+        uncertainty = []
+        stat = 1       # fit failed
+    else:
+        uncertainty = np.sqrt(np.diag(pcov))
+        stat = 0       # fit successful
+
+    return popt, uncertainty, noise, ppoly, stat